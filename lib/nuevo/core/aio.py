@@ -0,0 +1,195 @@
+"""
+Asyncio versions of the Vertex and Edge containers and proxies, for engines
+whose operations are coroutines.
+
+    g = AsyncGraph(engine)
+    v = await g.vertices.get(id)
+    async for e in v.outE():
+        w = await e.inV
+"""
+
+from functools import partial
+
+from nuevo.core.elements import Element, Vertex, Edge, VertexProxy, EdgeProxy
+from nuevo.core.indices import Index, IndexProxy
+from nuevo.core.graph import Graph
+
+class AsyncElements(object):
+    """
+    Elements returned by an engine coroutine, which is only created by
+    calling load when they are awaited or iterated. Iterate them with async
+    for, or await them to get a list.
+    """
+
+    def __init__(self, engine, load, cls):
+        self._engine = engine
+        self._load_contents = load
+        self._cls = cls
+
+    async def _load(self):
+        contents = await self._load_contents()
+        return [ self._cls(self._engine, content) for content in contents ]
+
+    def __await__(self):
+        return self._load().__await__()
+
+    async def __aiter__(self):
+        for element in await self._load():
+            yield element
+
+class AsyncElement(object):
+    """Mixin for elements whose save must be awaited."""
+
+    __slots__ = ()
+
+    async def save(self):
+        if not self._dirty:
+            return
+        changed, removed = self._delta()
+        if changed or removed:
+            await self._engine.save_properties(self, changed, removed)
+        self._dirty = None
+
+class AsyncVertex(AsyncElement, Vertex):
+    """A Vertex whose traversal methods are asynchronous."""
+
+    __slots__ = ()
+
+    def outE(self, *labels):
+        return AsyncElements(self._engine, partial(self._engine.out_edges, self, labels), AsyncEdge)
+
+    def inE(self, *labels):
+        return AsyncElements(self._engine, partial(self._engine.in_edges, self, labels), AsyncEdge)
+
+    def bothE(self, *labels):
+        return AsyncElements(self._engine, partial(self._engine.both_edges, self, labels), AsyncEdge)
+
+    def outV(self, *labels):
+        return AsyncElements(self._engine, partial(self._engine.out_vertices, self, labels), AsyncVertex)
+
+    def inV(self, *labels):
+        return AsyncElements(self._engine, partial(self._engine.in_vertices, self, labels), AsyncVertex)
+
+    def bothV(self, *labels):
+        return AsyncElements(self._engine, partial(self._engine.both_vertices, self, labels), AsyncVertex)
+
+class AsyncEdge(AsyncElement, Edge):
+    """An Edge whose outV and inV must be awaited."""
+
+    __slots__ = ()
+
+    @property
+    def outV(self):
+        return self._vertex(self._engine.out_vertex)
+
+    @property
+    def inV(self):
+        return self._vertex(self._engine.in_vertex)
+
+    async def _vertex(self, load):
+        return AsyncVertex(self._engine, await load(self))
+
+def async_element_class(element_type):
+    if issubclass(element_type, Vertex):
+        return AsyncVertex
+    return AsyncEdge
+
+class AsyncVertexProxy(VertexProxy):
+    """A proxy for interacting with vertices asynchronously."""
+
+    async def create(self, **kwargs):
+        content = await self._engine.create_vertex(kwargs)
+        return AsyncVertex(self._engine, content)
+
+    async def create_many(self, items):
+        contents = await self._engine.create_vertices(items)
+        return [ AsyncVertex(self._engine, content) for content in contents ]
+
+    async def get(self, id):
+        content = await self._engine.get_vertex(id)
+        return AsyncVertex(self._engine, content)
+
+    async def update(self, _vertex, **kwargs):
+        result = await self._engine.update_vertex(_vertex, kwargs)
+        if isinstance(_vertex, Element):
+            _vertex._dirty = None
+        return result
+
+    async def delete(self, _vertex):
+        return await self._engine.delete_vertex(_vertex)
+
+class AsyncEdgeProxy(EdgeProxy):
+    """A proxy for interacting with edges asynchronously."""
+
+    async def create(self, _outV, _label, _inV, **kwargs):
+        self._check(_outV, _label, _inV)
+        content = await self._engine.create_edge(_outV, _label, _inV, kwargs)
+        return AsyncEdge(self._engine, content)
+
+    async def create_many(self, items):
+        def checked(items):
+            for _outV, _label, _inV, data in items:
+                self._check(_outV, _label, _inV)
+                yield _outV, _label, _inV, data or {}
+
+        contents = await self._engine.create_edges(checked(items))
+        return [ AsyncEdge(self._engine, content) for content in contents ]
+
+    async def get(self, id):
+        content = await self._engine.get_edge(id)
+        return AsyncEdge(self._engine, content)
+
+    async def update(self, _edge, **kwargs):
+        result = await self._engine.update_edge(_edge, kwargs)
+        if isinstance(_edge, Element):
+            _edge._dirty = None
+        return result
+
+    async def delete(self, _edge):
+        return await self._engine.delete_edge(_edge)
+
+class AsyncIndex(Index):
+    """An Index whose operations are asynchronous."""
+
+    async def put(self, element, key, value):
+        return await self._engine.index_put(self, element, key, value)
+
+    async def put_unique(self, element, key, value):
+        return await self._engine.index_put_unique(self, element, key, value)
+
+    async def remove(self, element, key=None, value=None):
+        await self._engine.index_remove(self, element, key, value)
+
+    def lookup(self, key, value):
+        return AsyncElements(self._engine, partial(self._engine.index_lookup, self, key, value),
+                             async_element_class(self.element_type))
+
+    def query(self, query):
+        return AsyncElements(self._engine, partial(self._engine.index_query, self, query),
+                             async_element_class(self.element_type))
+
+class AsyncIndexProxy(IndexProxy):
+    """Index proxy to create and retrieve indices asynchronously."""
+
+    async def create(self, name, element_type, **config):
+        resp = await self._engine.index_create(name, element_type, config)
+        return AsyncIndex(self._engine, resp, name, element_type)
+
+    async def get(self, name, element_type):
+        resp = await self._engine.index_get(name, element_type)
+        return AsyncIndex(self._engine, resp, name, element_type)
+
+    async def get_create(self, name, element_type, **config):
+        resp = await self._engine.index_get_create(name, element_type, config)
+        return AsyncIndex(self._engine, resp, name, element_type)
+
+    async def delete(self, index, element_type=None):
+        await self._engine.index_delete(index, element_type)
+
+class AsyncGraph(Graph):
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._vertices = AsyncVertexProxy(engine)
+        self._edges = AsyncEdgeProxy(engine)
+        self._indices = AsyncIndexProxy(engine)
@@ -0,0 +1,78 @@
+"""
+Identity map of element contents, with LRU and TTL eviction.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+class ElementCache(object):
+    """
+    Keeps the content of the last used elements by element type and id, so
+    repeated reads of an element return the same content object.
+
+    At most size entries are kept, evicting the least recently used one, and
+    entries older than ttl seconds are dropped. A size of 0 disables it.
+    It can be shared between threads.
+    """
+
+    def __init__(self, size=1000, ttl=None, clock=time.time):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, kind, id, valid=None):
+        """
+        Return the content cached for the element, or None. Contents for
+        which valid(content) is false are evicted and count as a miss.
+        """
+        key = (kind, id)
+        with self._lock:
+            try:
+                content, expires = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            if (expires is not None and expires < self.clock()) \
+                    or (valid is not None and not valid(content)):
+                self.misses += 1
+                return None
+            self._entries[key] = (content, expires)
+            self.hits += 1
+            return content
+
+    def put(self, kind, id, content):
+        if not self.size:
+            return
+        key = (kind, id)
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (content, expires)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def peek(self, kind, id):
+        """Return the content cached for the element without touching it."""
+        with self._lock:
+            entry = self._entries.get((kind, id))
+        return entry[0] if entry is not None else None
+
+    def evict(self, kind, id):
+        with self._lock:
+            self._entries.pop((kind, id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    size=len(self._entries), max_size=self.size)
+
+    def __len__(self):
+        return len(self._entries)
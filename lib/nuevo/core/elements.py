@@ -3,22 +3,85 @@ Vertex and Edge container classes and proxies.
 """
 
 class Element(object):
-    """This is an abstract base class for Vertex and Edge"""
+    """
+    This is an abstract base class for Vertex and Edge.
+    
+    Elements are equal, and hash the same, when they have the same id and
+    kind in the same engine. Elements whose content is a future are only
+    equal to elements sharing that content, and can't be hashed: their hash
+    would change once the future is materialized.
+    """
+    
+    __slots__ = ('_engine', '_content', '_dirty')
+    
+    _kind = None
     
     def __init__(self, engine, content, **kwargs):
         self._engine = engine
         self._content = content
+        # whether each key changed since the last save was stored on the
+        # server before the change, None until there is one
+        self._dirty = None
         super(Element, self).__init__(**kwargs)
     
     @property
     def id(self):
         return self._content.id
     
+    @property
+    def dirty(self):
+        """The keys of the properties changed or removed since the last save."""
+        return frozenset(self._dirty or ())
+    
+    def save(self):
+        """
+        Persist the properties changed or removed since the element was
+        loaded or last saved. Saves made inside a transaction are sent
+        together in its batch.
+        """
+        if not self._dirty:
+            return
+        changed, removed = self._delta()
+        if changed or removed:
+            self._engine.save_properties(self, changed, removed)
+        self._dirty = None
+    
+    def _delta(self):
+        """
+        Return the properties to set and the keys to delete on save. Only
+        the keys that were stored are deleted, not those added and removed
+        again since.
+        """
+        data = self._content.data
+        changed = dict( (key, data[key]) for key in self._dirty if key in data )
+        removed = [ key for key, stored in self._dirty.items() if stored and key not in data ]
+        return changed, removed
+    
     def __setitem__(self, key, value):
         """
-        Create and/or assign a property of an Element that will be persisted.
+        Create and/or assign a property of an Element that will be persisted
+        on save. Assigning None removes the property.
+        """
+        self._touch(key)
+        if value is None:
+            self._content.data.pop(key, None)
+        else:
+            self._content.data[key] = value
+    
+    def __delitem__(self, key):
         """
-        self._content.data[key] = value
+        Remove a property of an Element, persisted on save.
+        """
+        if key not in self._content.data:
+            raise KeyError(key)
+        self._touch(key)
+        del self._content.data[key]
+    
+    def _touch(self, key):
+        if self._dirty is None:
+            self._dirty = {}
+        if key not in self._dirty:
+            self._dirty[key] = key in self._content.data
     
     def __getitem__(self, key):
         """
@@ -36,53 +99,100 @@ class Element(object):
         return item in self._content.data
     
     def __eq__(self, other):
-        return isinstance(other, Element) \
-            and self.id == other.id \
-            and self._engine == other._engine \
-            and self._content == other._content
+        if not isinstance(other, Element) \
+                or self._kind != other._kind \
+                or self._engine != other._engine:
+            return False
+        if not (self._content.ready and other._content.ready):
+            return self._content is other._content
+        return self.id == other.id
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __hash__(self):
+        if not self._content.ready:
+            raise TypeError("unhashable %s: its content is still a future"
+                            % self.__class__.__name__)
+        return hash((self._kind, self.id))
     
     def __repr__(self):
         return u"<%s: %s>" % (self.__class__.__name__, self._content.uri)
     
 class Vertex(Element):
     """A container for Vertex elements returned by the DB."""     
+    
+    __slots__ = ()
+    
+    _kind = "vertex"
         
-    def outE(self, *labels):
-        """Return the outgoing edges of the vertex."""
-        return self._engine.out_edges(self, labels)
+    def outE(self, *labels, **options):
+        """
+        Return the outgoing edges of the vertex. With prefetch=True the
+        vertices at both ends of the edges are fetched at once. With
+        page_size, the edges are fetched lazily in pages of that size, for
+        vertices with too many edges to get them in a single response.
+        """
+        edges = self._engine.out_edges(self, labels, options.get('page_size'))
+        return self._prefetch(edges, **options)
+
+    def inE(self, *labels, **options):
+        """Return the incoming edges of the vertex. Accepts prefetch and page_size like outE."""
+        edges = self._engine.in_edges(self, labels, options.get('page_size'))
+        return self._prefetch(edges, **options)
 
-    def inE(self, *labels):
-        """Return the incoming edges of the vertex."""
-        return self._engine.in_edges(self, labels)
+    def bothE(self, *labels, **options):
+        """Return all incoming and outgoing edges of the vertex. Accepts prefetch and page_size like outE."""
+        edges = self._engine.both_edges(self, labels, options.get('page_size'))
+        return self._prefetch(edges, **options)
 
-    def bothE(self, *labels):
-        """Return all incoming and outgoing edges of the vertex."""
-        return self._engine.both_edges(self, labels)
+    def _prefetch(self, edges, prefetch=False, page_size=None):
+        if not prefetch:
+            return edges
+        if page_size and hasattr(edges, 'pages'):
+            # resolve the endpoints page by page, keeping the iteration lazy
+            return ( edge for page in edges.pages()
+                     for edge in self._engine.resolve_endpoints(page) )
+        return self._engine.resolve_endpoints(edges)
     
-    def outV(self, *labels):
-        """Return the out-adjacent vertices to the vertex."""
-        return self._engine.out_vertices(self, labels)
+    def outV(self, *labels, **options):
+        """Return the out-adjacent vertices to the vertex. Accepts page_size like outE."""
+        return self._engine.out_vertices(self, labels, options.get('page_size'))
 
-    def inV(self, *labels):
-        """Return the in-adjacent vertices of the vertex."""
-        return self._engine.in_vertices(self, labels)
+    def inV(self, *labels, **options):
+        """Return the in-adjacent vertices of the vertex. Accepts page_size like outE."""
+        return self._engine.in_vertices(self, labels, options.get('page_size'))
 
-    def bothV(self, *labels):
-        """Return all incoming- and outgoing-adjacent vertices of vertex."""
-        return self._engine.both_vertices(self, labels)
+    def bothV(self, *labels, **options):
+        """Return all incoming- and outgoing-adjacent vertices of vertex. Accepts page_size like outE."""
+        return self._engine.both_vertices(self, labels, options.get('page_size'))
 
 class Edge(Element):
     """A container for Edge elements returned by the resource."""
+    
+    # endpoints attached by engine.resolve_endpoints
+    __slots__ = ('_outV', '_inV')
+    
+    _kind = "edge"
+    
+    def __init__(self, engine, content, **kwargs):
+        self._outV = None
+        self._inV = None
+        super(Edge, self).__init__(engine, content, **kwargs)
 
     @property
     def outV(self):
         """Returns the outgoing Vertex of the edge."""
+        if self._outV is not None:
+            return self._outV
         content = self._engine.out_vertex(self)
         return Vertex(self._engine, content)
     
     @property
     def inV(self):
         """Returns the incoming Vertex of the edge."""
+        if self._inV is not None:
+            return self._inV
         content = self._engine.in_vertex(self)
         return Vertex(self._engine, content)
 
@@ -97,6 +207,14 @@ class VertexProxy(object):
         content = self._engine.create_vertex(kwargs)
         return Vertex(self._engine, content)
 
+    def create_many(self, items):
+        """
+        Adds a vertex for each dict of properties in items and returns them.
+        The items are streamed to the database in batches.
+        """
+        contents = self._engine.create_vertices(items)
+        return [ Vertex(self._engine, content) for content in contents ]
+
     def get(self, id):
         """Retrieves a vertex from the DB and returns it."""
         content = self._engine.get_vertex(id)
@@ -104,7 +222,10 @@ class VertexProxy(object):
 
     def update(self, _vertex, **kwargs):
         """Updates a vertex in the graph DB and returns it.""" 
-        return self._engine.update_vertex(_vertex, kwargs)
+        result = self._engine.update_vertex(_vertex, kwargs)
+        if isinstance(_vertex, Element):
+            _vertex._dirty = None
+        return result
     
     def delete(self, _vertex):
         """Deletes a vertex from the graph DB."""
@@ -118,13 +239,30 @@ class EdgeProxy(object):
 
     def create(self, _outV, _label, _inV, **kwargs):
         """Adds an edge to the database and returns it.""" 
+        self._check(_outV, _label, _inV)
+        
+        content = self._engine.create_edge(_outV, _label, _inV, kwargs)
+        return Edge(self._engine, content)
+
+    def create_many(self, items):
+        """
+        Adds an edge for each (outV, label, inV, properties) tuple in items
+        and returns them. The items are streamed to the database in batches,
+        and may refer to vertices created in the same transaction.
+        """
+        def checked(items):
+            for _outV, _label, _inV, data in items:
+                self._check(_outV, _label, _inV)
+                yield _outV, _label, _inV, data or {}
+        
+        contents = self._engine.create_edges(checked(items))
+        return [ Edge(self._engine, content) for content in contents ]
+
+    def _check(self, _outV, _label, _inV):
         if not _label or _inV is None or _outV is None:
             raise ValueError("Invalid argument value")
         if not isinstance(_label, str):
             raise TypeError("_label must be a string")
-        
-        content = self._engine.create_edge(_outV, _label, _inV, kwargs)
-        return Edge(self._engine, content)
 
     def get(self, id):
         """Retrieves an edge from the DB and returns it."""
@@ -133,7 +271,10 @@ class EdgeProxy(object):
         
     def update(self, _edge, **kwargs):
         """Updates an edge in the graph DB and returns it.""" 
-        return self._engine.update_edge(_edge, kwargs)
+        result = self._engine.update_edge(_edge, kwargs)
+        if isinstance(_edge, Element):
+            _edge._dirty = None
+        return result
     
     def delete(self, _edge):
         """Deletes a vertex from a graph DB and returns the response."""
@@ -1,40 +1,138 @@
-
 import re
-import pkg_resources
+import threading
+
+from nuevo.core.profile import Profile
 
 import logging
 log = logging.getLogger(__name__)
 
+ENGINE_URL = re.compile(r"(?P<engine>[a-zA-Z0-9]+)(\+(?P<option>[a-zA-Z0-9]+))?:(?P<rest>.*)")
+
+def _entry_points(name=None):
+    """The nuevo.engines entry points, or only those called name."""
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # pkg_resources is slow to import, only use it when there is no
+        # importlib.metadata
+        import pkg_resources
+        return list(pkg_resources.iter_entry_points('nuevo.engines', name))
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        eps = eps.select(group='nuevo.engines')
+    else:
+        eps = eps.get('nuevo.engines', ())
+    return [ ep for ep in eps if name is None or ep.name == name ]
+
+def _load(ep):
+    try:
+        eng_class = ep.load()()
+        log.debug("Loaded engine module %s", ep.name)
+        return eng_class
+    except Exception as ex:
+        log.error("Could not import engine %s: %s", ep.name, ex)
+        raise ex
+
+class EngineRegistry(object):
+    """
+    Engine classes by name, loaded from the nuevo.engines entry points the
+    first time each one is asked for, and engine URLs already parsed.
+    """
+    
+    max_urls = 1024
+    
+    def __init__(self):
+        self._engines = {}
+        self._urls = {}
+        self._lock = threading.Lock()
+    
+    def get(self, name):
+        try:
+            return self._engines[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._engines:
+                eps = _entry_points(name)
+                if not eps:
+                    raise KeyError("No %s engine installed" % name)
+                self._engines[name] = _load(eps[0])
+            return self._engines[name]
+    
+    def parse(self, url):
+        """Return the engine name, option and rest of an engine URL."""
+        try:
+            return self._urls[url]
+        except KeyError:
+            pass
+        m = ENGINE_URL.match(url)
+        if m is None:
+            raise ValueError("Invalid engine URL %r" % url)
+        parsed = m.group('engine'), m.group('option'), m.group('rest')
+        if len(self._urls) >= self.max_urls:
+            self._urls.clear()
+        self._urls[url] = parsed
+        return parsed
+    
+    def clear(self):
+        with self._lock:
+            self._engines.clear()
+            self._urls.clear()
+
+registry = EngineRegistry()
 
 def get_engines():
+    """Load every installed engine, returning them by name."""
     engines = {}
-    for ep in pkg_resources.iter_entry_points('nuevo.engines'):
-        try:
-            eng_class = ep.load()()
-            engines[ep.name] = eng_class
-            logging.debug("Loaded engine module %s", ep.name)
-        except Exception as ex:
-            logging.error("Could not import engine %s: %s", ep.name, ex)
-            raise ex
+    for ep in _entry_points():
+        engines[ep.name] = registry.get(ep.name)
     return engines
 
 def create_engine(url):
-    engines = get_engines()
-    
-    m = re.match( r"(?P<engine>[a-zA-Z0-9]+)(\+(?P<option>[a-zA-Z0-9]+))?:(?P<rest>.*)", url)
-        
-    engine, option, rest = m.group('engine'), m.group('option'), m.group('rest')
-    
-    eng_class = engines[engine]
+    engine, option, rest = registry.parse(url)
+    eng_class = registry.get(engine)
     return eng_class(option, rest)
 
 class Engine(object):
     
     name = None
     
-    def query(self, language, q):
+    def query(self, language, q, params=None, **options):
+        """
+        Run the query q, written in language, with the given parameters.
+        Engines implement each language they support in a query_<language>
+        method.
+        """
         try:
-            query_fun = getattr(self, 'query_%s')
-        except AttributeError:
+            query_fun = getattr(self, 'query_%s' % language)
+        except (AttributeError, NotImplementedError):
             raise Exception("%s query language not supported by %s engine." % (language, self.name) )
-        return query_fun(q)
\ No newline at end of file
+        return query_fun(q, params, **options)
+    
+    def stats(self, reset=False):
+        """
+        Return a dict with the metrics the engine collects. With reset, the
+        counters start again from zero.
+        """
+        return {}
+    
+    def profile(self, slowest=10):
+        """
+        Return a context manager that measures how the time of the block
+        splits between building batches, encoding commands, waiting for the
+        network, decoding responses and materializing futures, and keeps
+        the slowest requests. It covers everything the current thread does
+        in the block.
+        """
+        return Profile(slowest)
+    
+    def prepare(self, language, q, names=(), **options):
+        """
+        Register the query q, written in language, with the names of its
+        parameters. Returns a callable that runs it with their values.
+        """
+        try:
+            prepare_fun = getattr(self, 'prepare_%s' % language)
+        except (AttributeError, NotImplementedError):
+            raise Exception("%s prepared queries not supported by %s engine." % (language, self.name) )
+        return prepare_fun(q, names, **options)
\ No newline at end of file
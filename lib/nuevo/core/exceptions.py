@@ -1,3 +1,4 @@
+import sys
 
 class NuevoException(Exception):
     pass
@@ -6,4 +7,13 @@ class NotFoundException(NuevoException):
     pass
 
 class ExistsException(NuevoException):
-    pass
\ No newline at end of file
+    pass
+
+if sys.version_info[0] < 3:
+    exec("""def reraise(type, value, traceback):
+    raise type, value, traceback
+""")
+else:
+    def reraise(type, value, traceback):
+        """Raise value again with the traceback it was caught with."""
+        raise value.with_traceback(traceback)
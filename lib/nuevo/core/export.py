@@ -0,0 +1,187 @@
+"""
+Streaming export of a graph, or of the part of it reachable from some start
+vertices, to JSONL, and its restore into any engine.
+
+Each line is a vertex or an edge record, and every edge comes after both of
+its vertices, so a dump can be restored in a single pass:
+
+    {"vertex": 3, "data": {"name": "alice"}}
+    {"edge": 7, "out": 3, "label": "knows", "in": 4, "data": {}}
+
+    snapshot(engine, "staging.jsonl.gz")
+    restore(test_engine, "staging.jsonl.gz")
+
+Elements are read in pages of page_size, each page in one request, and
+written back in chunks of chunk_size, each chunk in one transaction.
+"""
+
+import gzip
+import json
+import time
+
+from nuevo.core.elements import Element, Vertex
+from nuevo.core.loader import KeyMap
+
+class ExportStats(object):
+    """Counts of the elements dumped or restored, and the time it took."""
+
+    def __init__(self):
+        self.vertices = 0
+        self.edges = 0
+        self.start = time.time()
+        self.elapsed = 0.0
+
+    def __str__(self):
+        return "%d vertices, %d edges in %.1fs" % (self.vertices, self.edges, self.elapsed)
+
+def vertex_record(content):
+    return {"vertex": content.id, "data": content.data}
+
+def edge_record(content):
+    return {"edge": content.id, "out": content.out_id, "label": content.label,
+            "in": content.in_id, "data": content.data}
+
+def _write(out, record):
+    # text on Python 2 as well, json.dumps gives bytes there
+    out.write(u"%s\n" % json.dumps(record, separators=(',', ':')))
+
+def _pages(scan, page_size):
+    after = None
+    while True:
+        page = scan(after, page_size)
+        for content in page:
+            yield content
+        if len(page) < page_size:
+            return
+        after = page[-1].id
+
+def dump(engine, out, start=None, depth=None, labels=(), page_size=1000):
+    """
+    Write the records of the graph to the text file out. With start, a list
+    of vertices or ids, only the vertices reachable from them through edges
+    with the given labels, in either direction and up to depth edges away,
+    are written, along with the edges between them.
+
+    A whole graph is read with scan_vertices and scan_edges, a page of
+    page_size elements at a time. On Neo4j every page reads all the nodes,
+    or relationships, of the server to keep the ones after the previous
+    page: dumping n elements costs about n * n / page_size reads, so use
+    large pages for large graphs, or dump from start vertices.
+    """
+    stats = ExportStats()
+    if start is None:
+        for content in _pages(engine.scan_vertices, page_size):
+            _write(out, vertex_record(content))
+            stats.vertices += 1
+        for content in _pages(engine.scan_edges, page_size):
+            _write(out, edge_record(content))
+            stats.edges += 1
+    else:
+        _dump_reachable(engine, out, start, depth, labels, page_size, stats)
+    stats.elapsed = time.time() - stats.start
+    return stats
+
+def _dump_reachable(engine, out, start, depth, labels, page_size, stats):
+    ids = [ v.id if isinstance(v, Element) else v for v in start ]
+    frontier = sorted(engine.get_vertices(ids).items())
+    visited = set(ids)
+    edges = set()
+    for id, content in frontier:
+        _write(out, vertex_record(content))
+        stats.vertices += 1
+
+    level = 0
+    while frontier:
+        last = depth is not None and level >= depth
+        next_frontier = []
+        for i in range(0, len(frontier), page_size):
+            page = [ id for id, _ in frontier[i:i + page_size] ]
+            adjacent = [ edge for page_edges in engine.adjacent_edges(page, labels, "all")
+                         for edge in page_edges if edge.id not in edges ]
+
+            if not last:
+                new = set()
+                for edge in adjacent:
+                    for id in (edge.out_id, edge.in_id):
+                        if id not in visited:
+                            new.add(id)
+                found = sorted(engine.get_vertices(new).items()) if new else []
+                for id, content in found:
+                    visited.add(id)
+                    _write(out, vertex_record(content))
+                    stats.vertices += 1
+                next_frontier.extend(found)
+
+            for edge in adjacent:
+                if edge.id not in edges and edge.out_id in visited and edge.in_id in visited:
+                    edges.add(edge.id)
+                    _write(out, edge_record(edge))
+                    stats.edges += 1
+        frontier = next_frontier
+        level += 1
+
+def load(engine, records, chunk_size=1000, max_keys=1000000, spill_dir=None):
+    """
+    Create the elements of dump records in engine, one transaction per chunk
+    of records. The elements get new ids, the edges are linked to the new
+    vertices, and edges of vertices that are not in the records are skipped.
+    """
+    stats = ExportStats()
+    keys = KeyMap(max_keys, spill_dir)
+    try:
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                _load_chunk(engine, chunk, keys, stats)
+                chunk = []
+        if chunk:
+            _load_chunk(engine, chunk, keys, stats)
+    finally:
+        keys.close()
+    stats.elapsed = time.time() - stats.start
+    return stats
+
+def _load_chunk(engine, chunk, keys, stats):
+    created = {}
+    with engine.transaction():
+        for record in chunk:
+            if "vertex" in record:
+                created[record["vertex"]] = engine.create_vertex(record.get("data") or {})
+                stats.vertices += 1
+                continue
+            outv = _endpoint(engine, record["out"], created, keys)
+            inv = _endpoint(engine, record["in"], created, keys)
+            if outv is None or inv is None:
+                continue
+            engine.create_edge(outv, str(record["label"]), inv, record.get("data") or {})
+            stats.edges += 1
+    for id, content in created.items():
+        keys[id] = content.id
+
+def _endpoint(engine, id, created, keys):
+    # a vertex of the same chunk is still a future of the transaction
+    if id in created:
+        return Vertex(engine, created[id])
+    return keys.get(id)
+
+def read_dump(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t") if str is not bytes else gzip.open(path, mode)
+    return open(path, mode)
+
+def snapshot(engine, path, **kwargs):
+    """Dump the graph to a file, gzipped if its name ends in .gz."""
+    with _open(path, "w") as out:
+        return dump(engine, out, **kwargs)
+
+def restore(engine, path, **kwargs):
+    """Load the snapshot in the file at path into engine."""
+    with _open(path, "r") as f:
+        return load(engine, read_dump(f), **kwargs)
@@ -0,0 +1,349 @@
+"""
+Bulk loading of vertices and edges from JSONL or CSV files.
+
+Vertex records are dicts of properties, with the external key of the vertex
+in the key field. Edge records hold the keys of their vertices in the out
+and in fields, the label in the label field, and the rest are properties:
+
+    {"id": "alice", "name": "Alice"}
+    {"out": "alice", "label": "knows", "in": "bob", "since": 2010}
+
+    loader = BulkLoader(engine, index="people")
+    loader.load_vertices(read_records("people.jsonl"))
+    loader.load_edges(read_records("knows.csv"))
+
+The records are streamed in chunks, each chunk written in one transaction.
+A reader thread keeps at most queue_size chunks ahead of the writers, so
+memory stays bounded, and the external keys of the vertices are mapped to
+their ids in a KeyMap that spills to disk once it grows over max_keys.
+
+From the command line:
+
+    nuevo-load neo4j:http://localhost:7474/db/data/ -v people.jsonl -e knows.csv
+"""
+
+from __future__ import print_function
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from nuevo.core.engine import create_engine
+from nuevo.core.elements import Vertex
+from nuevo.core.indices import IndexProxy
+from nuevo.core.exceptions import reraise
+
+def read_jsonl(path):
+    """Yield the records of a file with a JSON object per line."""
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def read_csv(path):
+    """Yield the rows of a CSV file with a header as dicts. Empty cells are skipped."""
+    if sys.version_info[0] < 3:
+        f = open(path, 'rb')
+    else:
+        f = open(path, newline='')
+    with f:
+        for row in csv.DictReader(f):
+            yield dict( (k, v) for k, v in row.items() if v != '' )
+
+READERS = {
+    'jsonl': read_jsonl,
+    'json': read_jsonl,
+    'csv': read_csv,
+}
+
+def read_records(path, format=None):
+    """Yield the records of a file, in format or the one of its extension."""
+    if format is None:
+        format = os.path.splitext(path)[1].lstrip('.').lower()
+    try:
+        reader = READERS[format]
+    except KeyError:
+        raise ValueError("Unknown record format %r" % format)
+    return reader(path)
+
+class KeyMap(object):
+    """
+    Map of the external keys of the loaded vertices to their ids. Keys are
+    compared as text. Up to max_keys entries are kept in memory, and then
+    moved to an SQLite file in directory, removed when the map is closed.
+    It can be shared between threads.
+    """
+
+    def __init__(self, max_keys=1000000, directory=None):
+        self.max_keys = max_keys
+        self.directory = directory
+        self._keys = {}
+        self._db = None
+        self._path = None
+        self._lock = threading.Lock()
+
+    def __setitem__(self, key, id):
+        with self._lock:
+            self._keys[self._text(key)] = id
+            if len(self._keys) >= self.max_keys:
+                self._spill()
+
+    def get(self, key, default=None):
+        key = self._text(key)
+        with self._lock:
+            id = self._keys.get(key)
+            if id is None and self._db is not None:
+                row = self._db.execute("SELECT id FROM keys WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    id = row[0]
+        return default if id is None else id
+
+    def __getitem__(self, key):
+        id = self.get(key)
+        if id is None:
+            raise KeyError(key)
+        return id
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        with self._lock:
+            spilled = self._db.execute("SELECT count(*) FROM keys").fetchone()[0] if self._db else 0
+            return len(self._keys) + spilled
+
+    @property
+    def spilled(self):
+        return self._db is not None
+
+    def close(self):
+        with self._lock:
+            self._keys = {}
+            if self._db is not None:
+                self._db.close()
+                os.remove(self._path)
+                self._db = self._path = None
+
+    def _spill(self):
+        if self._db is None:
+            fd, self._path = tempfile.mkstemp(prefix="nuevo-keys-", suffix=".db", dir=self.directory)
+            os.close(fd)
+            self._db = sqlite3.connect(self._path, check_same_thread=False)
+            self._db.execute("PRAGMA synchronous = OFF")
+            self._db.execute("PRAGMA journal_mode = OFF")
+            self._db.execute("CREATE TABLE keys (key TEXT PRIMARY KEY, id INTEGER)")
+        self._db.executemany("INSERT OR REPLACE INTO keys VALUES (?, ?)", self._keys.items())
+        self._db.commit()
+        self._keys = {}
+
+    def _text(self, key):
+        return key if isinstance(key, type(u"")) else u"%s" % (key,)
+
+class LoadStats(object):
+    """Counts of the records loaded, and the time it took."""
+
+    def __init__(self):
+        self.vertices = 0
+        self.edges = 0
+        self.skipped = 0
+        self.start = time.time()
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        """Elements written per second."""
+        return (self.vertices + self.edges) / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return "%d vertices, %d edges, %d skipped in %.1fs (%.0f/s)" % (
+            self.vertices, self.edges, self.skipped, self.elapsed, self.rate)
+
+class BulkLoader(object):
+    """
+    Writes vertex and edge records to an engine in chunks of chunk_size, from
+    workers threads. With index, the vertices are put in the vertex index of
+    that name by their key. Edges whose vertices were not loaded are skipped,
+    or raise a KeyError when strict. progress(stats) is called after each
+    chunk.
+    """
+
+    def __init__(self, engine, key="id", out_key="out", in_key="in", label_key="label",
+                 index=None, chunk_size=1000, workers=1, queue_size=None,
+                 max_keys=1000000, spill_dir=None, strict=False, progress=None):
+        self.engine = engine
+        self.key = key
+        self.out_key = out_key
+        self.in_key = in_key
+        self.label_key = label_key
+        self.index = IndexProxy(engine).get_create(index, Vertex) if index else None
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.queue_size = queue_size or 2 * workers
+        self.keys = KeyMap(max_keys, spill_dir)
+        self.strict = strict
+        self.progress = progress
+        self.stats = LoadStats()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.keys.close()
+
+    def load_vertices(self, records):
+        self._run(records, self._write_vertices)
+        return self.stats
+
+    def load_edges(self, records):
+        self._run(records, self._write_edges)
+        return self.stats
+
+    def _write_vertices(self, chunk):
+        engine = self.engine
+        keyed = []
+        with engine.transaction():
+            for record in chunk:
+                content = engine.create_vertex(record)
+                if record.get(self.key) is not None:
+                    keyed.append((record[self.key], content))
+                    if self.index is not None:
+                        self.index.put(Vertex(engine, content), self.key, record[self.key])
+        for key, content in keyed:
+            self.keys[key] = content.id
+        with self._lock:
+            self.stats.vertices += len(chunk)
+
+    def _write_edges(self, chunk):
+        engine = self.engine
+        written = skipped = 0
+        with engine.transaction():
+            for record in chunk:
+                record = dict(record)
+                out_key = record.pop(self.out_key, None)
+                label = record.pop(self.label_key, None)
+                in_key = record.pop(self.in_key, None)
+                out_id = self.keys.get(out_key)
+                in_id = self.keys.get(in_key)
+                if out_id is None or in_id is None or not label:
+                    if self.strict:
+                        raise KeyError("Can't load edge %r -%s-> %r" % (out_key, label, in_key))
+                    skipped += 1
+                    continue
+                engine.create_edge(out_id, str(label), in_id, record)
+                written += 1
+        with self._lock:
+            self.stats.edges += written
+            self.stats.skipped += skipped
+
+    def _run(self, records, write):
+        """
+        Read the records in chunks on this thread, and write them from the
+        workers. Reading blocks while queue_size chunks are waiting.
+        """
+        chunks = queue.Queue(self.queue_size)
+        errors = []
+
+        def work():
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    return
+                if errors:
+                    continue
+                try:
+                    write(chunk)
+                except Exception:
+                    errors.append(sys.exc_info())
+                    continue
+                self._report()
+
+        threads = [ threading.Thread(target=work) for _ in range(self.workers) ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            chunk = []
+            for record in records:
+                if errors:
+                    break
+                chunk.append(record)
+                if len(chunk) >= self.chunk_size:
+                    chunks.put(chunk)
+                    chunk = []
+            if chunk and not errors:
+                chunks.put(chunk)
+        finally:
+            for thread in threads:
+                chunks.put(None)
+            for thread in threads:
+                thread.join()
+        self._report()
+        if errors:
+            reraise(*errors[0])
+
+    def _report(self):
+        with self._lock:
+            self.stats.elapsed = time.time() - self.stats.start
+            if self.progress is not None:
+                self.progress(self.stats)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="nuevo-load",
+                                     description="Bulk load vertices and edges into a graph.")
+    parser.add_argument("engine", help="engine URL, e.g. neo4j:http://localhost:7474/db/data/")
+    parser.add_argument("-v", "--vertices", action="append", default=[], metavar="FILE",
+                        help="vertex records file, .jsonl or .csv")
+    parser.add_argument("-e", "--edges", action="append", default=[], metavar="FILE",
+                        help="edge records file, .jsonl or .csv")
+    parser.add_argument("--format", choices=sorted(READERS), help="format of every file")
+    parser.add_argument("--key", default="id", help="vertex key field (default: id)")
+    parser.add_argument("--out-key", default="out", help="edge out vertex key field (default: out)")
+    parser.add_argument("--in-key", default="in", help="edge in vertex key field (default: in)")
+    parser.add_argument("--label-key", default="label", help="edge label field (default: label)")
+    parser.add_argument("--index", help="vertex index to put the vertices in by key")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="records per request")
+    parser.add_argument("--workers", type=int, default=1, help="writer threads")
+    parser.add_argument("--max-keys", type=int, default=1000000,
+                        help="keys kept in memory before spilling to disk")
+    parser.add_argument("--spill-dir", help="directory of the spilled keys file")
+    parser.add_argument("--strict", action="store_true",
+                        help="fail on edges of unknown vertices instead of skipping them")
+    parser.add_argument("-q", "--quiet", action="store_true", help="don't report progress")
+    args = parser.parse_args(argv)
+
+    def progress(stats):
+        print("\r%s" % stats, end="", file=sys.stderr)
+
+    engine = create_engine(args.engine)
+    with BulkLoader(engine, key=args.key, out_key=args.out_key, in_key=args.in_key,
+                    label_key=args.label_key, index=args.index,
+                    chunk_size=args.chunk_size, workers=args.workers,
+                    max_keys=args.max_keys, spill_dir=args.spill_dir, strict=args.strict,
+                    progress=None if args.quiet else progress) as loader:
+        for path in args.vertices:
+            loader.load_vertices(read_records(path, args.format))
+        for path in args.edges:
+            loader.load_edges(read_records(path, args.format))
+    if not args.quiet:
+        print(file=sys.stderr)
+    print(loader.stats)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
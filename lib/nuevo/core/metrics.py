@@ -0,0 +1,117 @@
+"""
+Counters and histograms of the requests made by an engine.
+"""
+
+from bisect import bisect_left
+import threading
+
+from nuevo.core import profile
+
+# seconds
+LATENCY_BOUNDS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# commands per request
+SIZE_BOUNDS = (1, 2, 5, 10, 50, 100, 500, 1000)
+
+class Histogram(object):
+    """
+    Count of the observed values falling in each bucket. counts[i] is the
+    number of values <= bounds[i] and > bounds[i - 1], and the last count is
+    for the values over every bound.
+    """
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        return dict(count=self.count, sum=self.sum,
+                    bounds=list(self.bounds), counts=list(self.counts))
+
+class Metrics(object):
+    """
+    Request metrics of an engine, by HTTP method and resource kind: request
+    count, bytes sent and received, errors, network latency and commands
+    sent in batches. Also the time spent encoding, on the network and
+    decoding, and the batch sizes.
+    It can be shared between threads.
+    """
+
+    PHASES = ("encode", "network", "decode")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self.requests = {}
+        self.latencies = {}
+        self.commands = {}
+        self.timings = dict( (phase, Histogram()) for phase in self.PHASES )
+        self.batch_sizes = Histogram(SIZE_BOUNDS)
+
+    def request(self, method, kind, request_bytes, response_bytes, status=None, error=False,
+                latency=None):
+        """
+        Count a request and its response, or its failure when error. latency
+        is the time until the response, when there was one.
+        """
+        with self._lock:
+            stats = self.requests.get((method, kind))
+            if stats is None:
+                stats = self.requests[(method, kind)] = dict(
+                    count=0, request_bytes=0, response_bytes=0, errors=0, statuses={})
+            stats['count'] += 1
+            stats['request_bytes'] += request_bytes
+            stats['response_bytes'] += response_bytes
+            if error:
+                stats['errors'] += 1
+            if status is not None:
+                stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            if latency is not None:
+                histogram = self.latencies.get((method, kind))
+                if histogram is None:
+                    histogram = self.latencies[(method, kind)] = Histogram()
+                histogram.observe(latency)
+
+    def command(self, method, kind):
+        """Count a command queued in a batch."""
+        with self._lock:
+            self.commands[(method, kind)] = self.commands.get((method, kind), 0) + 1
+
+    def timing(self, phase, seconds):
+        """Observe the time spent in phase, also reported to the open profiles."""
+        with self._lock:
+            self.timings[phase].observe(seconds)
+        profile.record(phase, seconds)
+
+    def batch(self, commands):
+        with self._lock:
+            self.batch_sizes.observe(commands)
+
+    def snapshot(self, reset=False):
+        """Return the metrics as plain dicts and lists, optionally resetting them."""
+        with self._lock:
+            snapshot = dict(
+                requests=dict( ("%s %s" % key, dict(stats, statuses=dict(stats['statuses'])))
+                               for key, stats in self.requests.items() ),
+                latencies=dict( ("%s %s" % key, histogram.snapshot())
+                                for key, histogram in self.latencies.items() ),
+                commands=dict( ("%s %s" % key, count) for key, count in self.commands.items() ),
+                timings=dict( (phase, histogram.snapshot())
+                              for phase, histogram in self.timings.items() ),
+                batch_sizes=self.batch_sizes.snapshot(),
+            )
+            if reset:
+                self._clear()
+        return snapshot
@@ -0,0 +1,96 @@
+"""
+Breakdown of where the time of a block of code goes, between building
+batches, encoding and sending commands, decoding their responses and
+materializing them:
+
+    with engine.profile() as p:
+        handle_request()
+    print(p)
+"""
+
+import heapq
+import threading
+import time
+
+PHASES = ("build", "encode", "network", "decode", "materialize")
+
+_local = threading.local()
+
+def active():
+    """The profiles open in the current thread, innermost last."""
+    return getattr(_local, 'stack', None)
+
+def record(phase, seconds):
+    for profile in active() or ():
+        profile.add(phase, seconds)
+
+def record_command(description, seconds):
+    for profile in active() or ():
+        profile.command(description, seconds)
+
+class Profile(object):
+    """
+    Time spent in each phase while the profile is open in this thread, and
+    the slowest requests. The time not spent in any phase is the time of
+    the application code itself.
+    """
+
+    def __init__(self, slowest=10):
+        self.slowest = slowest
+        self.phases = dict( (phase, [0.0, 0]) for phase in PHASES )
+        self.commands = []
+        self.total = None
+        self._start = None
+
+    def __enter__(self):
+        if active() is None:
+            _local.stack = []
+        _local.stack.append(self)
+        self._start = time.time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.total = time.time() - self._start
+        _local.stack.remove(self)
+
+    def add(self, phase, seconds):
+        entry = self.phases[phase]
+        entry[0] += seconds
+        entry[1] += 1
+
+    def command(self, description, seconds):
+        item = (seconds, description)
+        if len(self.commands) < self.slowest:
+            heapq.heappush(self.commands, item)
+        elif item > self.commands[0]:
+            heapq.heapreplace(self.commands, item)
+
+    def report(self):
+        """Return the breakdown as a dict."""
+        total = self.total if self.total is not None else time.time() - self._start
+        phases = dict( (phase, dict(time=spent, count=count))
+                       for phase, (spent, count) in self.phases.items() )
+        return dict(
+            total=total,
+            phases=phases,
+            application=max(total - sum(spent for spent, _ in self.phases.values()), 0.0),
+            slowest=[ dict(command=description, time=seconds)
+                      for seconds, description in sorted(self.commands, reverse=True) ],
+        )
+
+    def __str__(self):
+        report = self.report()
+        total = report['total'] or 1e-9
+        lines = ["%-12s %10s %6s %8s" % ("phase", "ms", "%", "count")]
+        for phase in PHASES:
+            entry = report['phases'][phase]
+            lines.append("%-12s %10.2f %6.1f %8d" % (phase, entry['time'] * 1000,
+                                                     entry['time'] * 100 / total, entry['count']))
+        lines.append("%-12s %10.2f %6.1f" % ("application", report['application'] * 1000,
+                                              report['application'] * 100 / total))
+        lines.append("%-12s %10.2f" % ("total", report['total'] * 1000))
+        if report['slowest']:
+            lines.append("slowest commands:")
+            for command in report['slowest']:
+                lines.append("  %10.2f ms  %s" % (command['time'] * 1000, command['command']))
+        return "\n".join(lines)
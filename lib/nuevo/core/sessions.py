@@ -1,45 +1,332 @@
-
 from pkgutil import walk_packages
 import inspect
 import logging
 log = logging.getLogger(__name__)
 
 from nuevo.core.engine import create_engine
-from nuevo.core.elements import Vertex, Edge, VertexProxy, EdgeProxy
-from nuevo.core.indices import IndexProxy
+from nuevo.core.elements import Element, Vertex, Edge, VertexProxy, EdgeProxy
+from nuevo.core.indices import Index, IndexProxy
 from nuevo.ogm.model import Node, NodeProxy
 
+class PendingContent(object):
+    """
+    Content of an element created in a session and not flushed yet.
+    """
+
+    __slots__ = ('data', 'outV', 'label', 'inV')
+
+    ready = False
+    id = None
+    uri = "<pending>"
+
+    def __init__(self, data, outV=None, label=None, inV=None):
+        self.data = dict(data)
+        self.outV = outV
+        self.label = label
+        self.inV = inV
+
+class SessionVertexProxy(VertexProxy):
+    """Vertex proxy that records changes in a session instead of sending them."""
+
+    def __init__(self, session):
+        super(SessionVertexProxy, self).__init__(session.engine)
+        self._session = session
+
+    def create(self, **kwargs):
+        """Adds a vertex to the session and returns it."""
+        vertex = Vertex(self._engine, PendingContent(kwargs))
+        self._session._new.append(vertex)
+        return vertex
+
+    def create_many(self, items):
+        return [ self.create(**data) for data in items ]
+
+    def get(self, id):
+        self._session._autoflush()
+        return self._session.add(super(SessionVertexProxy, self).get(id))
+
+    def update(self, _vertex, **kwargs):
+        """Replaces the properties of a vertex, written on flush."""
+        if not isinstance(_vertex, Element):
+            _vertex = self.get(_vertex)
+        self._session._replace(_vertex, kwargs)
+
+    def delete(self, _vertex):
+        self._session.delete(_vertex)
+
+class SessionEdgeProxy(EdgeProxy):
+    """Edge proxy that records changes in a session instead of sending them."""
+
+    def __init__(self, session):
+        super(SessionEdgeProxy, self).__init__(session.engine)
+        self._session = session
+
+    def create(self, _outV, _label, _inV, **kwargs):
+        """Adds an edge to the session and returns it."""
+        self._check(_outV, _label, _inV)
+        edge = Edge(self._engine, PendingContent(kwargs, _outV, _label, _inV))
+        self._session._new.append(edge)
+        return edge
+
+    def create_many(self, items):
+        return [ self.create(_outV, _label, _inV, **(data or {}))
+                 for _outV, _label, _inV, data in items ]
+
+    def get(self, id):
+        self._session._autoflush()
+        return self._session.add(super(SessionEdgeProxy, self).get(id))
+
+    def update(self, _edge, **kwargs):
+        """Replaces the properties of an edge, written on flush."""
+        if not isinstance(_edge, Element):
+            _edge = self.get(_edge)
+        self._session._replace(_edge, kwargs)
+
+    def delete(self, _edge):
+        self._session.delete(_edge)
+
+class SessionIndex(Index):
+    """Index whose new entries are written when the session flushes."""
+
+    def __init__(self, session, content, name, element_type):
+        super(SessionIndex, self).__init__(session.engine, content, name, element_type)
+        self._session = session
+
+    def put(self, element, key, value):
+        if not isinstance(element, self.element_type):
+            raise TypeError("Element type incompatible with index type")
+        self._session._entries.append((self, element, key, value))
+
+    def lookup(self, key, value):
+        self._session._autoflush()
+        return super(SessionIndex, self).lookup(key, value)
+
+    def query(self, query):
+        self._session._autoflush()
+        return super(SessionIndex, self).query(query)
+
+class SessionIndexProxy(IndexProxy):
+
+    def __init__(self, session):
+        super(SessionIndexProxy, self).__init__(session.engine)
+        self._session = session
+
+    def create(self, name, element_type, **config):
+        resp = self._engine.index_create(name, element_type, config)
+        return SessionIndex(self._session, resp, name, element_type)
+
+    def get(self, name, element_type):
+        resp = self._engine.index_get(name, element_type)
+        return SessionIndex(self._session, resp, name, element_type)
+
+    def get_create(self, name, element_type, **config):
+        resp = self._engine.index_get_create(name, element_type, config)
+        return SessionIndex(self._session, resp, name, element_type)
+
 class Session(object):
     """
     Session object that connects to the database.
-    
+
     Keeps indices for retrieving models, by the model element_type field.
     A Post model class with element_type = "posts" can be accessed like:
-    
+
     db = DBSession()
     db.posts.get(1)
-    db.posts.index.get(key=value) 
+    db.posts.index.get(key=value)
+
+    The session is a unit of work: the vertices, edges and index entries
+    created, the properties changed and the elements deleted through it are
+    written together in a single batch on commit():
+
+    with DBSession() as db:
+        v = db.vertices.create(name="a")
+        db.edges.create(v, "knows", db.vertices.get(1))
+
+    With autoflush, pending changes are written before reading elements or
+    querying, so reads see them.
+
+    Only the elements created or got through the proxies of the session are
+    tracked. Those reached otherwise, by traversals or queries, must be
+    added to the session for their property changes to be saved on flush:
+
+    for v in db.add(v).outV():
+        v["seen"] = True
+        db.add(v)
     """
-    
+
+    autoflush = True
+
     @classmethod
     def bind(cls, engine_uri):
         cls.engine_uri = engine_uri
-    
+
     def __init__(self):
         self.engine = create_engine(self.engine_uri)
-        
+
         # Standard stuff
-        self.indices  = IndexProxy(self.engine)
-        self.vertices = VertexProxy(self.engine)
-        self.edges    = EdgeProxy(self.engine)
-        
-        
+        self.indices  = SessionIndexProxy(self)
+        self.vertices = SessionVertexProxy(self)
+        self.edges    = SessionEdgeProxy(self)
+
+        self._new = []
+        self._tracked = {}
+        self._entries = []
+        self._deleted = []
+
         # Models
         model_indices = {}
         for name in Node._model_registry:
             model = Node._model_registry[name]
-            index = self.indices.get_create(name, Node)
+            index = IndexProxy(self.engine).get_create(name, Node)
             model_indices[name] = index
-        
+
         self.nodes    = NodeProxy(engine=self.engine, indices=model_indices)
-    
\ No newline at end of file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    @property
+    def dirty(self):
+        """The tracked elements with unsaved property changes."""
+        return [ element for element in self._tracked.values() if element.dirty ]
+
+    @property
+    def pending(self):
+        return bool(self._new or self._entries or self._deleted or self.dirty)
+
+    def add(self, element):
+        """
+        Track the property changes of element, to save them on flush, and
+        return it.
+        """
+        if element._content.ready:
+            self._tracked.setdefault(id(element), element)
+        return element
+
+    def delete(self, element):
+        """
+        Delete element on flush. Edges are deleted before vertices. Deleting
+        a vertex also drops the edges to or from it that are not flushed
+        yet, and the pending index entries of all of them.
+        """
+        dropped = [element]
+        if isinstance(element, Vertex):
+            dropped.extend( new for new in self._new
+                            if isinstance(new, Edge) and self._touches(new, element) )
+        self._entries = [ entry for entry in self._entries if entry[1] not in dropped ]
+        pending = any( new is element for new in self._new )
+        self._new = [ new for new in self._new if not any( new is e for e in dropped ) ]
+        if not pending:
+            self._tracked.pop(id(element), None)
+            self._deleted.append(element)
+
+    def query(self, *args, **kwargs):
+        self._autoflush()
+        return self.engine.query(*args, **kwargs)
+
+    def flush(self):
+        """
+        Write the pending changes in one transaction: new vertices and edges
+        in creation order, property changes, index entries, and then the
+        deleted edges and vertices.
+
+        When the transaction is sent in several requests, because of the
+        batch limits of the engine, a failed flush may be partial: the
+        elements created by the requests that went through keep their
+        content and are no longer pending. The other changes stay pending.
+        """
+        if not self.pending:
+            return
+
+        new = [ (element, element._content) for element in self._new ]
+        dirty = [ (element, element._delta()) for element in self.dirty ]
+        # whether the content of each new element was a future, materialized
+        # once the request creating it goes through
+        futures = []
+        engine = self.engine
+        try:
+            with engine.transaction():
+                for element, pending in new:
+                    if isinstance(element, Vertex):
+                        element._content = engine.create_vertex(pending.data)
+                    else:
+                        element._content = engine.create_edge(pending.outV, pending.label,
+                                                              pending.inV, pending.data)
+                    futures.append(not element._content.ready)
+                for element, (changed, removed) in dirty:
+                    engine.save_properties(element, changed, removed)
+                for index, element, key, value in self._entries:
+                    engine.index_put(index, element, key, value)
+                for element in self._deleted:
+                    if isinstance(element, Edge):
+                        engine.delete_edge(element)
+                for element in self._deleted:
+                    if not isinstance(element, Edge):
+                        engine.delete_vertex(element)
+        except Exception:
+            created = [ element for (element, _), future in zip(new, futures)
+                        if future and element._content.ready ]
+            for element, pending in new:
+                if not any( element is c for c in created ):
+                    element._content = pending
+            if created:
+                log.warning("Partial flush, %d of %d new elements were created",
+                            len(created), len(new))
+            self._created(created)
+            self._new = [ element for element in self._new if not element._content.ready ]
+            raise
+
+        self._created( element for element, _ in new )
+        for element, _ in dirty:
+            element._dirty = None
+        self._new = []
+        self._entries = []
+        self._deleted = []
+
+    def commit(self):
+        self.flush()
+
+    def _created(self, elements):
+        """Track the elements created by a flush."""
+        for element in elements:
+            element._dirty = None
+            self.add(element)
+
+    def rollback(self):
+        """
+        Forget the pending changes. Elements keep their local property
+        values, but are no longer tracked.
+        """
+        self._new = []
+        self._tracked = {}
+        self._entries = []
+        self._deleted = []
+
+    def _autoflush(self):
+        if self.autoflush:
+            self.flush()
+
+    def _touches(self, edge, vertex):
+        """Whether a pending edge goes to or from vertex."""
+        for end in (edge._content.outV, edge._content.inV):
+            if isinstance(end, Element):
+                if end == vertex:
+                    return True
+            elif vertex._content.ready and end == vertex.id:
+                return True
+        return False
+
+    def _replace(self, element, data):
+        data = dict( (k, v) for k, v in data.items() if v is not None )
+        for key in list(element):
+            if key not in data:
+                del element[key]
+        for key, value in data.items():
+            element[key] = value
+        self.add(element)
@@ -0,0 +1,158 @@
+"""
+Client side traversals: breadth first search, k-hop neighbourhoods and
+unweighted shortest paths.
+
+The graph is walked one level at a time: the vertices adjacent to a whole
+frontier are fetched with a single engine request, split in pages of
+page_size vertices for big frontiers. Edges are followed in direction
+("out", "in" or "all") and, when labels are given, only through edges with
+one of those labels:
+
+    for vertex, depth in bfs(v, labels=["knows"], max_depth=3):
+        ...
+"""
+
+from array import array
+
+from nuevo.core.elements import Element, Vertex
+
+REVERSE = {"out": "in", "in": "out", "all": "all"}
+
+class IdSet(object):
+    """
+    Set of integer ids kept as a sparse bitmap: a word of 64 bits for each
+    block of 64 ids with any of them in the set. Memory follows the number
+    of ids, a couple of bytes each when they are dense, whatever their
+    values.
+    """
+
+    __slots__ = ('_words', '_len')
+
+    def __init__(self, ids=()):
+        self._words = {}
+        self._len = 0
+        for id in ids:
+            self.add(id)
+
+    def add(self, id):
+        """Add id to the set, returning whether it was not in it yet."""
+        key, bit = id >> 6, 1 << (id & 63)
+        word = self._words.get(key, 0)
+        if word & bit:
+            return False
+        self._words[key] = word | bit
+        self._len += 1
+        return True
+
+    def __contains__(self, id):
+        return bool(self._words.get(id >> 6, 0) & (1 << (id & 63)))
+
+    def __len__(self):
+        return self._len
+
+def _vertices(start):
+    if isinstance(start, Element):
+        return [start]
+    return list(start)
+
+def _pages(ids, page_size):
+    for i in range(0, len(ids), page_size):
+        yield ids[i:i + page_size]
+
+def bfs(start, labels=(), direction="out", max_depth=None, page_size=1000):
+    """
+    Yield (vertex, depth) for each vertex reachable from start, a vertex or
+    a list of them, up to max_depth edges away, in breadth first order. The
+    start vertices come first, with depth 0.
+    """
+    start = _vertices(start)
+    if not start:
+        return
+    engine = start[0]._engine
+    visited = IdSet()
+    frontier = array('l')
+    for vertex in start:
+        if visited.add(vertex.id):
+            frontier.append(vertex.id)
+            yield vertex, 0
+
+    depth = 0
+    while frontier and (max_depth is None or depth < max_depth):
+        depth += 1
+        next_frontier = array('l')
+        for page in _pages(frontier, page_size):
+            for contents in engine.adjacent_vertices(page, labels, direction):
+                for content in contents:
+                    if visited.add(content.id):
+                        next_frontier.append(content.id)
+                        yield Vertex(engine, content), depth
+        frontier = next_frontier
+
+def k_hop(start, k, labels=(), direction="out", page_size=1000):
+    """Yield the vertices at 1 to k edges away from start, nearest first."""
+    for vertex, depth in bfs(start, labels, direction, k, page_size):
+        if depth:
+            yield vertex
+
+def shortest_path(source, target, labels=(), direction="out", max_depth=None, page_size=1000):
+    """
+    Return the vertices of a shortest path from source to target, both
+    included, or None if there is none of at most max_depth edges.
+
+    The search goes both ways, expanding the smaller frontier each time:
+    from source along direction, and from target against it.
+    """
+    engine = source._engine
+    if source.id == target.id:
+        return [source]
+    forward = {source.id: None}
+    backward = {target.id: None}
+    forward_frontier = array('l', [source.id])
+    backward_frontier = array('l', [target.id])
+
+    depth = 0
+    while forward_frontier and backward_frontier and (max_depth is None or depth < max_depth):
+        depth += 1
+        if len(forward_frontier) <= len(backward_frontier):
+            forward_frontier, meets = _expand(engine, forward_frontier, forward, backward,
+                                              labels, direction, page_size)
+        else:
+            backward_frontier, meets = _expand(engine, backward_frontier, backward, forward,
+                                               labels, REVERSE[direction], page_size)
+        if meets:
+            ids = min(( _path(meet, forward, backward) for meet in meets ), key=len)
+            contents = engine.get_vertices(ids)
+            return [ Vertex(engine, contents[id]) for id in ids ]
+    return None
+
+def _expand(engine, frontier, parents, other, labels, direction, page_size):
+    """
+    Visit the vertices adjacent to frontier, recording their parent. Return
+    the next frontier and the visited vertices already reached from the
+    other side.
+    """
+    next_frontier = array('l')
+    meets = []
+    for page in _pages(frontier, page_size):
+        for parent, contents in zip(page, engine.adjacent_vertices(page, labels, direction)):
+            for content in contents:
+                id = content.id
+                if id not in parents:
+                    parents[id] = parent
+                    next_frontier.append(id)
+                    if id in other:
+                        meets.append(id)
+    return next_frontier, meets
+
+def _path(meet, forward, backward):
+    ids = []
+    id = meet
+    while id is not None:
+        ids.append(id)
+        id = forward[id]
+    ids.reverse()
+    id = backward[meet]
+    while id is not None:
+        ids.append(id)
+        id = backward[id]
+    return ids
@@ -0,0 +1,54 @@
+
+class MemoryContent(object):
+    """
+    Content of an element living in a MemoryEngine store. It is always ready,
+    and holds its own copy of the properties, like a REST response would.
+    """
+
+    __slots__ = ('kind', 'id', 'data')
+
+    ready = True
+
+    def __init__(self, kind, id, data):
+        self.kind = kind
+        self.id = id
+        self.data = data
+
+    @property
+    def uri(self):
+        return "/%s/%d" % (self.kind, self.id)
+
+    def __eq__(self, other):
+        return type(self) == type(other) \
+            and self.kind == other.kind \
+            and self.id == other.id \
+            and self.data == other.data
+
+class MemoryEdgeContent(MemoryContent):
+
+    __slots__ = ('label', 'out_id', 'in_id')
+
+    def __init__(self, id, label, out_id, in_id, data):
+        self.label = label
+        self.out_id = out_id
+        self.in_id = in_id
+        super(MemoryEdgeContent, self).__init__("relationship", id, data)
+
+class MemoryIndexContent(object):
+
+    __slots__ = ('kind', 'name')
+
+    ready = True
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+
+    @property
+    def uri(self):
+        return "/index/%s/%s" % (self.kind, self.name)
+
+    def __eq__(self, other):
+        return type(self) == type(other) \
+            and self.kind == other.kind \
+            and self.name == other.name
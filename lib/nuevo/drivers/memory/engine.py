@@ -0,0 +1,457 @@
+
+from nuevo.core.engine import Engine
+from nuevo.core.elements import Element, Vertex, Edge
+from nuevo.core.indices import Index
+
+from nuevo.core.exceptions import NuevoException, NotFoundException, ExistsException
+
+from nuevo.drivers.memory.content import MemoryContent, MemoryEdgeContent, MemoryIndexContent
+
+from contextlib import contextmanager
+import threading
+from itertools import count
+from array import array
+import bisect
+
+
+class ElementImpl(object):
+    """
+    Mixin implementation of the operations common to vertices and edges.
+    """
+    
+    def save_properties(self, element, changed, removed):
+        if isinstance(element, Vertex):
+            id = self._get_vertex_id(element)
+            data = self._vertices[id]
+            self._log(self._vertices.__setitem__, id, data)
+            self._vertices[id] = self._patch(element, data, changed, removed)
+        else:
+            id = self._get_edge_id(element)
+            out_id, label, in_id, data = record = self._edges[id]
+            self._log(self._edges.__setitem__, id, record)
+            self._edges[id] = (out_id, label, in_id, self._patch(element, data, changed, removed))
+    
+    def _patch(self, element, data, changed, removed):
+        # like Neo4j, deleting a property that isn't stored fails
+        for key in removed:
+            if key not in data:
+                raise NotFoundException("Can't find property %r of %r" % (key, element))
+        data = dict(data)
+        data.update(changed)
+        for key in removed:
+            del data[key]
+        return data
+
+class VertexImpl(object):
+    """
+    Mixin implementation of the Vertex operations for the in-memory store.
+    Adjacency is always iterated lazily, so page_size is ignored.
+    """
+
+    def out_edges(self, vertex, labels, page_size=None):
+        return self._iter_edges(self._get_edge_ids(vertex, labels, "out"))
+
+    def in_edges(self, vertex, labels, page_size=None):
+        return self._iter_edges(self._get_edge_ids(vertex, labels, "in"))
+
+    def both_edges(self, vertex, labels, page_size=None):
+        return self._iter_edges(self._get_edge_ids(vertex, labels, "all"))
+
+    def out_vertices(self, vertex, labels, page_size=None):
+        return self._iter_vertices(self._get_vertex_ids(vertex, labels, "out"))
+
+    def in_vertices(self, vertex, labels, page_size=None):
+        return self._iter_vertices(self._get_vertex_ids(vertex, labels, "in"))
+
+    def both_vertices(self, vertex, labels, page_size=None):
+        return self._iter_vertices(self._get_vertex_ids(vertex, labels, "all"))
+
+    def adjacent_edges(self, vertices, labels, direction):
+        return [ [ self._edge_content(eid) for eid in self._get_edge_ids(vertex, labels, direction) ]
+                 for vertex in vertices ]
+
+    def adjacent_vertices(self, vertices, labels, direction):
+        return [ [ self._vertex_content(vid) for vid in self._get_vertex_ids(vertex, labels, direction) ]
+                 for vertex in vertices ]
+
+    def _get_edge_ids(self, vertex, labels, direction):
+        id = self._get_vertex_id(vertex)
+        if direction == "out":
+            eids = self._out[id]
+        elif direction == "in":
+            eids = self._in[id]
+        else:
+            eids = sorted(set(self._out[id]) | set(self._in[id]))
+        if labels:
+            eids = [eid for eid in eids if self._edges[eid][1] in labels]
+        return list(eids)
+
+    def _get_vertex_ids(self, vertex, labels, direction):
+        id = self._get_vertex_id(vertex)
+        seen = set()
+        vids = []
+        for eid in self._get_edge_ids(vertex, labels, direction):
+            out_id, _, in_id, _ = self._edges[eid]
+            other = in_id if out_id == id else out_id
+            if other not in seen:
+                seen.add(other)
+                vids.append(other)
+        return vids
+
+    def _iter_edges(self, eids):
+        for eid in eids:
+            yield Edge(self, self._edge_content(eid))
+
+    def _iter_vertices(self, vids):
+        for vid in vids:
+            yield Vertex(self, self._vertex_content(vid))
+
+class VertexProxyImpl(object):
+    """
+    Mixin implementation of the VertexProxy operations for the in-memory store.
+    """
+
+    def create_vertex(self, data):
+        id = self._next_id(self._vertex_ids, self._vertex_order)
+        self._vertices[id] = self._remove_none(data)
+        self._out[id] = array('l')
+        self._in[id] = array('l')
+        self._log(self._forget_vertex, id)
+        return self._vertex_content(id)
+
+    def create_vertices(self, items):
+        return [ self.create_vertex(data) for data in items ]
+
+    def get_vertex(self, id):
+        try:
+            return self._vertex_content(id)
+        except KeyError:
+            raise NotFoundException("Can't find vertex %d" % id)
+
+    def get_vertices(self, ids):
+        return dict( (id, self.get_vertex(id)) for id in set(ids) )
+
+    def scan_vertices(self, after=None, limit=1000):
+        return [ self._vertex_content(id)
+                 for id in self._scan(self._vertices, self._vertex_order, after, limit) ]
+
+    def update_vertex(self, vertex, data):
+        id = self._get_vertex_id(vertex)
+        data = self._remove_none(data)
+        self._log(self._vertices.__setitem__, id, self._vertices[id])
+        self._vertices[id] = data
+
+        if isinstance(vertex, Vertex):
+            vertex._content.data.clear()
+            vertex._content.data.update(data)
+
+    def delete_vertex(self, vertex):
+        id = self._get_vertex_id(vertex)
+        if self._out[id] or self._in[id]:
+            raise NuevoException("Can't delete vertex %d, it still has edges" % id)
+        self._log(self._restore_vertex, id, self._vertices[id])
+        self._forget_vertex(id)
+        self._unindex("node", id)
+
+    def _forget_vertex(self, id):
+        del self._vertices[id]
+        del self._out[id]
+        del self._in[id]
+
+    def _restore_vertex(self, id, data):
+        self._vertices[id] = data
+        self._out[id] = array('l')
+        self._in[id] = array('l')
+
+class EdgeImpl(object):
+    """
+    Mixin implementation of the Edge operations for the in-memory store.
+    """
+
+    def out_vertex(self, edge):
+        return self._vertex_content(self._edges[edge.id][0])
+
+    def in_vertex(self, edge):
+        return self._vertex_content(self._edges[edge.id][2])
+
+    def resolve_endpoints(self, edges):
+        edges = list(edges)
+        vertices = {}
+        for edge in edges:
+            out_id, _, in_id, _ = self._edges[edge.id]
+            for id in (out_id, in_id):
+                if id not in vertices:
+                    vertices[id] = Vertex(self, self._vertex_content(id))
+            edge._outV = vertices[out_id]
+            edge._inV = vertices[in_id]
+        return edges
+
+class EdgeProxyImpl(object):
+    """
+    Mixin implementation of the EdgeProxy operations for the in-memory store.
+    """
+
+    def create_edge(self, outv, label, inv, data):
+        try:
+            out_id = self._get_vertex_id(outv)
+        except NotFoundException:
+            raise NotFoundException("Can't find origin vertex %r" % outv)
+        try:
+            in_id = self._get_vertex_id(inv)
+        except NotFoundException:
+            raise NotFoundException("Can't find destination vertex %r" % inv)
+
+        id = self._next_id(self._edge_ids, self._edge_order)
+        self._link_edge(id, (out_id, label, in_id, self._remove_none(data)))
+        self._log(self._unlink_edge, id)
+        return self._edge_content(id)
+
+    def create_edges(self, items):
+        return [ self.create_edge(outv, label, inv, data)
+                 for outv, label, inv, data in items ]
+
+    def get_edge(self, id):
+        try:
+            return self._edge_content(id)
+        except KeyError:
+            raise NotFoundException("Can't find edge %d" % id)
+
+    def scan_edges(self, after=None, limit=1000):
+        return [ self._edge_content(id)
+                 for id in self._scan(self._edges, self._edge_order, after, limit) ]
+
+    def update_edge(self, edge, data):
+        id = self._get_edge_id(edge)
+        data = self._remove_none(data)
+        out_id, label, in_id, old = self._edges[id]
+        self._log(self._edges.__setitem__, id, (out_id, label, in_id, old))
+        self._edges[id] = (out_id, label, in_id, data)
+
+        if isinstance(edge, Edge):
+            edge._content.data.clear()
+            edge._content.data.update(data)
+
+    def delete_edge(self, edge):
+        id = self._get_edge_id(edge)
+        self._log(self._link_edge, id, self._edges[id])
+        self._unlink_edge(id)
+        self._unindex("relationship", id)
+
+    def _link_edge(self, id, record):
+        self._edges[id] = record
+        self._out[record[0]].append(id)
+        self._in[record[2]].append(id)
+
+    def _unlink_edge(self, id):
+        out_id, _, in_id, _ = self._edges.pop(id)
+        self._out[out_id].remove(id)
+        self._in[in_id].remove(id)
+
+class IndexProxyImpl(object):
+
+    def index_create(self, name, element_type, config):
+        key = (self._index_kind(element_type), name)
+        if key in self._indices:
+            raise ExistsException("%s index %s already exists" % (element_type.__name__, name))
+        self._indices[key] = {}
+        self._log(self._indices.pop, key)
+        return MemoryIndexContent(*key)
+
+    def index_get(self, name, element_type):
+        key = (self._index_kind(element_type), name)
+        if key not in self._indices:
+            raise NotFoundException("Can't find %s index %s" % (element_type.__name__, name))
+        return MemoryIndexContent(*key)
+
+    def index_get_create(self, name, element_type, config):
+        try:
+            return self.index_get(name, element_type)
+        except NotFoundException:
+            return self.index_create(name, element_type, config)
+
+    def index_delete(self, index=None, element_type=None):
+        if isinstance(index, Index):
+            key = (index._content.kind, index._content.name)
+        else:
+            assert element_type
+            key = (self._index_kind(element_type), index)
+        try:
+            entries = self._indices.pop(key)
+        except KeyError:
+            raise NotFoundException("Can't find index %s" % (key[1],))
+        self._log(self._indices.__setitem__, key, entries)
+
+class IndexImpl(object):
+
+    def index_put(self, index, element, key, value):
+        if not isinstance(element, index.element_type):
+            raise TypeError("Element type incompatible with index type")
+        entries = self._index_entries(index)
+        ids = entries.setdefault((key, value), [])
+        if element.id not in ids:
+            ids.append(element.id)
+            self._log(ids.remove, element.id)
+
+    def index_put_unique(self, index, element, key, value):
+        if not isinstance(element, index.element_type):
+            raise TypeError("Element type incompatible with index type")
+        entries = self._index_entries(index)
+        self._log(entries.__setitem__, (key, value), entries.get((key, value), []))
+        entries[(key, value)] = [element.id]
+
+    def index_remove(self, index, element, key=None, value=None):
+        entries = self._index_entries(index)
+        id = element.id if isinstance(element, Element) else element
+        for (k, v), ids in entries.items():
+            if (key is None or k == key) and (value is None or v == value) and id in ids:
+                ids.remove(id)
+                self._log(ids.append, id)
+
+    def index_lookup(self, index, key, value):
+        ids = list(self._index_entries(index).get((key, value), ()))
+        if issubclass(index.element_type, Vertex):
+            return self._iter_vertices(ids)
+        else:
+            return self._iter_edges(ids)
+
+    def _index_entries(self, index):
+        try:
+            return self._indices[(index._content.kind, index._content.name)]
+        except KeyError:
+            raise NotFoundException("Can't find index %s" % index.name)
+
+    def _unindex(self, kind, id):
+        for (index_kind, name), entries in self._indices.items():
+            if index_kind != kind:
+                continue
+            for ids in entries.values():
+                if id in ids:
+                    ids.remove(id)
+                    self._log(ids.append, id)
+
+
+class MemoryEngine(Engine, ElementImpl,
+                   VertexImpl, VertexProxyImpl,
+                   EdgeImpl, EdgeProxyImpl,
+                   IndexImpl, IndexProxyImpl):
+    """
+    A pure Python, in-process graph engine.
+
+    Vertices and edges are kept in hashes by id, with per-vertex adjacency
+    arrays of edge ids, and indices are hashes from key/value pairs to ids.
+    The ids ever created are also kept in order, for scans.
+    Every engine instance owns an independent, empty graph.
+    """
+
+    name = "Memory"
+
+    def __init__(self, option=None, path=None):
+        self._vertex_ids = count()
+        self._edge_ids = count()
+        self._vertices = {}
+        self._edges = {}
+        self._out = {}
+        self._in = {}
+        self._indices = {}
+        # append-only, the ids of deleted elements are skipped by scans
+        self._vertex_order = array('l')
+        self._edge_order = array('l')
+        self._ids_lock = threading.Lock()
+        # each thread has its own transactions
+        self._local = threading.local()
+
+    def _remove_none(self, data):
+        data = dict( (k, data[k]) for k in data if data[k] is not None )
+        return data
+
+    def _vertex_content(self, id):
+        return MemoryContent("node", id, dict(self._vertices[id]))
+
+    def _edge_content(self, id):
+        out_id, label, in_id, data = self._edges[id]
+        return MemoryEdgeContent(id, label, out_id, in_id, dict(data))
+
+    def _index_kind(self, element_type):
+        if issubclass(element_type, Vertex):
+            return "node"
+        elif issubclass(element_type, Edge):
+            return "relationship"
+        else:
+            raise TypeError("Only Vertex or Edge indices are supported")
+
+    def _get_vertex_id(self, element):
+        id = self._get_id(element)
+        if id not in self._vertices:
+            raise NotFoundException("Can't find vertex %d" % id)
+        return id
+
+    def _get_edge_id(self, element):
+        id = self._get_id(element)
+        if id not in self._edges:
+            raise NotFoundException("Can't find edge %d" % id)
+        return id
+
+    def _get_id(self, element):
+        if isinstance(element, Element):
+            return element.id
+        elif isinstance(element, int):
+            return element
+        else:
+            raise TypeError("Element or int required")
+
+    def _next_id(self, ids, order):
+        with self._ids_lock:
+            id = next(ids)
+            order.append(id)
+        return id
+
+    def _scan(self, elements, order, after, limit):
+        i = 0 if after is None else bisect.bisect_right(order, after)
+        ids = []
+        while i < len(order) and len(ids) < limit:
+            if order[i] in elements:
+                ids.append(order[i])
+            i += 1
+        return ids
+
+    @property
+    def _journals(self):
+        """The undo logs of the transactions open in the current thread."""
+        try:
+            return self._local.journals
+        except AttributeError:
+            self._local.journals = []
+            return self._local.journals
+
+    def _log(self, undo, *args):
+        """Record how to revert a change if the current transaction fails."""
+        if self._journals:
+            self._journals[-1].append((undo, args))
+
+    def _clear_database_for_testing(self):
+        self.__init__()
+
+    @contextmanager
+    def transaction(self, nest=True):
+        if not self._journals:
+            nest = True
+
+        if nest:
+            self._journals.append([])
+            try:
+                yield self
+            except:
+                for undo, args in reversed(self._journals.pop()):
+                    undo(*args)
+                raise
+            journal = self._journals.pop()
+            if self._journals:
+                self._journals[-1].extend(journal)
+        else:
+            yield self
+
+    def __getattr__(self, key):
+        raise NotImplementedError("%s not supported in the Memory engine" % key)
+
+def load():
+    return MemoryEngine
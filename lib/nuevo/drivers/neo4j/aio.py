@@ -0,0 +1,434 @@
+"""
+Asyncio engine for the Neo4j REST API, selected with a neo4j+async: URL:
+
+    engine = create_engine("neo4j+async:http://localhost:7474/db/data/")
+    g = AsyncGraph(engine)
+
+Requests go through a pool of keep-alive connections, so many coroutines
+can have requests in flight at the same time.
+"""
+
+import asyncio
+import contextvars
+import time
+from contextlib import asynccontextmanager
+from types import GeneratorType
+from urllib.parse import urlsplit, parse_qsl
+
+import logging
+log = logging.getLogger(__name__)
+
+from nuevo.core.engine import Engine
+from nuevo.core.aio import AsyncVertex, AsyncEdge
+from nuevo.core.cache import ElementCache
+from nuevo.core.metrics import Metrics
+
+from nuevo.drivers.neo4j import operations
+from nuevo.drivers.neo4j.operations import ResourceImpl, Return
+from nuevo.drivers.neo4j.commands import Neo4jRESTCommandFactory
+from nuevo.drivers.neo4j.content import Neo4jContent, Neo4jElementContent
+from nuevo.drivers.neo4j.queries import QueryResult, PreparedQuery, plans
+from nuevo.drivers.neo4j.rest import Neo4jAtomicREST, Neo4jBatchedREST, BatchLimits, resource_kind
+
+
+class _NotSent(Exception):
+    """A request could not be sent on a connection."""
+
+class AsyncHTTPPool(object):
+    """
+    Keep-alive HTTP/1.1 connections to the server of url. At most
+    max_connections requests are in flight at once, the rest wait for a
+    free connection.
+    """
+
+    def __init__(self, url, max_connections=10, timeout=None):
+        parts = urlsplit(url)
+        self.ssl = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.path = parts.path.rstrip('/')
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._idle = []
+        self._slots = None
+
+    async def request(self, method, resource, body=None):
+        """Return the status, headers and content of the response."""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_connections)
+        data = body.encode('utf-8') if body is not None else b""
+        async with self._slots:
+            return await asyncio.wait_for(
+                self._request(method, self.path + resource, data), self.timeout)
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+    async def _request(self, method, target, data):
+        while self._idle:
+            reader, writer = conn = self._idle.pop()
+            if reader.at_eof() or writer.is_closing():
+                # the server closed this idle connection
+                writer.close()
+                continue
+            try:
+                return await self._roundtrip(conn, method, target, data, reused=True)
+            except _NotSent:
+                # it was closed before the request went out, try another one
+                pass
+        conn = await asyncio.open_connection(self.host, self.port, ssl=self.ssl or None)
+        return await self._roundtrip(conn, method, target, data)
+
+    async def _roundtrip(self, conn, method, target, data, reused=False):
+        """
+        Send a request on conn and read its response. With reused, failing
+        to send the request raises _NotSent. Once it is sent, a failure is
+        raised as is: the server may have processed the request, so it
+        can't be sent again.
+        """
+        reader, writer = conn
+        head = "%s %s HTTP/1.1\r\n" \
+               "Host: %s:%d\r\n" \
+               "Accept: application/json\r\n" \
+               "Content-Type: application/json\r\n" \
+               "Content-Length: %d\r\n\r\n" % (method, target, self.host, self.port, len(data))
+        try:
+            writer.write(head.encode('latin-1') + data)
+            await writer.drain()
+        except ConnectionError:
+            writer.close()
+            if reused:
+                raise _NotSent()
+            raise
+        except BaseException:
+            writer.close()
+            raise
+        try:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionResetError("Connection closed by the server")
+            version, status = line.decode('latin-1').split(None, 2)[:2]
+            status = int(status)
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+
+            keep_alive = headers.get('connection', '').lower() != 'close' \
+                and (version != "HTTP/1.0" or headers.get('connection', '').lower() == 'keep-alive')
+            if method == "HEAD" or status in (204, 304) or status < 200:
+                content = b""
+            elif headers.get('transfer-encoding', '').lower() == 'chunked':
+                content = await self._read_chunked(reader)
+            elif 'content-length' in headers:
+                content = await reader.readexactly(int(headers['content-length']))
+            else:
+                content = await reader.read()
+                keep_alive = False
+        except BaseException:
+            writer.close()
+            raise
+
+        if keep_alive:
+            self._idle.append(conn)
+        else:
+            writer.close()
+        return status, headers, content
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0].strip(), 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+
+class AsyncNeo4jAtomicREST(Neo4jAtomicREST):
+    """Executor that sends each command right away, on the connections of pool."""
+
+    def __init__(self, pool, base_url, metrics=None):
+        self.pool = pool
+        self.base_url = base_url.rstrip('/')
+        self.metrics = metrics or Metrics()
+        self.stream = False
+
+    async def execute(self, cmd, resp_cls=Neo4jContent):
+        log.debug("EXEC: %s", cmd)
+        response = await self.send(cmd)
+        if response is not None:
+            return resp_cls(cid=None, response=response)
+        else:
+            return None
+
+    async def send(self, cmd):
+        kind = resource_kind(cmd.resource)
+        data = self.encode(cmd)
+        start = time.time()
+        try:
+            code, _, cont = await self.pool.request(cmd.method, cmd.resource, data)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            self.metrics.request(cmd.method, kind, len(data), 0, error=True)
+            raise
+        latency = time.time() - start
+        self.answered(cmd, latency)
+        return self.response(cmd, kind, len(data), latency, code, cont)
+
+class AsyncNeo4jBatchedREST(Neo4jBatchedREST):
+    """Executor that queues commands and sends them to /batch on flush, on the connections of pool."""
+
+    def __init__(self, pool, base_url, limits=None, metrics=None):
+        self.pool = pool
+        self.base_url = base_url.rstrip('/')
+        self.limits = limits or BatchLimits()
+        self.metrics = metrics or Metrics()
+        self.reset()
+
+    async def flush(self):
+        locations, results = {}, {}
+        try:
+            for chunk in self.chunks(locations):
+                await self.send_chunk(chunk, locations, results)
+        finally:
+            self.materialize(results)
+        self.reset()
+
+    async def send_chunk(self, chunk, locations, results):
+        data = "[%s]" % ",".join(data for _, data in chunk)
+        log.debug("SEND: %s", data)
+        positions = [ pos for pos, _ in chunk ]
+        start = time.time()
+        try:
+            code, _, cont = await self.pool.request("POST", "/batch", data)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            self.metrics.request("POST", "batch", len(data), 0, error=True)
+            raise
+        latency = time.time() - start
+        self.answered(len(positions), latency)
+        self.received(positions, len(data), latency, code, cont, locations, results)
+
+
+class AsyncQueryResult(QueryResult):
+
+    vertex_class = AsyncVertex
+    edge_class = AsyncEdge
+
+
+class AsyncNeo4jRESTEngine(Engine, ResourceImpl):
+    """
+    Neo4j REST engine whose operations are coroutines. Use it through
+    nuevo.core.aio.AsyncGraph.
+
+    The operations are the ones of the blocking engine, see
+    nuevo.drivers.neo4j.operations; only sending their commands differs.
+
+    The URL accepts the pool_size, timeout, batch_max_commands,
+    batch_max_bytes, bulk_size, cache_size and cache_ttl options,
+    e.g. http://localhost:7474/db/data/?pool_size=20
+    """
+
+    name = "Neo4jRESTAsync"
+
+    factory = Neo4jRESTCommandFactory
+
+    def __init__(self, url):
+        url, _, query = url.partition('?')
+        options = dict(parse_qsl(query))
+
+        self.base_url = url.rstrip('/') + '/'
+        self._base_prefix = self.base_url
+        timeout = options.get('timeout')
+        self.pool = AsyncHTTPPool(self.base_url,
+                                  max_connections=int(options.get('pool_size', 10)),
+                                  timeout=float(timeout) if timeout else None)
+        self.metrics = Metrics()
+        self.atomic = AsyncNeo4jAtomicREST(self.pool, self.base_url, self.metrics)
+        self.batch_limits = BatchLimits(
+            max_commands = int(options['batch_max_commands']) if 'batch_max_commands' in options else None,
+            max_bytes = int(options['batch_max_bytes']) if 'batch_max_bytes' in options else None
+        )
+        self.bulk_size = int(options.get('bulk_size', 1000))
+        cache_ttl = options.get('cache_ttl')
+        self.cache = ElementCache(int(options.get('cache_size', 0)),
+                                  float(cache_ttl) if cache_ttl else None)
+        # each task sees its own open batch, if any
+        self._batch = contextvars.ContextVar('batch', default=None)
+
+    @property
+    def rest(self):
+        """The executor for the current task: its open batch, if any."""
+        return self._batch.get() or self.atomic
+
+    async def close(self):
+        await self.pool.close()
+
+    def stats(self, reset=False):
+        stats = self.metrics.snapshot(reset)
+        stats['cache'] = self.cache.stats()
+        stats['plans'] = plans.stats()
+        return stats
+
+    @asynccontextmanager
+    async def transaction(self, nest=True):
+        if self._batch.get() is None:
+            nest = True
+
+        if nest:
+            batch = AsyncNeo4jBatchedREST(self.pool, self.base_url, self.batch_limits, self.metrics)
+            token = self._batch.set(batch)
+            try:
+                yield self
+                await batch.flush()
+            finally:
+                self._batch.reset(token)
+        else:
+            yield self
+
+    async def _run(self, op):
+        """Run an operation like operations.run, awaiting the commands it sends."""
+        try:
+            request = next(op)
+            while True:
+                try:
+                    if isinstance(request, GeneratorType):
+                        response = await self._run(request)
+                    else:
+                        response = await self._send(request)
+                except Exception as ex:
+                    request = op.throw(ex)
+                else:
+                    request = op.send(response)
+        except Return as ret:
+            return ret.value
+        except StopIteration:
+            return None
+
+    async def _send(self, request):
+        """Send the commands of an operation, see operations.Send."""
+        if request.atomic:
+            return await self.atomic.execute(request.cmds, request.resp_cls)
+        if not isinstance(request.cmds, list):
+            batch = self._batch.get()
+            if batch is not None:
+                return batch.execute(request.cmds, request.resp_cls)
+            return await self.atomic.execute(request.cmds, request.resp_cls)
+        async with self.transaction(nest=request.now):
+            return [ self.rest.execute(cmd, request.resp_cls) for cmd in request.cmds ]
+
+    def _contents(self, resp):
+        if resp is None:
+            return []
+        resp._raise_not_ready()
+        return [ Neo4jElementContent(response=r) for r in resp._response ]
+
+    # Element
+
+    async def save_properties(self, element, changed, removed):
+        await self._run(operations.save_properties(self, element, changed, removed))
+
+    # Vertex
+
+    async def out_edges(self, vertex, labels):
+        return self._contents(await self._run(operations.edges(self, vertex, labels, "out")))
+
+    async def in_edges(self, vertex, labels):
+        return self._contents(await self._run(operations.edges(self, vertex, labels, "in")))
+
+    async def both_edges(self, vertex, labels):
+        return self._contents(await self._run(operations.edges(self, vertex, labels, "all")))
+
+    async def out_vertices(self, vertex, labels):
+        return self._contents(await self._run(operations.vertices(self, vertex, labels, "out")))
+
+    async def in_vertices(self, vertex, labels):
+        return self._contents(await self._run(operations.vertices(self, vertex, labels, "in")))
+
+    async def both_vertices(self, vertex, labels):
+        return self._contents(await self._run(operations.vertices(self, vertex, labels, "all")))
+
+    # VertexProxy
+
+    async def create_vertex(self, data):
+        return await self._run(operations.create_vertex(self, data))
+
+    async def create_vertices(self, items):
+        return await self._run(operations.create_vertices(self, items))
+
+    async def get_vertex(self, id):
+        return await self._run(operations.get(self, "node", id))
+
+    async def update_vertex(self, vertex, data):
+        await self._run(operations.update(self, vertex, "node", data))
+
+    async def delete_vertex(self, vertex):
+        await self._run(operations.delete(self, vertex, "node"))
+
+    # Edge
+
+    async def out_vertex(self, edge):
+        return await self._run(operations.endpoint(self, edge._content.out_id))
+
+    async def in_vertex(self, edge):
+        return await self._run(operations.endpoint(self, edge._content.in_id))
+
+    # EdgeProxy
+
+    async def create_edge(self, outv, label, inv, data):
+        return await self._run(operations.create_edge(self, outv, label, inv, data))
+
+    async def create_edges(self, items):
+        return await self._run(operations.create_edges(self, items))
+
+    async def get_edge(self, id):
+        return await self._run(operations.get(self, "relationship", id))
+
+    async def update_edge(self, edge, data):
+        await self._run(operations.update(self, edge, "relationship", data))
+
+    async def delete_edge(self, edge):
+        await self._run(operations.delete(self, edge, "relationship"))
+
+    # IndexProxy
+
+    async def index_create(self, name, element_type, config):
+        return await self._run(operations.index_create(self, name, element_type, config))
+
+    async def index_get(self, name, element_type):
+        return await self._run(operations.index_get(self, name, element_type))
+
+    async def index_get_create(self, name, element_type, config):
+        return await self._run(operations.index_get_create(self, name, element_type, config))
+
+    async def index_delete(self, index=None, element_type=None):
+        await self._run(operations.index_delete(self, index, element_type))
+
+    # Index
+
+    async def index_put(self, index, element, key, value):
+        await self._run(operations.index_put(self, index, element, key, value))
+
+    async def index_lookup(self, index, key, value):
+        return self._contents(await self._run(operations.index_lookup(self, index, key, value)))
+
+    # Queries
+
+    async def query_cypher(self, q, params=None, column_types=None):
+        return await self.run_plan(plans.get(q, column_types), params)
+
+    def prepare_cypher(self, q, names=(), column_types=None):
+        return PreparedQuery(self, plans.get(q, column_types), names)
+
+    async def run_plan(self, plan, params):
+        content = await self._run(operations.run_plan(self, plan, params))
+        return AsyncQueryResult(self, content, plan)
+
+    def __getattr__(self, key):
+        raise NotImplementedError("%s not supported in the async Neo4j engine" % key)
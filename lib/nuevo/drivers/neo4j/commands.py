@@ -1,8 +1,34 @@
 
 import json, re
 
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+try:
+    from urllib import quote
+except ImportError:
+    from urllib.parse import quote
+
+def _properties(uri=None, id=None, type=None):
+    if uri:
+        return "%s/properties" % uri
+    elif id is not None and type:
+        return "/%s/%d/properties" % (type, id)
+    else:
+        raise ValueError("Need either uri or type/id")
+
 class Neo4jCommand(object):
     
+    # JSON encoding of params, when it is known in advance
+    encoded = None
+    
+    # resources of other elements the command depends on, like the nodes
+    # of a relationship it deletes
+    elements = ()
+    
     def __init__(self, method="GET", resource="/", params=None):
         self.method = method
         self.resource = resource
@@ -13,13 +39,61 @@ class Neo4jCommand(object):
 
 class Neo4jBatchedCommand(Neo4jCommand):
     
+    REFERENCE = re.compile(r"^{([0-9]+)}")
+    
     def __init__(self, cmd, id):
         self.id = id
-        if re.match(r"{[0-9]+}", cmd.resource): 
-            resource = cmd.resource
-        else:
-            resource = cmd.resource
-        super(Neo4jBatchedCommand, self).__init__(cmd.method, resource, cmd.params)
+        self.refs = set()
+        m = self.REFERENCE.match(cmd.resource)
+        if m: 
+            self.refs.add(int(m.group(1)))
+        self._collect_refs(cmd.params)
+        if any( ref >= id for ref in self.refs ):
+            raise ValueError("Batched command %d can only refer to previous commands" % id)
+        super(Neo4jBatchedCommand, self).__init__(cmd.method, cmd.resource, cmd.params)
+        self.elements = cmd.elements
+        if not self.refs:
+            self.encoded = cmd.encoded
+    
+    def _collect_refs(self, value):
+        if isinstance(value, basestring):
+            m = self.REFERENCE.match(value)
+            if m:
+                self.refs.add(int(m.group(1)))
+        elif isinstance(value, dict):
+            for v in value.values():
+                self._collect_refs(v)
+        elif isinstance(value, list):
+            for v in value:
+                self._collect_refs(v)
+    
+    def resolve(self, locations, base_url):
+        """
+        Return a copy of the command where the {cid} references to commands
+        already sent in a previous request are replaced by their locations.
+        """
+        def absolute(m):
+            return locations.get(int(m.group(1)), m.group(0))
+        
+        def relative(m):
+            location = absolute(m)
+            if location.startswith(base_url):
+                location = location[len(base_url):]
+            return location
+        
+        def substitute(value):
+            if isinstance(value, basestring):
+                return self.REFERENCE.sub(absolute, value)
+            elif isinstance(value, dict):
+                return dict( (k, substitute(v)) for k, v in value.items() )
+            elif isinstance(value, list):
+                return [ substitute(v) for v in value ]
+            return value
+        
+        resource = self.REFERENCE.sub(relative, self.resource)
+        cmd = Neo4jCommand(self.method, resource, substitute(self.params))
+        cmd.elements = self.elements
+        return Neo4jBatchedCommand(cmd, self.id)
 
 class JSONCommandEncoder(json.JSONEncoder):
     def default(self, o):
@@ -29,7 +103,32 @@ class JSONCommandEncoder(json.JSONEncoder):
         elif isinstance(o, Neo4jCommand):
             return o.params
         else:
-            return super(CommandEncoder, self).default(obj)
+            return super(JSONCommandEncoder, self).default(o)
+
+def dumps(cmd):
+    """Encode a command as JSON, reusing the encoding of its params if known."""
+    if cmd.encoded is None:
+        return json.dumps(cmd, cls=JSONCommandEncoder)
+    if isinstance(cmd, Neo4jBatchedCommand):
+        return '{"method": %s, "to": %s, "body": %s, "id": %d}' \
+            % (json.dumps(cmd.method), json.dumps(cmd.resource), cmd.encoded, cmd.id)
+    return cmd.encoded
+
+def traversal_params(labels, direction):
+    """Parameters of a traversal to the neighbours of a node."""
+    #if not labels and direction != "all":
+    #    raise NotImplementedError("All labels for a specific direction can't be obtained")
+    params = dict(
+        relationships = list( dict(direction=direction, type=label) for label in labels ),
+        max_depth = 1
+    )
+    if not labels and direction == "in":
+        params['return_filter'] = dict(language='javascript',
+                                       body=r"position.length() == 1 && position.startNode().equals(position.lastRelationship().getEndNode())")
+    if not labels and direction == "out":
+        params['return_filter'] = dict(language='javascript',
+                                       body=r"position.length() == 1 && position.startNode().equals(position.lastRelationship().getStartNode())")
+    return params
 
 class Neo4jRESTCommandFactory(object):
     
@@ -73,6 +172,14 @@ class Neo4jRESTCommandFactory(object):
         
         return Neo4jCommand("PUT", resource, data)
     
+    @staticmethod
+    def set_property(key, value, uri=None, id=None, type=None):
+        return Neo4jCommand("PUT", "%s/%s" % (_properties(uri, id, type), quote(key, safe="")), value)
+    
+    @staticmethod
+    def delete_property(key, uri=None, id=None, type=None):
+        return Neo4jCommand("DELETE", "%s/%s" % (_properties(uri, id, type), quote(key, safe="")))
+    
     @staticmethod
     def delete(uri=None, id=None, type=None):
         if uri:
@@ -105,6 +212,21 @@ class Neo4jRESTCommandFactory(object):
         resource = "%s/traverse/%s" % (start_uri, return_type)
         return Neo4jCommand("POST", resource, params)
     
+    @staticmethod
+    def paged_traversal(start_uri=None, start_id=None, return_type="node", params=None,
+                        page_size=50, lease_time=60):
+        assert start_uri or start_id is not None
+        if not start_uri:
+            start_uri = "/node/%d" % start_id
+        resource = "%s/paged/traverse/%s?pageSize=%d&leaseTime=%d" \
+            % (start_uri, return_type, page_size, lease_time)
+        return Neo4jCommand("POST", resource, params)
+    
+    # Queries
+    @staticmethod
+    def cypher(query, params=None):
+        return Neo4jCommand("POST", "/cypher", dict(query=query, params=params or {}))
+    
     # Indices
     @staticmethod
     def create_node_index(name, config):
@@ -136,4 +258,3 @@ class Neo4jRESTCommandFactory(object):
     @staticmethod
     def index_lookup(index_uri, key, value):
         return Neo4jCommand("GET", "%s/%s/%s" % (index_uri, key, value) )
-    
\ No newline at end of file
@@ -4,6 +4,8 @@ class NotReadyException(Exception):
 
 class Future(object):
     
+    __slots__ = ('_cid', '_response')
+    
     def __init__(self, cid=None, response=None):
         assert cid is not None or response is not None
         self._cid = cid
@@ -32,8 +34,13 @@ class Future(object):
         if not self.ready:
             raise NotReadyException("This is still a future object")
     
+def _url_id(url):
+    return int(url[url.rindex('/') + 1:])
+
 class Neo4jContent(Future):
     
+    __slots__ = ()
+    
     @property
     def uri(self):
         try:
@@ -68,35 +75,105 @@ class Neo4jContent(Future):
         return item in self._response
 
 class Neo4jElementContent(Neo4jContent):
+    """
+    Content of a vertex or an edge. Only the parts of the REST response
+    that describe the element are kept: its URL and id, properties, and the
+    label and endpoint ids of edges. Ids are parsed once, on materialization.
+    """
+    
+    __slots__ = ('_self', '_id', '_data', 'label', 'out_id', 'in_id')
+    
+    def __init__(self, cid=None, response=None):
+        assert cid is not None or response is not None
+        self._cid = cid
+        self._response = None
+        self._self = self._id = self._data = None
+        self.label = self.out_id = self.in_id = None
+        if response is not None:
+            self.__materialize__(response)
+    
+    def __materialize__(self, response):
+        assert response is not None
+        self._self = response["self"]
+        self._id = _url_id(self._self)
+        self._data = response["data"]
+        self.label = response.get("type")
+        if "start" in response:
+            self.out_id = _url_id(response["start"])
+            self.in_id = _url_id(response["end"])
+    
+    @property
+    def ready(self):
+        return self._self is not None
+    
+    @property
+    def kind(self):
+        return "node" if self.label is None else "relationship"
     
     @property
     def _uri(self):
-        return self["self"]
+        self._raise_not_ready()
+        return self._self
     
     @property
     def id(self):
-        uri = self._uri
-        _id = int(uri.rpartition('/')[-1])
-        return _id
+        self._raise_not_ready()
+        return self._id
     
     @property
     def data(self):
-        return self["data"]
-
-    def __response_eq__(self, resp1, resp2):
-        return resp1["data"] == resp2["data"]
+        self._raise_not_ready()
+        return self._data
+    
+    # the response isn't kept, the mapping is over the properties
+    
+    def __setitem__(self, key, value):
+        self.data[key] = value
+    
+    def __getitem__(self, key):
+        return self.data[key]
+    
+    def __iter__(self):
+        return iter(self.data)
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def __contains__(self, item):
+        return item in self.data
+    
+    def __eq__(self, other):
+        return type(self) == type(other) \
+            and ( 
+                 ( not other.ready and not self.ready and self._cid == other._cid ) 
+                 or 
+                 ( other.ready and self.ready and self._self == other._self
+                   and self._data == other._data )
+                )
 
 class Neo4jIndexContent(Neo4jContent):
     
+    __slots__ = ('_index_uri',)
+    
     @property
     def _uri(self):
-        tpl = self["template"]
-        return tpl.format(key="",value="").rstrip("/")
+        try:
+            return self._index_uri
+        except AttributeError:
+            tpl = self["template"]
+            self._index_uri = tpl.format(key="",value="").rstrip("/")
+            return self._index_uri
     
     def __response_eq__(self, resp1, resp2):
         return resp1["template"] == resp2["template"]
     
 class Neo4jContentList(Future):
+    """
+    A list response. When streamed, the response is an iterator decoding
+    the items as they are received, so it can only be iterated once.
+    """
+    
+    streamable = True
     
     def __init__(self, cid=None, response=None):
         assert cid is not None or response is not None
@@ -119,13 +196,19 @@ class Neo4jContentList(Future):
             return self
     
         def next(self):
-            n = self.it.next()
+            n = next(self.it)
             if self.filter(n):
                 return self.cls(engine=self.engine,
                                 content=self.content_cls(response=n))
+        
+        __next__ = next
     
     def as_elements(self, engine, cls, content_cls=Neo4jContent, filter=lambda x: True):
         return self.filter_iter(self, engine, cls, content_cls, filter)
+    
+    def as_contents(self, content_cls=Neo4jContent):
+        self._raise_not_ready()
+        return [ content_cls(response=n) for n in self._response ]
 
 class Neo4jContentDict(Future):
     
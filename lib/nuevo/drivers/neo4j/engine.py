@@ -1,85 +1,124 @@
 
 from nuevo.core.engine import Engine
-from nuevo.core.elements import Element, Vertex, Edge
-from nuevo.core.indices import Index
+from nuevo.core.elements import Vertex, Edge
 
-from nuevo.core.exceptions import NotFoundException
+from nuevo.core.cache import ElementCache
+from nuevo.core.metrics import Metrics
 
-from nuevo.drivers.neo4j.rest import RESTException, Neo4jAtomicREST, Neo4jBatchedREST
-from nuevo.drivers.neo4j.commands import Neo4jRESTCommandFactory
+from nuevo.drivers.neo4j.rest import Neo4jAtomicREST, Neo4jBatchedREST, BatchLimits, shared_session
+from nuevo.drivers.neo4j.commands import Neo4jRESTCommandFactory, traversal_params
+from nuevo.drivers.neo4j.indices import catalog
+from nuevo.drivers.neo4j.queries import QueryResult, PreparedQuery, plans
+from nuevo.drivers.neo4j.paging import PagedTraversal
+from nuevo.drivers.neo4j import operations
+from nuevo.drivers.neo4j.operations import ResourceImpl, SCAN_VERTICES, SCAN_EDGES
 
-from nuevo.drivers.neo4j.content import Neo4jElementContent, Neo4jIndexContent, Neo4jContentList, Neo4jContentDict
+from nuevo.drivers.neo4j.content import Neo4jElementContent, NotReadyException
 
 from contextlib import contextmanager
-from itertools import chain
+from multiprocessing.pool import ThreadPool
 
-import urlparse
-import sys
-import posixpath
-def relative_url(target, base):
-    base = urlparse.urlparse(base)
-    target = urlparse.urlparse(target)
-    if base.netloc != target.netloc:
-        raise ValueError('target and base netlocs do not match')
-    base_dir = '.' + posixpath.dirname(base.path)
-    target = '.' + target.path
-    return '/' + posixpath.relpath(target, start=base_dir)
+try:
+    import urlparse
+except ImportError:
+    from urllib import parse as urlparse
+import threading
 
+def parse_options(query):
+    """Parse the ?key=value options at the end of an engine URL."""
+    return dict(urlparse.parse_qsl(query))
+
+def get_option(options, key, type=str, default=None):
+    if key not in options:
+        return default
+    if type is bool:
+        return options[key].lower() in ("1", "true", "yes", "on")
+    return type(options[key])
+
+
+class ElementImpl(object):
+    """
+    Mixin implementation of the operations common to vertices and edges.
+    """
+    
+    def save_properties(self, element, changed, removed):
+        """
+        Set the changed properties of the element and delete the removed
+        ones, one command per property, sent together in a batch.
+        """
+        self._run(operations.save_properties(self, element, changed, removed))
 
 class VertexImpl(object):
     """
     Mixin implementation of the Vertex operations for Neo4j.
     """
     
-    def out_edges(self, vertex, labels):
-        resp = self._get_edges(vertex, labels, "out")
+    def out_edges(self, vertex, labels, page_size=None):
+        if page_size:
+            return self._paged(vertex, labels, "out", "relationship", Edge, page_size)
+        resp = self._run(operations.edges(self, vertex, labels, "out"))
         return resp.as_elements(self, Edge, Neo4jElementContent)
 
-    def in_edges(self, vertex, labels):
-        resp = self._get_edges(vertex, labels, "in")
+    def in_edges(self, vertex, labels, page_size=None):
+        if page_size:
+            return self._paged(vertex, labels, "in", "relationship", Edge, page_size)
+        resp = self._run(operations.edges(self, vertex, labels, "in"))
         return resp.as_elements(self, Edge, Neo4jElementContent)
 
-    def both_edges(self, vertex, labels):
-        resp = self._get_edges(vertex, labels, "all")
+    def both_edges(self, vertex, labels, page_size=None):
+        if page_size:
+            return self._paged(vertex, labels, "all", "relationship", Edge, page_size)
+        resp = self._run(operations.edges(self, vertex, labels, "all"))
         return resp.as_elements(self, Edge, Neo4jElementContent)
 
-    def out_vertices(self, vertex, labels):
-        resp = self._get_vertices(vertex, labels, "out")
+    def out_vertices(self, vertex, labels, page_size=None):
+        if page_size:
+            return self._paged(vertex, labels, "out", "node", Vertex, page_size)
+        resp = self._run(operations.vertices(self, vertex, labels, "out"))
         return resp.as_elements(self, Vertex, Neo4jElementContent)
     
-    def in_vertices(self, vertex, labels):
-        resp = self._get_vertices(vertex, labels, "in")
+    def in_vertices(self, vertex, labels, page_size=None):
+        if page_size:
+            return self._paged(vertex, labels, "in", "node", Vertex, page_size)
+        resp = self._run(operations.vertices(self, vertex, labels, "in"))
         return resp.as_elements(self, Vertex, Neo4jElementContent)
 
-    def both_vertices(self, vertex, labels):
-        resp = self._get_vertices(vertex, labels, "all")
+    def both_vertices(self, vertex, labels, page_size=None):
+        if page_size:
+            return self._paged(vertex, labels, "all", "node", Vertex, page_size)
+        resp = self._run(operations.vertices(self, vertex, labels, "all"))
         return resp.as_elements(self, Vertex, Neo4jElementContent)
 
-    def _get_edges(self, vertex, labels, direction):
-        uri, id = self._get_uri_id(vertex)
-        
-        cmd = self.factory.node_relationships(uri, id, direction, labels)
-        resp = self.rest.execute(cmd, Neo4jContentList)
-        return resp
+    def adjacent_edges(self, vertices, labels, direction):
+        """
+        Return the edges of each of the vertices, as lists of contents, all
+        fetched in a single batch.
+        """
+        return self._run(operations.adjacent_edges(self, vertices, labels, direction))
+    
+    def adjacent_vertices(self, vertices, labels, direction):
+        """
+        Return the vertices adjacent to each of the vertices, as lists of
+        contents, all fetched in a single batch.
+        """
+        return self._run(operations.adjacent_vertices(self, vertices, labels, direction))
     
-    def _get_vertices(self, vertex, labels, direction):
+    def _paged(self, vertex, labels, direction, return_type, cls, page_size):
+        """
+        Return the neighbours or the edges of a vertex as an iterable that
+        fetches them in pages of page_size. Paging is never batched, so the
+        vertex must exist already.
+        """
         uri, id = self._get_uri_id(vertex)
-        #if not labels and direction != "all":
-        #    raise NotImplementedError("All labels for a specific direction can't be obtained")
-        params = dict(
-            relationships = list( dict(direction=direction, type=label) for label in labels ),
-            max_depth = 1
-        )
-        if not labels and direction == "in":
-            params['return_filter'] = dict(language='javascript',
-                                           body=r"position.length() == 1 && position.startNode().equals(position.lastRelationship().getEndNode())")
-        if not labels and direction == "out":
-            params['return_filter'] = dict(language='javascript',
-                                           body=r"position.length() == 1 && position.startNode().equals(position.lastRelationship().getStartNode())")
-        
-        cmd = self.factory.traversal(uri, id, "node", params)
-        resp = self.rest.execute(cmd, Neo4jContentList)
-        return resp
+        if uri is not None:
+            raise NotReadyException("Can't page the adjacency of %r, it is a future" % uri)
+        params = traversal_params(labels, direction)
+        if return_type == "relationship":
+            # every edge, even several to the same neighbour
+            params['uniqueness'] = "relationship_global"
+        cmd = self.factory.paged_traversal(start_id=id, return_type=return_type, params=params,
+                                           page_size=page_size, lease_time=self.page_lease_time)
+        return PagedTraversal(self, cmd, cls, page_size, self.page_prefetch)
     
 class VertexProxyImpl(object):
     """
@@ -87,47 +126,33 @@ class VertexProxyImpl(object):
     """
     
     def create_vertex(self, data):
-        # remove Nones
-        data = self._remove_none(data)
-        cmd = self.factory.create_node(data)
-        return self.rest.execute(cmd, Neo4jElementContent)
+        return self._run(operations.create_vertex(self, data))
+    
+    def create_vertices(self, items):
+        return self._run(operations.create_vertices(self, items))
     
     def get_vertex(self, id):
-        try:
-            cmd = self.factory.get(type="node", id=id)
-            return self.rest.execute(cmd, Neo4jElementContent)
-        except RESTException as ex:
-            if ex.status == 404:
-                raise NotFoundException("Can't find vertex %d" % id)
-            else:
-                raise ex
+        return self._run(operations.get(self, "node", id))
+    
+    def get_vertices(self, ids):
+        """
+        Return the contents of the vertices with the given ids by id, those
+        not cached fetched in a single batch.
+        """
+        return self._run(operations.get_vertices(self, ids))
+    
+    def scan_vertices(self, after=None, limit=1000):
+        """
+        Return the contents of the first limit vertices with an id over after,
+        by id. Each page scans every node on the server.
+        """
+        return self._run(operations.scan(self, SCAN_VERTICES, after, limit))
     
     def update_vertex(self, vertex, data):
-        uri, id = self._get_uri_id(vertex)
-        data = self._remove_none(data)
-        try:
-            cmd = self.factory.update(uri, id, "node", data)
-            self.rest.execute(cmd)
-        
-            if isinstance(vertex, Vertex) and vertex._content.ready:
-                vertex._content.data.clear()
-                vertex._content.data.update(data)
-        except RESTException as ex:
-            if ex.status == 404:
-                raise NotFoundException("Can't find vertex %d" % id)
-            else:
-                raise ex
+        self._run(operations.update(self, vertex, "node", data))
     
     def delete_vertex(self, vertex):
-        uri, id = self._get_uri_id(vertex)
-        try:
-            cmd = self.factory.delete(uri, id, "node")
-            self.rest.execute(cmd)
-        except RESTException as ex:
-            if ex.status == 404:
-                raise NotFoundException("Can't find vertex %d" % id)
-            else:
-                raise ex
+        self._run(operations.delete(self, vertex, "node"))
     
 class EdgeImpl(object):
     """
@@ -135,14 +160,28 @@ class EdgeImpl(object):
     """
     
     def out_vertex(self, edge):
-        uri = relative_url(edge._content["start"], self.base_url)
-        cmd = self.factory.get(uri=uri)
-        return self.rest.execute(cmd, Neo4jElementContent)
+        return self._run(operations.endpoint(self, edge._content.out_id))
 
     def in_vertex(self, edge):
-        uri = relative_url(edge._content["end"], self.base_url)
-        cmd = self.factory.get(uri=uri)
-        return self.rest.execute(cmd, Neo4jElementContent)
+        return self._run(operations.endpoint(self, edge._content.in_id))
+    
+    def resolve_endpoints(self, edges):
+        """
+        Fetch the vertices at both ends of the edges in a single batch and
+        attach them to the edges, which are returned as a list.
+        """
+        edges = list(edges)
+        ids = set()
+        for edge in edges:
+            ids.add(edge._content.out_id)
+            ids.add(edge._content.in_id)
+        
+        contents = self.get_vertices(ids)
+        vertices = dict( (id, Vertex(self, content)) for id, content in contents.items() )
+        for edge in edges:
+            edge._outV = vertices[edge._content.out_id]
+            edge._inV = vertices[edge._content.in_id]
+        return edges
 
 class EdgeProxyImpl(object):
     """
@@ -150,133 +189,73 @@ class EdgeProxyImpl(object):
     """
     
     def create_edge(self, outv, label, inv, data):
-        fr_uri, fr_id = self._get_uri_id(outv)
-        to_uri, to_id = self._get_uri_id(inv)
-        # remove Nones
-        data = self._remove_none(data)
-        args = dict(from_id=fr_id, from_uri=fr_uri,
-                    to_id=to_id, to_uri=to_uri,
-                    label=label, data=data)
-        args = self._remove_none(args)
-        try:
-            cmd = self.factory.create_relationship(**args)
-            return self.rest.execute(cmd, Neo4jElementContent)
-        except RESTException as ex:
-            if ex.status == 404:
-                raise NotFoundException("Can't find origin vertex %r" % outv)
-            elif ex.status == 400:
-                raise NotFoundException("Can't find destination vertex %r" % inv)
-            else:
-                raise ex
+        return self._run(operations.create_edge(self, outv, label, inv, data))
             
+    def create_edges(self, items):
+        return self._run(operations.create_edges(self, items))
+    
     def get_edge(self, id):
-        try:
-            cmd = self.factory.get(type="relationship", id=id)
-            return self.rest.execute(cmd, Neo4jElementContent)
-        except RESTException as ex:
-            if ex.status == 404:
-                raise NotFoundException("Can't find edge %d" % id)
-            else:
-                raise ex
+        return self._run(operations.get(self, "relationship", id))
+    
+    def scan_edges(self, after=None, limit=1000):
+        """
+        Return the contents of the first limit edges with an id over after,
+        by id. Each page scans every relationship on the server.
+        """
+        return self._run(operations.scan(self, SCAN_EDGES, after, limit))
     
     def update_edge(self, edge, data):
-        uri, id = self._get_uri_id(edge)
-        data = self._remove_none(data)
-        try:
-            cmd = self.factory.update(uri, id, "relationship", data)
-            self.rest.execute(cmd)
-            
-            if isinstance(edge, Edge) and edge._content.ready:
-                edge._content.data.clear()
-                edge._content.data.update(data)
-        except RESTException as ex:
-            if ex.status == 404:
-                raise NotFoundException("Can't find edge %r" % edge)
-            else:
-                raise ex
+        self._run(operations.update(self, edge, "relationship", data))
     
     def delete_edge(self, edge):
-        uri, id = self._get_uri_id(edge)
-        try:
-            cmd = self.factory.delete(uri, id, "relationship")
-            self.rest.execute(cmd)
-        except RESTException as ex:
-            if ex.status == 404:
-                raise NotFoundException("Can't find edge %r" % edge)
-            else:
-                raise ex
+        self._run(operations.delete(self, edge, "relationship"))
 
 class IndexProxyImpl(object):
+    """
+    Mixin implementation of the IndexProxy operations for Neo4j. Index
+    descriptions come from the process wide index catalog, downloaded once,
+    so a warm index_get or index_get_create makes no request.
+    """
 
     def index_create(self, name, element_type, config):
-        if issubclass(element_type, Vertex):
-            cmd = self.factory.create_node_index(name, config)
-        elif issubclass(element_type, Edge):
-            cmd = self.factory.create_relationship_index(name, config)
-        else:
-            raise TypeError("Only Vertex or Edge indices are supported")
-        resp = self.rest.execute(cmd, Neo4jIndexContent)
-        return resp
+        return self._run(operations.index_create(self, name, element_type, config))
 
     def index_get(self, name, element_type):
-        if issubclass(element_type, Vertex):
-            type = "node"
-        elif issubclass(element_type, Edge):
-            type = "relationship"
-        else:
-            raise TypeError("Only Vertex or Edge indices are supported")
-        
-        try:
-            cmd = self.factory.get_indices(type)
-            resp = self.rest.execute(cmd, Neo4jContentDict)
-            return resp.get_as_content(name, Neo4jIndexContent)
-        except KeyError as ex:
-            raise NotFoundException("Can't find %s index %s" % (element_type.__name__, name))
+        return self._run(operations.index_get(self, name, element_type))
     
     def index_get_create(self, name, element_type, config):
-        try:
-            return self.index_get(name, element_type)
-        except Exception:
-            return self.index_create(name, element_type, config)
+        return self._run(operations.index_get_create(self, name, element_type, config))
     
     def index_delete(self, index=None, element_type=None):
-        if isinstance(index, Index):
-            uri = relative_url(index._content.uri, self.base_url)
-        else:
-            assert element_type
-            if issubclass(element_type, Vertex):
-                type = "node"
-            elif issubclass(element_type, Edge):
-                type = "relationship"
-            else:
-                raise TypeError("Only Vertex or Edge indices are supported")
-            uri = "/index/%s/%s" % (type, index)
-            
-        cmd = self.factory.delete_index(uri)
-        self.rest.execute(cmd)
+        self._run(operations.index_delete(self, index, element_type))
 
 class IndexImpl(object):
     
     def index_put(self, index, element, key, value):
-        if not isinstance(element, index.element_type):
-            raise TypeError("Element type incompatible with index type")
-        index_uri = relative_url(index._content.uri, self.base_url)
-        cmd = self.factory.index_element(index_uri, element._content.uri, key, value)
-        self.rest.execute(cmd)
+        self._run(operations.index_put(self, index, element, key, value))
     
     def index_lookup(self, index, key, value):
-        index_uri = relative_url(index._content.uri, self.base_url)
-        cmd = self.factory.index_lookup(index_uri, key, value)
-        resp = self.rest.execute(cmd, Neo4jContentList)
+        resp = self._run(operations.index_lookup(self, index, key, value))
         return resp.as_elements(self, index.element_type, Neo4jElementContent)
 
 class QueryImpl(object):
     
-    def query_cypher(self, q, column_types=None):
-        cmd = self.factory.cypher(q)
+    def query_cypher(self, q, params=None, column_types=None):
+        """
+        Run a Cypher query. The rows are decoded while iterating the result,
+        which inside a transaction is only possible once it is sent.
+        """
+        return self.run_plan(plans.get(q, column_types), params)
+    
+    def prepare_cypher(self, q, names=(), column_types=None):
+        return PreparedQuery(self, plans.get(q, column_types), names)
+    
+    def run_plan(self, plan, params):
+        content = self._run(operations.run_plan(self, plan, params))
+        return QueryResult(self, content, plan)
     
 
-class Neo4jRESTEngine(Engine,
+class Neo4jRESTEngine(Engine, ResourceImpl, ElementImpl,
                       VertexImpl, VertexProxyImpl,
                       EdgeImpl, EdgeProxyImpl,
                       IndexImpl, IndexProxyImpl,
@@ -286,28 +265,102 @@ class Neo4jRESTEngine(Engine,
     
     factory = Neo4jRESTCommandFactory
     
+    def __new__(cls, protocol, path):
+        # neo4j+async: URLs get the asyncio engine
+        if protocol == "async":
+            from nuevo.drivers.neo4j.aio import AsyncNeo4jRESTEngine
+            return AsyncNeo4jRESTEngine(path)
+        return super(Neo4jRESTEngine, cls).__new__(cls)
+    
     def __init__(self, protocol, path):
+        path, _, query = path.partition('?')
+        options = parse_options(query)
+        
         base_url = "%s:%s/" % (protocol, path)
         self.base_url = base_url
-        self.rest     = Neo4jAtomicREST(base_url)
-        self.rest_stack = []
+        self._base_prefix = base_url.rstrip('/') + '/'
+        self.session  = shared_session(base_url, get_option(options, 'pool_size', int, 10),
+                                       get_option(options, 'pool_timeout', float, 60))
+        self.timeout  = get_option(options, 'timeout', float)
+        self.metrics  = Metrics()
+        self.stream_responses = get_option(options, 'stream_responses', bool, False)
+        self.stream_requests = get_option(options, 'stream_requests', bool, False)
+        self.atomic   = Neo4jAtomicREST(base_url, self.session, self.timeout, self.metrics,
+                                        self.stream_responses)
+        # the open batches of each thread
+        self._local   = threading.local()
+        
+        self.batch_limits = BatchLimits(
+            max_commands = get_option(options, 'batch_max_commands', int),
+            max_bytes = get_option(options, 'batch_max_bytes', int),
+            adaptive = get_option(options, 'batch_adaptive', bool, False),
+            target_latency = get_option(options, 'batch_target_latency', float, 1.0)
+        )
+        self.batch_workers = get_option(options, 'batch_workers', int, 1)
+        self._batch_pool = None
+        self._batch_pool_lock = threading.Lock()
+        self.bulk_size = get_option(options, 'bulk_size', int, 1000)
+        self.page_lease_time = get_option(options, 'page_lease_time', int, 60)
+        self.page_prefetch = get_option(options, 'page_prefetch', bool, True)
+        # opt-in, as changes made by other clients go unnoticed while an
+        # element is cached
+        self.cache = ElementCache(
+            size = get_option(options, 'cache_size', int, 0),
+            ttl = get_option(options, 'cache_ttl', float)
+        )
     
-    def _remove_none(self, data):
-        data = dict( (k, data[k]) for k in data if data[k] is not None )
-        return data
+    @property
+    def rest_stack(self):
+        try:
+            return self._local.rest_stack
+        except AttributeError:
+            self._local.rest_stack = []
+            return self._local.rest_stack
+    
+    @property
+    def rest(self):
+        """The executor for the current thread: its innermost open batch, if any."""
+        stack = self.rest_stack
+        return stack[-1] if stack else self.atomic
+    
+    @property
+    def batch_pool(self):
+        """The threads sending the groups of a batch, shared by every batch of the engine."""
+        if self.batch_workers <= 1:
+            return None
+        with self._batch_pool_lock:
+            if self._batch_pool is None:
+                self._batch_pool = ThreadPool(self.batch_workers)
+            return self._batch_pool
     
     def _start_batch(self):
-        self.rest_stack.append(self.rest)
-        self.rest = Neo4jBatchedREST(self.base_url)
+        self.rest_stack.append(Neo4jBatchedREST(self.base_url, self.batch_limits,
+                                                self.session, self.timeout,
+                                                self.batch_workers, self.metrics,
+                                                self.stream_responses, self.stream_requests,
+                                                self.batch_pool))
     
     def _send_batch(self):
         self.rest.flush()
     
     def _end_batch(self):
-        self.rest = self.rest_stack.pop()
+        self.rest_stack.pop()
+    
+    def stats(self, reset=False):
+        """
+        Return the request metrics of the engine, along with the stats of
+        the element cache and the query plan cache. With reset, the request
+        metrics start again from zero.
+        """
+        stats = self.metrics.snapshot(reset)
+        stats['cache'] = self.cache.stats()
+        stats['plans'] = plans.stats()
+        return stats
     
     def _clear_database_for_testing(self):
         self.factory.delete("/cleandb/secret-key")
+        self.cache.clear()
+        catalog.invalidate(self.base_url)
     
     @contextmanager
     def transaction(self, nest=True):
@@ -324,15 +377,17 @@ class Neo4jRESTEngine(Engine,
         else:
             yield self
     
-    def _get_uri_id(self, element):
-        uri = id = None
-        if isinstance(element, Element):
-            uri = relative_url(element._content.uri, self.base_url)
-        elif isinstance(element, int):
-            id = element
-        else:
-            raise TypeError("Element or int required")
-        return uri, id
+    def _run(self, op):
+        return operations.run(op, self._send)
+    
+    def _send(self, request):
+        """Send the commands of an operation, see operations.Send."""
+        if request.atomic:
+            return self.atomic.execute(request.cmds, request.resp_cls)
+        if not isinstance(request.cmds, list):
+            return self.rest.execute(request.cmds, request.resp_cls)
+        with self.transaction(nest=request.now):
+            return [ self.rest.execute(cmd, request.resp_cls) for cmd in request.cmds ]
     
     def __getattr__(self, key):
         raise NotImplementedError("%s not supported in the Neo4j engine" % key)
@@ -1,6 +1,8 @@
 
 from nuevo.core.indices import Index
 
+import threading
+
 class Neo4jIndex(Index):
     
     def __init__(self, engine, content, element_type):
@@ -11,5 +13,55 @@ class Neo4jIndex(Index):
     @property
     def uri(self):
         return self._content.uri
+
+class IndexCatalog(object):
+    """
+    Process wide cache of the index listings of Neo4j servers, by base url
+    and index type ("node" or "relationship"). Engines load a listing once
+    and keep it up to date when they create or delete indices.
+    
+    Once a listing is loaded, the indices not in it are taken as missing,
+    without asking the server again, until they are created through an
+    engine or the listing is invalidated.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listings = {}
+        self._loaded = set()
+    
+    def get(self, base_url, type, name):
+        """
+        Return the cached description of an index, or None if it is unknown
+        or the listing has not been loaded.
+        """
+        with self._lock:
+            return self._listings.get((base_url, type), {}).get(name)
     
-    
\ No newline at end of file
+    def loaded(self, base_url, type):
+        """Whether the whole listing of the server and type is cached."""
+        with self._lock:
+            return (base_url, type) in self._loaded
+    
+    def load(self, base_url, type, listing):
+        with self._lock:
+            self._listings[(base_url, type)] = dict(listing)
+            self._loaded.add((base_url, type))
+    
+    def add(self, base_url, type, name, description):
+        with self._lock:
+            self._listings.setdefault((base_url, type), {})[name] = description
+    
+    def remove(self, base_url, type, name):
+        with self._lock:
+            self._listings.get((base_url, type), {}).pop(name, None)
+    
+    def invalidate(self, base_url=None, type=None):
+        """Forget the listings of a server and type, or all of them."""
+        with self._lock:
+            for key in list(self._listings):
+                if base_url in (None, key[0]) and type in (None, key[1]):
+                    del self._listings[key]
+                    self._loaded.discard(key)
+
+catalog = IndexCatalog()
@@ -0,0 +1,466 @@
+"""
+The operations of the Neo4j engines, written once for the blocking engine
+and the asyncio one.
+
+An operation is a generator. It yields a Send with the commands it needs
+sent, is sent back their responses, and raises Return with its result:
+
+    def get_edge(engine, id):
+        content = yield Send(engine.factory.get(type="relationship", id=id),
+                             Neo4jElementContent)
+        raise Return(content)
+
+An operation can also yield another operation, and is sent back its
+result. The errors of the commands are thrown into the generator. The
+engines only differ in how they send the commands, see run() and
+AsyncNeo4jRESTEngine._run.
+"""
+
+from itertools import islice
+from types import GeneratorType
+import posixpath
+import sys
+
+try:
+    import urlparse
+except ImportError:
+    from urllib import parse as urlparse
+
+from nuevo.core.elements import Element, Vertex, Edge
+from nuevo.core.indices import Index
+from nuevo.core.exceptions import NotFoundException
+
+from nuevo.drivers.neo4j.rest import RESTException
+from nuevo.drivers.neo4j.commands import traversal_params
+from nuevo.drivers.neo4j.indices import catalog
+from nuevo.drivers.neo4j.queries import CypherContent, plans
+from nuevo.drivers.neo4j.content import Neo4jContent, Neo4jElementContent, Neo4jIndexContent, \
+    Neo4jContentList, Neo4jContentDict, NotReadyException
+
+def relative_url(target, base):
+    base = urlparse.urlparse(base)
+    target = urlparse.urlparse(target)
+    if base.netloc != target.netloc:
+        raise ValueError('target and base netlocs do not match')
+    base_dir = '.' + posixpath.dirname(base.path)
+    target = '.' + target.path
+    return '/' + posixpath.relpath(target, start=base_dir)
+
+def chunks(iterable, size):
+    """Split an iterable in lists of at most size items, lazily."""
+    it = iter(iterable)
+    chunk = list(islice(it, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(it, size))
+
+# legacy Cypher has no index on ids: every page reads all the nodes or
+# relationships to keep those over after, so a full scan is quadratic
+SCAN_VERTICES = "START n=node(*) WHERE ID(n) > {after} RETURN n ORDER BY ID(n) LIMIT {limit}"
+SCAN_EDGES = "START r=relationship(*) WHERE ID(r) > {after} RETURN r ORDER BY ID(r) LIMIT {limit}"
+
+NAMES = {"node": "vertex", "relationship": "edge"}
+
+class Send(object):
+    """
+    Commands for the engine to send, with the class of their responses.
+
+    A single command goes through the open batch, if any, and is answered
+    with its content. A list of commands is answered with the list of their
+    contents: they are queued in the open batch, or sent in a batch of their
+    own when there is none. With now, they always are, for the responses to
+    be ready. Atomic commands are sent right away, even in a transaction.
+    """
+
+    def __init__(self, cmds, resp_cls=Neo4jContent, now=False, atomic=False):
+        self.cmds = cmds
+        self.resp_cls = resp_cls
+        self.now = now
+        self.atomic = atomic
+
+class Return(Exception):
+    """The result of an operation, as generators can't return one on Python 2."""
+
+    def __init__(self, value=None):
+        super(Return, self).__init__(value)
+        self.value = value
+
+def run(op, send):
+    """Run the operation op, sending its commands with send, and return its result."""
+    try:
+        request = next(op)
+        while True:
+            try:
+                if isinstance(request, GeneratorType):
+                    response = run(request, send)
+                else:
+                    response = send(request)
+            except Exception:
+                request = op.throw(*sys.exc_info())
+            else:
+                request = op.send(response)
+    except Return as ret:
+        return ret.value
+    except StopIteration:
+        return None
+
+class ResourceImpl(object):
+    """
+    Mixin implementation of the addressing and caching of elements, common
+    to both engines. They have a base_url, an element cache and rest, the
+    executor of the commands of the current thread or task.
+    """
+
+    def _remove_none(self, data):
+        data = dict( (k, data[k]) for k in data if data[k] is not None )
+        return data
+
+    def _get_uri_id(self, element, now=False):
+        """
+        Return the id of an element, or the {cid} reference to it when its
+        content is a future of the batch being built. With now, the command
+        goes in a batch of its own, where futures can't be referred to.
+        """
+        uri = id = None
+        if isinstance(element, Element):
+            content = element._content
+            if content.ready:
+                id = content.id
+            elif now:
+                raise NotReadyException("%r is a future" % content.uri)
+            else:
+                uri = self._resource(content)
+        elif isinstance(element, int):
+            id = element
+        else:
+            raise TypeError("Element or int required")
+        return uri, id
+
+    def _cached(self, kind, id):
+        """
+        Return the cached content of an element, unless it is a future of a
+        batch that is gone.
+        """
+        return self.cache.get(kind, id, valid=lambda c: c.ready or self.rest.owns(c))
+
+    def _forget(self, kind, element, keep=True):
+        """
+        Evict a modified element from the cache. With keep, the element's
+        own content stays cached since it is updated in place.
+        """
+        if isinstance(element, Element):
+            if not element._content.ready:
+                return
+            id = element._content.id
+        else:
+            id = element
+        if not keep or self.cache.peek(kind, id) is not getattr(element, '_content', None):
+            self.cache.evict(kind, id)
+
+    def _endpoints(self, element):
+        """
+        Return the resources of the nodes of an edge, for the commands on it
+        to be flushed along with the ones on its nodes, if they are known.
+        """
+        if isinstance(element, Edge) and element._content.ready:
+            content = element._content
+            return ("/node/%d" % content.out_id, "/node/%d" % content.in_id)
+        return ()
+
+    def _resource(self, content, absolute=False):
+        """
+        Return the resource of a content relative to the base url, or a {cid}
+        back-reference when it is a future of the batch being built.
+        """
+        if content.ready:
+            return content.uri if absolute else self._path(content.uri)
+        if not self.rest.owns(content):
+            raise NotReadyException("%r is a future of another batch" % content.uri)
+        return content.uri
+
+    def _path(self, url):
+        """Return the resource of a URL of the server, relative to the base url."""
+        if url.startswith(self._base_prefix):
+            return url[len(self._base_prefix) - 1:]
+        return relative_url(url, self.base_url)
+
+    def _index_type(self, element_type):
+        if issubclass(element_type, Vertex):
+            return "node"
+        elif issubclass(element_type, Edge):
+            return "relationship"
+        else:
+            raise TypeError("Only Vertex or Edge indices are supported")
+
+# Element
+
+def save_properties(engine, element, changed, removed):
+    """
+    Set the changed properties of the element and delete the removed ones,
+    one command per property, sent together in a batch.
+    """
+    type = "node" if isinstance(element, Vertex) else "relationship"
+    uri, id = engine._get_uri_id(element)
+    cmds = [ engine.factory.set_property(key, value, uri, id, type)
+             for key, value in changed.items() ]
+    cmds.extend( engine.factory.delete_property(key, uri, id, type)
+                 for key in removed )
+    for cmd in cmds:
+        cmd.elements = engine._endpoints(element)
+    try:
+        yield Send(cmds[0] if len(cmds) == 1 else cmds)
+    except RESTException as ex:
+        if ex.status == 404:
+            raise NotFoundException("Can't find %s %r" % (type, element))
+        raise
+    engine._forget(type, element)
+
+def update(engine, element, type, data):
+    """Replace the properties of an element."""
+    uri, id = engine._get_uri_id(element)
+    data = engine._remove_none(data)
+    cmd = engine.factory.update(uri, id, type, data)
+    cmd.elements = engine._endpoints(element)
+    try:
+        yield Send(cmd)
+    except RESTException as ex:
+        if ex.status == 404:
+            raise NotFoundException("Can't find %s %r" % (NAMES[type], element))
+        raise
+    engine._forget(type, element)
+
+    if isinstance(element, Element) and element._content.ready:
+        element._content.data.clear()
+        element._content.data.update(data)
+
+def delete(engine, element, type):
+    uri, id = engine._get_uri_id(element)
+    cmd = engine.factory.delete(uri, id, type)
+    cmd.elements = engine._endpoints(element)
+    try:
+        yield Send(cmd)
+    except RESTException as ex:
+        if ex.status == 404:
+            raise NotFoundException("Can't find %s %r" % (NAMES[type], element))
+        raise
+    engine._forget(type, element, keep=False)
+
+def get(engine, type, id):
+    """Return the content of the element of type with id, from the cache if it is there."""
+    content = engine._cached(type, id)
+    if content is None:
+        try:
+            content = yield Send(engine.factory.get(type=type, id=id), Neo4jElementContent)
+        except RESTException as ex:
+            if ex.status == 404:
+                raise NotFoundException("Can't find %s %d" % (NAMES[type], id))
+            raise
+        engine.cache.put(type, id, content)
+    raise Return(content)
+
+def endpoint(engine, id):
+    """Return the content of the vertex at an end of an edge."""
+    content = engine._cached("node", id)
+    if content is None:
+        content = yield Send(engine.factory.get(type="node", id=id), Neo4jElementContent)
+        engine.cache.put("node", id, content)
+    raise Return(content)
+
+def get_vertices(engine, ids):
+    """
+    Return the contents of the vertices with the given ids by id, those not
+    cached fetched in a single batch.
+    """
+    contents = {}
+    missing = []
+    for id in set(ids):
+        content = engine._cached("node", id)
+        if content is not None and content.ready:
+            contents[id] = content
+        else:
+            missing.append(id)
+    if missing:
+        cmds = [ engine.factory.get(type="node", id=id) for id in missing ]
+        try:
+            fetched = yield Send(cmds, Neo4jElementContent, now=True)
+        except RESTException as ex:
+            if ex.status == 404:
+                raise NotFoundException("Can't find vertices %r" % missing)
+            raise
+        for id, content in zip(missing, fetched):
+            contents[id] = content
+            engine.cache.put("node", id, content)
+    raise Return(contents)
+
+def scan(engine, q, after, limit):
+    # pages are needed right away, so they never go into a batch
+    params = dict(after=-1 if after is None else after, limit=limit)
+    content = yield Send(plans.get(q).command(params), CypherContent, atomic=True)
+    raise Return([ Neo4jElementContent(response=row[0]) for row in content.data ])
+
+# Vertex
+
+def _edges_command(engine, vertex, labels, direction, now=False):
+    uri, id = engine._get_uri_id(vertex, now)
+    return engine.factory.node_relationships(uri, id, direction, labels)
+
+def _vertices_command(engine, vertex, labels, direction, now=False):
+    uri, id = engine._get_uri_id(vertex, now)
+    return engine.factory.traversal(uri, id, "node", traversal_params(labels, direction))
+
+def edges(engine, vertex, labels, direction):
+    """Return the list response with the edges of vertex."""
+    resp = yield Send(_edges_command(engine, vertex, labels, direction), Neo4jContentList)
+    raise Return(resp)
+
+def vertices(engine, vertex, labels, direction):
+    """Return the list response with the vertices adjacent to vertex."""
+    resp = yield Send(_vertices_command(engine, vertex, labels, direction), Neo4jContentList)
+    raise Return(resp)
+
+def adjacent_edges(engine, vertices, labels, direction):
+    """
+    Return the edges of each of the vertices, as lists of contents, all
+    fetched in a single batch.
+    """
+    cmds = [ _edges_command(engine, vertex, labels, direction, now=True) for vertex in vertices ]
+    resps = yield Send(cmds, Neo4jContentList, now=True)
+    raise Return([ resp.as_contents(Neo4jElementContent) for resp in resps ])
+
+def adjacent_vertices(engine, vertices, labels, direction):
+    """
+    Return the vertices adjacent to each of the vertices, as lists of
+    contents, all fetched in a single batch.
+    """
+    cmds = [ _vertices_command(engine, vertex, labels, direction, now=True) for vertex in vertices ]
+    resps = yield Send(cmds, Neo4jContentList, now=True)
+    raise Return([ resp.as_contents(Neo4jElementContent) for resp in resps ])
+
+# VertexProxy
+
+def create_vertex(engine, data):
+    cmd = engine.factory.create_node(engine._remove_none(data))
+    content = yield Send(cmd, Neo4jElementContent)
+    if content.ready:
+        engine.cache.put("node", content.id, content)
+    raise Return(content)
+
+def create_vertices(engine, items):
+    """Create the vertices in batches of bulk_size commands, or in the open batch."""
+    contents = []
+    for chunk in chunks(items, engine.bulk_size):
+        cmds = [ engine.factory.create_node(engine._remove_none(data)) for data in chunk ]
+        created = yield Send(cmds, Neo4jElementContent)
+        for content in created:
+            if content.ready:
+                engine.cache.put("node", content.id, content)
+        contents.extend(created)
+    raise Return(contents)
+
+# EdgeProxy
+
+def _edge_command(engine, outv, label, inv, data):
+    fr_uri, fr_id = engine._get_uri_id(outv)
+    to_uri, to_id = engine._get_uri_id(inv)
+    args = dict(from_id=fr_id, from_uri=fr_uri,
+                to_id=to_id, to_uri=to_uri,
+                label=label, data=engine._remove_none(data))
+    return engine.factory.create_relationship(**engine._remove_none(args))
+
+def create_edge(engine, outv, label, inv, data):
+    try:
+        content = yield Send(_edge_command(engine, outv, label, inv, data), Neo4jElementContent)
+    except RESTException as ex:
+        if ex.status == 404:
+            raise NotFoundException("Can't find origin vertex %r" % outv)
+        elif ex.status == 400:
+            raise NotFoundException("Can't find destination vertex %r" % inv)
+        raise
+    if content.ready:
+        engine.cache.put("relationship", content.id, content)
+    raise Return(content)
+
+def create_edges(engine, items):
+    """Create the edges in batches of bulk_size commands, or in the open batch."""
+    contents = []
+    for chunk in chunks(items, engine.bulk_size):
+        cmds = [ _edge_command(engine, outv, label, inv, data)
+                 for outv, label, inv, data in chunk ]
+        created = yield Send(cmds, Neo4jElementContent)
+        for content in created:
+            if content.ready:
+                engine.cache.put("relationship", content.id, content)
+        contents.extend(created)
+    raise Return(contents)
+
+# IndexProxy
+
+def index_create(engine, name, element_type, config):
+    type = engine._index_type(element_type)
+    if type == "node":
+        cmd = engine.factory.create_node_index(name, config)
+    else:
+        cmd = engine.factory.create_relationship_index(name, config)
+    resp = yield Send(cmd, Neo4jIndexContent)
+    if resp.ready:
+        catalog.add(engine.base_url, type, name, resp._response)
+    else:
+        catalog.invalidate(engine.base_url, type)
+    raise Return(resp)
+
+def _load_catalog(engine, type):
+    """Send the listing of the indices of type, unless the catalog has it."""
+    if not catalog.loaded(engine.base_url, type):
+        # the listing is needed right away, so it never goes into a batch
+        resp = yield Send(engine.factory.get_indices(type), Neo4jContentDict, atomic=True)
+        catalog.load(engine.base_url, type, resp._response if resp is not None else {})
+
+def index_get(engine, name, element_type):
+    type = engine._index_type(element_type)
+    yield _load_catalog(engine, type)
+    description = catalog.get(engine.base_url, type, name)
+    if description is None:
+        raise NotFoundException("Can't find %s index %s" % (element_type.__name__, name))
+    raise Return(Neo4jIndexContent(response=description))
+
+def index_get_create(engine, name, element_type, config):
+    type = engine._index_type(element_type)
+    yield _load_catalog(engine, type)
+    description = catalog.get(engine.base_url, type, name)
+    if description is not None:
+        raise Return(Neo4jIndexContent(response=description))
+    resp = yield index_create(engine, name, element_type, config)
+    raise Return(resp)
+
+def index_delete(engine, index=None, element_type=None):
+    if isinstance(index, Index):
+        uri = engine._resource(index._content)
+        type, name = engine._index_type(index.element_type), index.name
+    else:
+        assert element_type
+        type, name = engine._index_type(element_type), index
+        uri = "/index/%s/%s" % (type, index)
+    yield Send(engine.factory.delete_index(uri))
+    catalog.remove(engine.base_url, type, name)
+
+# Index
+
+def index_put(engine, index, element, key, value):
+    if not isinstance(element, index.element_type):
+        raise TypeError("Element type incompatible with index type")
+    index_uri = engine._resource(index._content)
+    element_uri = engine._resource(element._content, absolute=True)
+    yield Send(engine.factory.index_element(index_uri, element_uri, key, value))
+
+def index_lookup(engine, index, key, value):
+    """Return the list response with the elements indexed under key and value."""
+    index_uri = engine._resource(index._content)
+    resp = yield Send(engine.factory.index_lookup(index_uri, key, value), Neo4jContentList)
+    raise Return(resp)
+
+# Queries
+
+def run_plan(engine, plan, params):
+    """Return the content of the response to a query plan."""
+    content = yield Send(plan.command(params), CypherContent)
+    raise Return(content)
@@ -0,0 +1,84 @@
+"""
+Iteration over the adjacency of a vertex in pages, through the paged
+traversal resource of the server, so vertices with millions of edges never
+have their whole adjacency in a single response.
+"""
+
+import sys
+import threading
+
+from nuevo.core.exceptions import reraise
+from nuevo.drivers.neo4j.content import Neo4jElementContent
+from nuevo.drivers.neo4j.rest import RESTException
+
+class _Fetch(threading.Thread):
+    """Fetches a page in the background, keeping the result or the error."""
+
+    def __init__(self, fetch, location):
+        super(_Fetch, self).__init__()
+        self.daemon = True
+        self._fetch = fetch
+        self._location = location
+        self._result = self._error = None
+
+    def run(self):
+        try:
+            self._result = self._fetch(self._location)
+        except Exception:
+            self._error = sys.exc_info()
+
+    def result(self):
+        self.join()
+        if self._error is not None:
+            reraise(*self._error)
+        return self._result
+
+class PagedTraversal(object):
+    """
+    Iterable over the elements returned by a paged traversal command, page
+    by page. With prefetch, the next page is fetched in a background thread
+    while the current one is consumed.
+
+    The server keeps the traversal for lease_time seconds after each page
+    request; a traversal left idle for longer ends early.
+    """
+
+    def __init__(self, engine, cmd, cls, page_size, prefetch=True):
+        self._engine = engine
+        self._cmd = cmd
+        self.cls = cls
+        self.page_size = page_size
+        self.prefetch = prefetch
+
+    def __iter__(self):
+        for page in self.pages():
+            for element in page:
+                yield element
+
+    def pages(self):
+        """Yield the elements in lists of at most page_size."""
+        response, headers = self._engine.atomic.request(self._cmd)
+        location = headers.get('Location')
+        page = response or []
+        while True:
+            more = location is not None and len(page) >= self.page_size
+            pending = None
+            if more and self.prefetch:
+                pending = _Fetch(self._next, location)
+                pending.start()
+            yield [ self.cls(self._engine, Neo4jElementContent(response=item)) for item in page ]
+            if not more:
+                return
+            page = pending.result() if pending is not None else self._next(location)
+            if not page:
+                return
+
+    def _next(self, location):
+        cmd = self._engine.factory.get(self._engine._path(location))
+        try:
+            return self._engine.atomic.send(cmd) or []
+        except RESTException as ex:
+            # the traversal is exhausted, or its lease expired
+            if ex.status == 404:
+                return []
+            raise
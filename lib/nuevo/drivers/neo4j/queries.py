@@ -1 +1,232 @@
+"""
+Cypher query plans, prepared queries, and results decoded lazily into rows
+of Vertex, Edge or plain values.
+"""
 
+from collections import OrderedDict
+import json
+import threading
+
+from nuevo.core.elements import Vertex, Edge
+from nuevo.drivers.neo4j.commands import Neo4jRESTCommandFactory
+from nuevo.drivers.neo4j.content import Neo4jContent, Neo4jElementContent
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+class CypherContent(Neo4jContent):
+    """Response of the /cypher resource: the columns and the data rows."""
+
+    @property
+    def columns(self):
+        return self["columns"]
+
+    @property
+    def data(self):
+        return self["data"]
+
+class Row(tuple):
+    """A result row. Cells can be read by position or by column name."""
+
+    def __new__(cls, values, positions):
+        row = super(Row, cls).__new__(cls, values)
+        row._positions = positions
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            key = self._positions[key]
+        return super(Row, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except (KeyError, IndexError):
+            return default
+
+def is_vertex(value):
+    return isinstance(value, dict) and "self" in value and "data" in value \
+        and "start" not in value
+
+def is_edge(value):
+    return isinstance(value, dict) and "self" in value and "data" in value \
+        and "start" in value and "type" in value
+
+class QueryPlan(object):
+    """
+    What is reused by every execution of a query: the JSON encoding of its
+    text, and the decoders of its columns once they are known.
+    """
+
+    def __init__(self, query, column_types=None):
+        self.query = query
+        self.column_types = dict(column_types or {})
+        self.decoders = None
+        self._prefix = '{"query": %s, "params": ' % json.dumps(query)
+
+    def command(self, params):
+        """The /cypher command for params, with its body already encoded."""
+        cmd = Neo4jRESTCommandFactory.cypher(self.query, params)
+        cmd.encoded = '%s%s}' % (self._prefix, json.dumps(params or {}))
+        return cmd
+
+class PlanCache(object):
+    """
+    Process wide cache of query plans by query text and column types, which
+    keeps the size most recently used ones.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query, column_types=None):
+        key = (query, tuple(sorted((column_types or {}).items(), key=lambda item: item[0])))
+        with self._lock:
+            plan = self._plans.pop(key, None)
+            if plan is None:
+                self.misses += 1
+                plan = QueryPlan(query, column_types)
+            else:
+                self.hits += 1
+            self._plans[key] = plan
+            while len(self._plans) > self.size:
+                self._plans.popitem(last=False)
+            return plan
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    size=len(self._plans), max_size=self.size)
+
+plans = PlanCache()
+
+class PreparedQuery(object):
+    """
+    A query registered once with the names of its parameters, and run by
+    calling it with their values, by position or by name:
+
+        neighbours = engine.prepare("cypher", "START n=node({id}) MATCH n-->m RETURN m", ["id"])
+        for row in neighbours(v.id):
+            ...
+    
+    Calls inside a transaction are sent in its batch.
+    """
+
+    def __init__(self, engine, plan, names=()):
+        self._engine = engine
+        self.plan = plan
+        self.names = tuple(names)
+
+    def __call__(self, *args, **kwargs):
+        return self._engine.run_plan(self.plan, self.bind(args, kwargs))
+
+    def bind(self, args, kwargs):
+        """Return the parameters dict for a call with args and kwargs."""
+        if len(args) > len(self.names):
+            raise TypeError("Query takes %d parameters, %d given" % (len(self.names), len(args)))
+        params = dict(zip(self.names, args))
+        for name, value in kwargs.items():
+            if name not in self.names:
+                raise TypeError("Unknown query parameter %r" % name)
+            if name in params:
+                raise TypeError("Query parameter %r given twice" % name)
+            params[name] = value
+        missing = [ name for name in self.names if name not in params ]
+        if missing:
+            raise TypeError("Missing query parameters %s" % ", ".join(missing))
+        return params
+
+class QueryResult(object):
+    """
+    Rows returned by a query. The response is only decoded while iterating,
+    and each column gets the decoder of the first value found in it, or the
+    one for its type in the plan's column_types (Vertex, Edge, or None for
+    raw values). The decoders are kept in the plan for the next executions.
+    """
+
+    vertex_class = Vertex
+    edge_class = Edge
+
+    def __init__(self, engine, content, plan):
+        self._engine = engine
+        self._content = content
+        self._plan = plan
+
+    @property
+    def columns(self):
+        return self._content.columns
+
+    def __iter__(self):
+        positions = dict( (name, pos) for pos, name in enumerate(self.columns) )
+        for values in self._content.data:
+            decoders = self._plan.decoders or self._column_decoders(values)
+            yield Row([ decode(self, value) for decode, value in zip(decoders, values) ], positions)
+
+    def __len__(self):
+        return len(self._content.data)
+
+    def one(self):
+        """Return the first row, or None if there is none."""
+        for row in self:
+            return row
+
+    def _column_decoders(self, values):
+        cls = QueryResult
+        column_types = self._plan.column_types
+        decoders = []
+        resolved = True
+        for name, value in zip(self.columns, values):
+            if name in column_types:
+                decoders.append(self._decoder(column_types[name]))
+            elif is_vertex(value):
+                decoders.append(cls._vertex)
+            elif is_edge(value):
+                decoders.append(cls._edge)
+            else:
+                decoders.append(cls._value)
+                # a null or a list may hide an element column, look again
+                # in the next row
+                resolved = resolved and value is not None and not isinstance(value, list)
+        if resolved:
+            self._plan.decoders = decoders
+        return decoders
+
+    def _decoder(self, type):
+        if type is None:
+            return QueryResult._raw
+        elif issubclass(type, Vertex):
+            return QueryResult._vertex
+        elif issubclass(type, Edge):
+            return QueryResult._edge
+        raise TypeError("Only Vertex, Edge or None column types are supported")
+
+    def _raw(self, value):
+        return value
+
+    def _vertex(self, value):
+        if value is None:
+            return None
+        return self.vertex_class(self._engine, Neo4jElementContent(response=value))
+
+    def _edge(self, value):
+        if value is None:
+            return None
+        return self.edge_class(self._engine, Neo4jElementContent(response=value))
+
+    def _value(self, value):
+        if is_vertex(value):
+            return self._vertex(value)
+        elif is_edge(value):
+            return self._edge(value)
+        elif isinstance(value, list):
+            return [ self._value(v) for v in value ]
+        return value
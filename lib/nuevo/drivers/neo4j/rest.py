@@ -3,11 +3,22 @@
 import logging
 log = logging.getLogger(__name__)
 
-import requests, json
-from nuevo.drivers.neo4j.commands import JSONCommandEncoder, Neo4jBatchedCommand
+import requests, json, re, time, threading
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import EmptyPoolError
+from nuevo.drivers.neo4j.commands import Neo4jBatchedCommand, dumps
 from nuevo.drivers.neo4j.content import Neo4jContent
+from nuevo.drivers.neo4j.streaming import ByteCounter, CHUNK_SIZE, iter_array
 
 from nuevo.core.exceptions import NuevoException
+from nuevo.core.metrics import Metrics
+from nuevo.core import profile
+
+try:
+    basestring
+except NameError:
+    basestring = str
 
 class RESTException(NuevoException):
     
@@ -15,21 +26,160 @@ class RESTException(NuevoException):
         self.status = status
         super(RESTException, self).__init__(message)
 
-class Neo4jAtomicREST(object):
+def resource_kind(resource):
+    """
+    The kind of a resource for the metrics: its first segment, followed by
+    the sub-resource of nodes and relationships, e.g. node/relationships.
+    """
+    parts = [ part for part in resource.split('/') if part ]
+    if not parts:
+        return "root"
+    if parts[0].startswith('{'):
+        return "/".join(["reference"] + parts[1:2])
+    if parts[0] == "index" and len(parts) > 1:
+        return "index/%s" % parts[1]
+    if parts[0] in ("node", "relationship") and len(parts) > 2:
+        return "%s/%s" % (parts[0], parts[2])
+    return parts[0]
+
+class PoolTimeoutAdapter(HTTPAdapter):
+    """
+    HTTP adapter whose requests wait at most pool_timeout seconds for a free
+    connection of a blocking pool, and then raise a requests Timeout.
+    """
     
-    def __init__(self, base_url):
-        
-        self.session = requests.session(
-            headers = {
+    __attrs__ = HTTPAdapter.__attrs__ + ['pool_timeout']
+    
+    def __init__(self, pool_timeout=None, **kwargs):
+        # set before the pool manager is built by the base constructor
+        self.pool_timeout = pool_timeout
+        super(PoolTimeoutAdapter, self).__init__(**kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super(PoolTimeoutAdapter, self).init_poolmanager(*args, **kwargs)
+        manager = self.poolmanager
+        manager.pool_classes_by_scheme = dict(
+            (scheme, _waiting_pool(cls, self.pool_timeout))
+            for scheme, cls in manager.pool_classes_by_scheme.items() )
+    
+    def send(self, request, *args, **kwargs):
+        try:
+            return super(PoolTimeoutAdapter, self).send(request, *args, **kwargs)
+        except EmptyPoolError as ex:
+            raise requests.exceptions.Timeout(ex, request=request)
+
+def _waiting_pool(cls, pool_timeout):
+    """A subclass of the connection pool cls waiting pool_timeout seconds for a connection."""
+    def _get_conn(self, timeout=None):
+        return cls._get_conn(self, pool_timeout if timeout is None else timeout)
+    return type(cls.__name__, (cls,), dict(_get_conn=_get_conn))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def shared_session(base_url, pool_size=10, pool_timeout=60):
+    """
+    Return the requests session shared by every executor that talks to the
+    server at base_url with the same pool settings. It keeps up to
+    pool_size keep-alive connections. When all of them are in use, threads
+    wait for a free one, for at most pool_timeout seconds.
+    """
+    key = (base_url.rstrip('/'), pool_size, pool_timeout)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            session.headers.update({
                 'Accept':'application/json',
                 'Content-Type':'application/json'
-            }
-        )
-        
+            })
+            adapter = PoolTimeoutAdapter(pool_timeout, pool_connections=1, pool_maxsize=pool_size,
+                                         pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[key] = session
+        return session
+
+class StreamedItems(object):
+    """
+    Iterator over the items of the JSON array of a streamed response, each
+    one decoded as soon as it is received.
+
+    Until the items run out, the response holds a connection of the pool.
+    It is released when the iterator is closed or garbage collected, so an
+    iteration left halfway doesn't keep it.
+    """
+    
+    def __init__(self, resp, metrics, method, kind, sent, latency):
+        self._resp = resp
+        self._received = ByteCounter(resp.iter_content(CHUNK_SIZE))
+        self._items = iter_array(self._received)
+        self._decoding = 0.0
+        self._metrics = metrics
+        self._request = (method, kind, sent, latency)
+    
+    def __iter__(self):
+        return self
+    
+    def next(self):
+        if self._resp is None:
+            raise StopIteration
+        # only the time spent here, not in the caller between items
+        start = time.time()
+        try:
+            return next(self._items)
+        except Exception:
+            # the end of the items, or a failure reading them
+            self.close()
+            raise
+        finally:
+            self._decoding += time.time() - start
+    
+    __next__ = next
+    
+    def close(self):
+        """Release the connection of the response, if it is still held."""
+        resp, self._resp = self._resp, None
+        if resp is None:
+            return
+        resp.close()
+        method, kind, sent, latency = self._request
+        self._metrics.timing("decode", self._decoding)
+        self._metrics.request(method, kind, sent, self._received.count, resp.status_code,
+                              latency=latency)
+    
+    def __del__(self):
+        self.close()
+
+class Neo4jAtomicREST(object):
+    """
+    Executor that sends each command right away. With stream, the responses
+    that are JSON arrays are decoded item by item while they are iterated,
+    instead of being read whole; they can only be iterated once.
+    
+    Each streamed response holds a connection of the pool until it is read
+    to the end, closed or garbage collected. As the pool blocks when all its
+    connections are in use, iterating more streamed responses at once than
+    the pool_size of the engine, e.g. requesting the edges of every vertex
+    while iterating a streamed list of vertices, waits for pool_timeout and
+    fails. Read the outer response whole, with list(), in that case.
+    """
+    
+    def __init__(self, base_url, session=None, timeout=None, metrics=None, stream=False):
+        self.session = session or shared_session(base_url)
+        self.timeout = timeout
         self.base_url = base_url.rstrip('/')
+        self.metrics = metrics or Metrics()
+        self.stream = stream
+    
+    def owns(self, future):
+        """Whether future is a pending result of this executor."""
+        return False
     
     def execute(self, cmd, resp_cls=Neo4jContent):
         log.debug("EXEC: %s", cmd)
+        if self.stream and getattr(resp_cls, 'streamable', False):
+            return resp_cls(cid=None, response=self.iter_items(cmd))
         response = self.send(cmd)
         if response is not None:
             return resp_cls(cid=None, response=response)
@@ -37,36 +187,148 @@ class Neo4jAtomicREST(object):
             return None
     
     def send(self, cmd):
-        url  = self.base_url + cmd.resource
-        data = json.dumps(cmd, cls=JSONCommandEncoder)
-        log.debug("SEND: %s %s %s", cmd.method, url, data)
-        
-        try:
-            resp = self.session.request(cmd.method, url, data=data)
-            code = resp.status_code
-            cont = resp.content            
-            resp.raise_for_status()
-            if cont:
-                cont = json.loads(cont)
-            else:
-                cont = None
-            log.debug("RECV: %s %s", code, cont)
-            return cont
-        except requests.exceptions.HTTPError as ex:
+        return self.request(cmd)[0]
+    
+    def request(self, cmd):
+        """Send cmd, returning the decoded response and its headers."""
+        kind = resource_kind(cmd.resource)
+        resp, data, latency = self._open(cmd, kind)
+        return self.response(cmd, kind, len(data), latency, resp.status_code,
+                             resp.content), resp.headers
+    
+    def response(self, cmd, kind, sent, latency, code, content):
+        """
+        Account for the response to cmd, of sent bytes, and return its
+        decoded content, or raise a RESTException for an error status.
+        """
+        metrics = self.metrics
+        metrics.request(cmd.method, kind, sent, len(content), code, error=code >= 400,
+                        latency=latency)
+        if code >= 400:
+            raise RESTException(content, code)
+        start = time.time()
+        content = json.loads(content) if content else None
+        metrics.timing("decode", time.time() - start)
+        log.debug("RECV: %s %s", code, content)
+        return content
+    
+    def iter_items(self, cmd):
+        """
+        Send cmd and return an iterator over the items of the JSON array it
+        responds with, each one decoded as soon as it is received.
+        """
+        kind = resource_kind(cmd.resource)
+        resp, data, latency = self._open(cmd, kind, stream=True)
+        code = resp.status_code
+        if code >= 400:
+            cont = resp.content
+            self.metrics.request(cmd.method, kind, len(data), len(cont), code, error=True,
+                                 latency=latency)
             raise RESTException(cont, code)
+        return StreamedItems(resp, self.metrics, cmd.method, kind, len(data), latency)
+    
+    def _open(self, cmd, kind, stream=False):
+        """
+        Send cmd, returning the response, with its body not read yet, the
+        data sent and the time until the response headers.
+        """
+        data = self.encode(cmd)
+        try:
+            start = time.time()
+            resp = self.session.request(cmd.method, self.base_url + cmd.resource, data=data,
+                                        timeout=self.timeout, stream=stream)
+        except requests.RequestException:
+            self.metrics.request(cmd.method, kind, len(data), 0, error=True)
+            raise
+        latency = time.time() - start
+        self.answered(cmd, latency)
+        return resp, data, latency
+    
+    def encode(self, cmd):
+        start = time.time()
+        data = dumps(cmd)
+        self.metrics.timing("encode", time.time() - start)
+        log.debug("SEND: %s %s%s %s", cmd.method, self.base_url, cmd.resource, data)
+        return data
+    
+    def answered(self, cmd, latency):
+        """Account for the round trip of cmd, until the response headers."""
+        self.metrics.timing("network", latency)
+        profile.record_command("%s %s" % (cmd.method, cmd.resource), latency)
 
-class Neo4jBatchedREST(object):
+class BatchLimits(object):
+    """
+    Limits on the size of each /batch request sent when flushing a batch.
     
-    def __init__(self, base_url):
-        
-        self.session = requests.session(
-            headers = {
-                'Accept':'application/json',
-                'Content-Type':'application/json'
-            }
-        )
+    max_commands and max_bytes bound every request; None means unlimited.
+    With adaptive, the commands per request are tuned after every request so
+    that its round trip stays around target_latency seconds.
+    
+    A batch split in several requests is no longer atomic on the server: the
+    requests already sent stay committed if a later one fails.
+    """
+    
+    def __init__(self, max_commands=None, max_bytes=None,
+                 adaptive=False, target_latency=1.0, initial_commands=100):
+        self.max_commands = max_commands
+        self.max_bytes = max_bytes
+        self.adaptive = adaptive
+        self.target_latency = target_latency
         
+        self.commands = max_commands
+        if adaptive:
+            self.commands = min(initial_commands, max_commands or initial_commands)
+    
+    def full(self, commands, size):
+        """Whether a request with that many commands and bytes is too big."""
+        return (self.commands is not None and commands > self.commands) \
+            or (self.max_bytes is not None and size > self.max_bytes)
+    
+    def observe(self, commands, latency):
+        """Tune the commands per request after a round trip."""
+        if not self.adaptive:
+            return
+        if latency > self.target_latency:
+            self.commands = max(self.commands // 2, 1)
+        elif latency < self.target_latency / 2 and commands >= self.commands:
+            self.commands = self.commands * 2
+            if self.max_commands is not None:
+                self.commands = min(self.commands, self.max_commands)
+
+class Neo4jBatchedREST(object):
+    """
+    Executor that queues commands and sends them to /batch on flush.
+    
+    With stream, the sub-responses of each request are decoded, and their
+    futures materialized, one by one as they are received, instead of
+    reading the whole response first. With stream_requests, the commands are
+    encoded while the request is sent, instead of building the whole body
+    first.
+    
+    With more than one worker, the queued commands are split in groups that
+    share no {cid} references, elements nor indices, and the groups are sent
+    in parallel, each one in its own sequence of requests, on the threads of
+    pool. Commands on a relationship go with the ones on its nodes, and
+    deletes stay in their original order, in a single group.
+    
+    Each group is a separate transaction on the server, so a batch flushed
+    with several workers is not atomic: when a group fails, the others may
+    be committed already.
+    """
+    
+    ELEMENT = re.compile(r"/(?:node|relationship)/[0-9]+(?=/|$)|/index/(?:node|relationship)/[^/?]+")
+    
+    def __init__(self, base_url, limits=None, session=None, timeout=None, workers=1,
+                 metrics=None, stream=False, stream_requests=False, pool=None):
+        self.session = session or shared_session(base_url)
+        self.timeout = timeout
         self.base_url = base_url.rstrip('/')
+        self.limits = limits or BatchLimits()
+        self.workers = workers
+        self.pool = pool
+        self.metrics = metrics or Metrics()
+        self.stream = stream
+        self.stream_requests = stream_requests
         self._cid = 0
         
         self.batch   = []
@@ -78,40 +340,275 @@ class Neo4jBatchedREST(object):
         self._cid = self._cid + 1
         return _cid
     
+    def owns(self, future):
+        """Whether future is a pending result of this batch."""
+        cid = future._cid
+        return cid is not None and cid < len(self.futures) and self.futures[cid] is future
+    
     def execute(self, cmd, resp_cls=Neo4jContent):
+        start = time.time() if profile.active() else None
         cid = self.next_cid
         
         cmd = Neo4jBatchedCommand(cmd, cid)
         fut = resp_cls(cid=cid, response=None)
+        self.metrics.command(cmd.method, resource_kind(cmd.resource))
         
         self.batch.append(cmd)
         self.futures.append(fut)
         
+        if start is not None:
+            profile.record("build", time.time() - start)
         return fut
     
     def flush(self):
-        url  = "%s/batch" % self.base_url
-        data = json.dumps(self.batch, cls=JSONCommandEncoder)
-        log.debug("SEND: %s", data)
-
-        resp = self.session.request("POST", url, data=data)
+        """
+        Send the queued commands in as many /batch requests as the limits
+        require, rewriting the references to commands of previous requests.
+        """
+        results = {}
         try:
-            resp.raise_for_status()
-            responses = json.loads(resp.content)
-            log.debug("RECV: %s", responses) 
-
-            self.materialize(responses)
-            
-            self._cid = 0
-            self.batch = []
-            self.futures = []
-        except requests.HTTPError as err:
-            c = resp.content
-            if 'message' in c:
-                raise RESTException(c.message)
+            groups = self.groups(self.workers) if self.workers > 1 else []
+            if len(groups) > 1:
+                pool = self.pool or ThreadPool(len(groups))
+                try:
+                    pool.map(lambda positions: self.flush_group(positions, results), groups)
+                finally:
+                    if pool is not self.pool:
+                        pool.close()
             else:
-                raise RESTException(c.exception)
+                self.flush_group(range(len(self.batch)), results)
+        finally:
+            self.materialize(results)
+        self.reset()
+    
+    def flush_group(self, positions, results):
+        locations = {}
+        if self.stream_requests:
+            positions = list(positions)
+            while positions:
+                sent = self.send_stream(positions, locations, results)
+                positions = positions[sent:]
+            return
+        for chunk in self.chunks(locations, positions):
+            self.send_chunk(chunk, locations, results)
+    
+    def groups(self, count):
+        """
+        Split the positions of the queued commands in at most count lists,
+        so that commands referring to each other or to the same element, and
+        all the deletes, are in the same list.
+        """
+        parent = list(range(len(self.batch)))
+        def find(pos):
+            while parent[pos] != pos:
+                parent[pos] = parent[parent[pos]]
+                pos = parent[pos]
+            return pos
+        def union(a, b):
+            a, b = find(a), find(b)
+            parent[max(a, b)] = min(a, b)
+        
+        owners = {}
+        for pos, cmd in enumerate(self.batch):
+            for ref in cmd.refs:
+                union(pos, ref)
+            for element in self._elements(cmd):
+                union(pos, owners.setdefault(element, pos))
+            if cmd.method == "DELETE":
+                # deleting a node before its relationships fails
+                union(pos, owners.setdefault("DELETE", pos))
+        
+        components = {}
+        for pos in range(len(self.batch)):
+            components.setdefault(find(pos), []).append(pos)
+        
+        groups = [ [] for _ in range(min(count, len(components))) ]
+        for root in sorted(components):
+            min(groups, key=len).extend(components[root])
+        return [ sorted(group) for group in groups if group ]
+    
+    def _elements(self, cmd):
+        values = [cmd.resource]
+        values.extend(cmd.elements)
+        if isinstance(cmd.params, dict):
+            values.extend(cmd.params.values())
+        for value in values:
+            if isinstance(value, basestring):
+                for element in self.ELEMENT.findall(value):
+                    yield element
     
-    def materialize(self, responses):
-        for fut, response in zip(self.futures, responses):
-            fut.__materialize__(response['body'])
\ No newline at end of file
+    def chunks(self, locations, positions=None):
+        """
+        Yield the (position, encoded command) lists to send in each request.
+        Each list must be sent before asking for the next one, as commands
+        are encoded with the locations materialized so far.
+        """
+        if positions is None:
+            positions = range(len(self.batch))
+        chunk, size = [], 2
+        for pos in positions:
+            data = self.encode(self.batch[pos], locations)
+            if chunk and self.limits.full(len(chunk) + 1, size + len(data) + 1):
+                yield chunk
+                chunk, size = [], 2
+                data = self.encode(self.batch[pos], locations)
+            chunk.append((pos, data))
+            size += len(data) + 1
+        if chunk:
+            yield chunk
+    
+    def reset(self):
+        self._cid = 0
+        self.batch = []
+        self.futures = []
+    
+    def encode(self, cmd, locations):
+        start = time.time()
+        if cmd.refs and locations:
+            cmd = cmd.resolve(locations, self.base_url)
+        data = dumps(cmd)
+        self.metrics.timing("encode", time.time() - start)
+        return data
+    
+    def send_chunk(self, chunk, locations, results):
+        data = "[%s]" % ",".join(data for _, data in chunk)
+        log.debug("SEND: %s", data)
+        self.post(data, [ pos for pos, _ in chunk ], lambda: len(data), locations, results)
+    
+    def send_stream(self, positions, locations, results):
+        """
+        Send the commands at positions that fit in one request within the
+        limits, encoding them while the body is being sent with chunked
+        transfer encoding. Return how many were sent.
+        """
+        sent = []
+        body = ByteCounter(self.stream_body(positions, locations, sent))
+        # sent is complete once the body is, before the response is read
+        self.post(body, sent, lambda: body.count, locations, results)
+        return len(sent)
+    
+    def stream_body(self, positions, locations, sent):
+        """
+        Yield the body of a request with the commands at positions, in
+        pieces of about CHUNK_SIZE bytes, until the limits are reached. The
+        positions of the commands in the body are appended to sent.
+        """
+        debug = log.isEnabledFor(logging.DEBUG)
+        pieces, buffered, size = ["["], 1, 2
+        for pos in positions:
+            data = self.encode(self.batch[pos], locations)
+            if sent and self.limits.full(len(sent) + 1, size + len(data) + 1):
+                break
+            if debug:
+                log.debug("SEND: %s", data)
+            if sent:
+                pieces.append(",")
+                buffered += 1
+            pieces.append(data)
+            buffered += len(data)
+            size += len(data) + 1
+            sent.append(pos)
+            if buffered >= CHUNK_SIZE:
+                yield "".join(pieces).encode('utf-8')
+                pieces, buffered = [], 0
+        pieces.append("]")
+        yield "".join(pieces).encode('utf-8')
+    
+    def post(self, body, positions, size, locations, results):
+        """
+        Send a /batch request with body, for the commands at positions, and
+        collect its responses. size() is the number of bytes of the body.
+        """
+        url = "%s/batch" % self.base_url
+        metrics = self.metrics
+        start = time.time()
+        try:
+            resp = self.session.request("POST", url, data=body, timeout=self.timeout,
+                                        stream=self.stream)
+        except requests.RequestException:
+            metrics.request("POST", "batch", size(), 0, error=True)
+            raise
+        latency = time.time() - start
+        self.answered(len(positions), latency)
+        if resp.status_code >= 400 or not self.stream:
+            self.received(positions, size(), latency, resp.status_code, resp.content,
+                          locations, results)
+            return
+        
+        received = ByteCounter(resp.iter_content(CHUNK_SIZE))
+        start = time.time()
+        materializing = 0.0
+        try:
+            # each future is materialized as soon as its response is decoded,
+            # the responses aren't kept until the end of the flush
+            for pos, response in zip(positions, iter_array(received)):
+                self._locate(pos, response, locations)
+                started = time.time()
+                self._materialize(pos, response)
+                materializing += time.time() - started
+        finally:
+            resp.close()
+        metrics.timing("decode", time.time() - start - materializing)
+        profile.record("materialize", materializing)
+        metrics.request("POST", "batch", size(), received.count, resp.status_code,
+                        latency=latency)
+    
+    def answered(self, commands, latency):
+        """Account for the round trip of a request with that many commands."""
+        self.metrics.batch(commands)
+        self.metrics.timing("network", latency)
+        profile.record_command("POST /batch (%d commands)" % commands, latency)
+        self.limits.observe(commands, latency)
+    
+    def received(self, positions, sent, latency, code, content, locations, results):
+        """
+        Collect the whole response to a request of sent bytes with the
+        commands at positions, or raise a RESTException for an error status.
+        """
+        metrics = self.metrics
+        metrics.request("POST", "batch", sent, len(content), code, error=code >= 400,
+                        latency=latency)
+        if code >= 400:
+            raise RESTException(self._error_message(content), code)
+        start = time.time()
+        responses = json.loads(content)
+        metrics.timing("decode", time.time() - start)
+        log.debug("RECV: %s", responses)
+        self.collect(positions, responses, locations, results)
+    
+    def collect(self, positions, responses, locations, results):
+        """Keep the responses by position and the locations of new elements."""
+        for pos, response in zip(positions, responses):
+            results[pos] = response
+            self._locate(pos, response, locations)
+    
+    def _locate(self, pos, response, locations):
+        location = response.get('location')
+        body = response.get('body')
+        if location is None and isinstance(body, dict):
+            location = body.get('self')
+        if location is not None:
+            locations[self.batch[pos].id] = location
+    
+    def materialize(self, results):
+        """Materialize the futures of the responses, in the original order."""
+        if not results:
+            # streamed, they are materialized as they are received
+            return
+        start = time.time()
+        for pos in sorted(results):
+            self._materialize(pos, results[pos])
+        profile.record("materialize", time.time() - start)
+    
+    def _materialize(self, pos, response):
+        body = response.get('body')
+        if body is not None:
+            self.futures[pos].__materialize__(body)
+    
+    @staticmethod
+    def _error_message(content):
+        try:
+            error = json.loads(content)
+            return error.get('message') or error.get('exception')
+        except ValueError:
+            return content
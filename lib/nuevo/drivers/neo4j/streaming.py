@@ -0,0 +1,96 @@
+"""
+Incremental decoding of JSON array responses, one item at a time, as the
+bytes come from the socket.
+"""
+
+import codecs
+import json
+
+# bytes read from the socket at a time
+CHUNK_SIZE = 65536
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+class ByteCounter(object):
+    """Iterable over chunks of bytes that counts them as they go by."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.count = 0
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            self.count += len(chunk)
+            yield chunk
+
+def _skip(buf, pos):
+    while pos < len(buf) and buf[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+def iter_array(chunks, encoding='utf-8'):
+    """
+    Yield the items of the JSON array in chunks, an iterable of bytes, as
+    soon as each one is complete. Only the item being decoded and the rest
+    of the current chunk are kept in memory.
+    """
+    text = codecs.getincrementaldecoder(encoding)()
+    buf = ""
+    pos = 0
+    started = done = False
+    chunks = iter(chunks)
+    eof = False
+    # after failing to decode an incomplete item, wait until there is twice
+    # as much of it, so that big items are not decoded over and over
+    wanted = 0
+    while not done:
+        try:
+            chunk = next(chunks)
+            data = text.decode(chunk)
+        except StopIteration:
+            data = text.decode(b"", final=True)
+            eof = True
+        buf = buf[pos:] + data
+        pos = 0
+
+        while True:
+            pos = _skip(buf, pos)
+            if pos == len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("Expected a JSON array, got %r" % buf[pos:pos + 20])
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                done = True
+                break
+            if buf[pos] == ",":
+                pos += 1
+                continue
+            if len(buf) - pos < wanted and not eof:
+                break
+            try:
+                item, end = _decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                # the item is not complete yet
+                wanted = 2 * (len(buf) - pos)
+                break
+            # a number is only complete once the next item or the end of
+            # the array follows it
+            following = _skip(buf, end)
+            if following == len(buf) or buf[following] not in ",]":
+                if eof:
+                    raise ValueError("Invalid JSON array at %r" % buf[pos:following + 20])
+                wanted = len(buf) - pos + 1
+                break
+            wanted = 0
+            pos = end
+            yield item
+
+        if eof and not done:
+            raise ValueError("Truncated JSON array")
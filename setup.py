@@ -1,7 +1,8 @@
 from setuptools import setup, find_packages
 
 requires = [
-    "requests"
+    "requests",
+    "urllib3"
 ]
 
 setup(name='nuevo',
@@ -17,7 +18,11 @@ setup(name='nuevo',
     
     entry_points = {
         'nuevo.engines': [
-            'neo4j=nuevo.drivers.neo4j.engine:load'
+            'neo4j=nuevo.drivers.neo4j.engine:load',
+            'memory=nuevo.drivers.memory.engine:load'
+        ],
+        'console_scripts': [
+            'nuevo-load=nuevo.core.loader:main'
         ]
     }
 )
\ No newline at end of file
@@ -0,0 +1,339 @@
+
+import asyncio
+import json
+import re
+import threading
+
+class StubNeo4j(object):
+    """
+    A local HTTP server speaking a small subset of the Neo4j REST API,
+    enough to exercise the engines.
+    """
+    
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.nodes = {}
+        self.rels = {}
+        self.queries = {}
+        self.indices = {"node": {}, "relationship": {}}
+        self.traversals = {}
+        self.last_id = 0
+        self.requests = []
+        self.batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.writers = set()
+        # the next requests to drop without a response
+        self.hang_ups = 0
+        # (method, path) of the requests that fail with a server error
+        self.failing = set()
+    
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.base_url = "http://127.0.0.1:%d/db/data/" % port
+        return self.base_url
+    
+    async def stop(self):
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        await self.server.wait_closed()
+    
+    async def serve(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            await self._serve(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+    
+    async def _serve(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            method, target, _ = line.decode().split(" ", 2)
+            length = 0
+            chunked = False
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                key, _, value = line.decode().partition(":")
+                if key.lower() == "content-length":
+                    length = int(value)
+                elif key.lower() == "transfer-encoding":
+                    chunked = value.strip().lower() == "chunked"
+            if chunked:
+                body = await self._read_chunked(reader)
+            else:
+                body = await reader.readexactly(length) if length else b""
+            
+            self.requests.append((method, target))
+            if self.hang_ups:
+                self.hang_ups -= 1
+                break
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            await asyncio.sleep(self.delay)
+            self.in_flight -= 1
+            
+            path = target[len("/db/data"):]
+            if (method, path) in self.failing:
+                status, data, headers = 500, {"message": "Failing %s %s" % (method, path)}, {}
+            else:
+                status, data, headers = (self.handle(method, path, json.loads(body) if body else None)
+                                         + ({},))[:3]
+            content = json.dumps(data).encode() if data is not None else b""
+            head = "".join( "%s: %s\r\n" % item for item in headers.items() ).encode()
+            writer.write(b"HTTP/1.1 %d X\r\nContent-Type: application/json\r\n"
+                         b"Content-Length: %d\r\n" % (status, len(content)) + head + b"\r\n" + content)
+            await writer.drain()
+    
+    async def _read_chunked(self, reader):
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                await reader.readline()
+                return b"".join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+    
+    def drop_connections(self):
+        """Close the connections kept alive by the clients."""
+        for writer in list(self.writers):
+            writer.close()
+    
+    def url(self, path):
+        return self.base_url.rstrip("/") + path
+    
+    def node(self, id):
+        return {"self": self.url("/node/%d" % id), "data": self.nodes[id]}
+    
+    def rel(self, id):
+        start, label, end, data = self.rels[id]
+        return {"self": self.url("/relationship/%d" % id), "type": label, "data": data,
+                "start": self.url("/node/%d" % start), "end": self.url("/node/%d" % end)}
+    
+    def handle(self, method, path, body):
+        if method == "POST" and path == "/batch":
+            return self.batch(body)
+        if method == "POST" and path == "/node":
+            self.last_id += 1
+            self.nodes[self.last_id] = body or {}
+            return 201, self.node(self.last_id)
+        m = re.match(r"^/(node|relationship)/(\d+)(/properties(/[^/]+)?)?$", path)
+        if m:
+            return self.element(method, m.group(1), int(m.group(2)), m.group(3), m.group(4), body)
+        m = re.match(r"^/node/(\d+)/relationships(/(all|in|out)/?(.*))?$", path)
+        if m and method == "POST":
+            end = int(body["to"].rpartition("/")[-1])
+            if int(m.group(1)) not in self.nodes:
+                return 404, {"message": "Not found"}
+            if end not in self.nodes:
+                return 400, {"message": "Bad end node"}
+            self.last_id += 1
+            self.rels[self.last_id] = (int(m.group(1)), body["type"], end, body.get("data") or {})
+            return 201, self.rel(self.last_id)
+        if m and method == "GET":
+            id, direction = int(m.group(1)), m.group(3)
+            labels = [ l for l in m.group(4).split("&") if l ]
+            return 200, [ self.rel(r) for r, (start, label, end, _) in sorted(self.rels.items())
+                          if (not labels or label in labels)
+                          and ((direction != "in" and start == id) or (direction != "out" and end == id)) ]
+        m = re.match(r"^/node/(\d+)/traverse/(node|relationship)$", path)
+        if m and method == "POST":
+            return 200, self.traverse(int(m.group(1)), m.group(2), body)
+        m = re.match(r"^/node/(\d+)/paged/traverse/(node|relationship)\?pageSize=(\d+)&leaseTime=\d+$", path)
+        if m and method == "POST":
+            items = self.traverse(int(m.group(1)), m.group(2), body)
+            size = int(m.group(3))
+            self.last_id += 1
+            self.traversals[self.last_id] = (items[size:], size)
+            location = self.url("/node/%s/paged/traverse/%s/%d" % (m.group(1), m.group(2), self.last_id))
+            return 201, items[:size], {"Location": location}
+        m = re.match(r"^/node/\d+/paged/traverse/\w+/(\d+)$", path)
+        if m and method == "GET":
+            # an exhausted or expired traversal is gone
+            id = int(m.group(1))
+            items, size = self.traversals.get(id, ([], 0))
+            if not items:
+                self.traversals.pop(id, None)
+                return 404, {"message": "Traversal %d not found" % id}
+            self.traversals[id] = (items[size:], size)
+            return 200, items[:size]
+        m = re.match(r"^/index/(node|relationship)(/([^/]+)(/([^/]+)/([^/]+))?)?$", path)
+        if m:
+            return self.index(method, m.group(1), m.group(3), m.group(5), m.group(6), body)
+        if method == "POST" and path == "/cypher":
+            if body["query"] not in self.queries:
+                return 400, {"message": "Unknown query %s" % body["query"]}
+            columns, rows = self.queries[body["query"]](**body["params"])
+            return 200, {"columns": columns, "data": rows}
+        return 400, {"message": "Unsupported %s %s" % (method, path)}
+    
+    def element(self, method, type, id, properties, key, body):
+        store = self.nodes if type == "node" else self.rels
+        if id not in store:
+            return 404, {"message": "Not found"}
+        data = store[id] if store is self.nodes else store[id][3]
+        if method == "GET" and not properties:
+            return 200, self.node(id) if store is self.nodes else self.rel(id)
+        if method == "PUT" and properties and not key:
+            data.clear()
+            data.update(body)
+            return 204, None
+        if method == "PUT" and key:
+            data[key[1:]] = body
+            return 204, None
+        if method == "DELETE" and key:
+            if data.pop(key[1:], None) is None:
+                return 404, {"message": "No property %s" % key[1:]}
+            return 204, None
+        if method == "DELETE" and not properties:
+            if store is self.nodes and any( id in (start, end) for start, _, end, _ in self.rels.values() ):
+                return 409, {"message": "Node %d still has relationships" % id}
+            del store[id]
+            return 204, None
+        return 400, {"message": "Unsupported %s on %s %d" % (method, type, id)}
+    
+    def traverse(self, id, return_type, body):
+        """The elements at depth 1 of a traversal from node id."""
+        specs = body.get("relationships") or [{"direction": "all"}]
+        if "return_filter" in body:
+            direction = "in" if "getEndNode" in body["return_filter"]["body"] else "out"
+            specs = [{"direction": direction}]
+        items, seen = [], set()
+        for r, (start, label, end, _) in sorted(self.rels.items()):
+            for spec in specs:
+                if spec.get("type") not in (None, label):
+                    continue
+                direction = spec.get("direction", "all")
+                if direction != "in" and start == id:
+                    other = end
+                elif direction != "out" and end == id:
+                    other = start
+                else:
+                    continue
+                if return_type == "relationship":
+                    items.append(self.rel(r))
+                elif other not in seen:
+                    seen.add(other)
+                    items.append(self.node(other))
+                break
+        return items
+    
+    def index(self, method, type, name, key, value, body):
+        indices = self.indices[type]
+        if name is None and method == "GET":
+            if not indices:
+                return 204, None
+            return 200, dict( (name, self.index_description(type, name)) for name in indices )
+        if name is None and method == "POST":
+            indices.setdefault(body["name"], {})
+            return 201, self.index_description(type, body["name"])
+        if name not in indices:
+            return 404, {"message": "No %s index %s" % (type, name)}
+        if key is None and method == "POST":
+            element = body["uri"][len(self.url("")):]
+            indices[name].setdefault((body["key"], str(body["value"])), []).append(element)
+            return 201, self.handle("GET", element, None)[1]
+        if key is None and method == "DELETE":
+            del indices[name]
+            return 204, None
+        if method == "GET":
+            return 200, [ self.handle("GET", element, None)[1]
+                          for element in indices[name].get((key, value), []) ]
+        return 400, {"message": "Unsupported %s on index %s" % (method, name)}
+    
+    def index_description(self, type, name):
+        return {"template": self.url("/index/%s/%s/{key}/{value}" % (type, name)),
+                "provider": "lucene", "type": "exact"}
+    
+    def batch(self, jobs):
+        self.batches.append(jobs)
+        locations, results = {}, []
+        for job in jobs:
+            ref = lambda m: locations[int(m.group(1))]
+            to = re.sub(r"^{(\d+)}", lambda m: ref(m)[len(self.url("")):], job["to"])
+            body = json.loads(re.sub(r'"{(\d+)}', lambda m: '"' + ref(m), json.dumps(job.get("body"))))
+            status, data = self.handle(job["method"], to, body)[:2]
+            if status >= 400:
+                # the whole batch fails, like the transaction on the server
+                return 500, {"message": "Job %d failed with %d: %s" % (job["id"], status, data["message"])}
+            result = {"id": job["id"], "from": job["to"]}
+            if data is not None:
+                result["body"] = data
+                if isinstance(data, dict) and "self" in data:
+                    result["location"] = locations[job["id"]] = data["self"]
+            results.append(result)
+        return 200, results
+
+def with_stub(delay=0, options=""):
+    """Run an async test with a stub server and an engine pointing to it."""
+    def decorator(test):
+        def wrapper(*args, **kwargs):
+            from nuevo.drivers.neo4j.aio import AsyncNeo4jRESTEngine
+            
+            async def run():
+                stub = StubNeo4j(delay)
+                url = await stub.start()
+                engine = AsyncNeo4jRESTEngine(url + "?pool_size=4" + ("&" + options if options else ""))
+                try:
+                    await test(*args, stub=stub, engine=engine, **kwargs)
+                finally:
+                    await engine.close()
+                    await stub.stop()
+            asyncio.run(run())
+        # no functools.wraps, the test runner must not see the stub arguments
+        wrapper.__name__ = test.__name__
+        wrapper.__doc__ = test.__doc__
+        return wrapper
+    return decorator
+
+def start_stub(delay=0):
+    """
+    Run a stub server in an event loop of its own thread, for blocking
+    clients. Return the stub and a function that stops it.
+    """
+    stub = StubNeo4j(delay)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(stub.start())
+        started.set()
+        loop.run_forever()
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    started.wait()
+    
+    def stop():
+        asyncio.run_coroutine_threadsafe(stub.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+    return stub, stop
+
+def with_rest_stub(options="", delay=0):
+    """Run a test with a stub server and a blocking Neo4j engine pointing to it."""
+    def decorator(test):
+        def wrapper(*args, **kwargs):
+            from nuevo.drivers.neo4j.engine import Neo4jRESTEngine
+            
+            stub, stop = start_stub(delay)
+            try:
+                path = stub.base_url[len("http:"):]
+                engine = Neo4jRESTEngine("http", path + ("?" + options if options else ""))
+                test(*args, stub=stub, engine=engine, **kwargs)
+            finally:
+                stop()
+        wrapper.__name__ = test.__name__
+        wrapper.__doc__ = test.__doc__
+        return wrapper
+    return decorator
@@ -0,0 +1,312 @@
+import json
+
+from . import with_rest_stub
+
+@with_rest_stub("batch_max_commands=2")
+def test_split_max_commands(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    with engine.transaction():
+        vs = [ g.vertices.create(i=i) for i in range(5) ]
+    
+    assert [ len(jobs) for jobs in stub.batches ] == [2, 2, 1]
+    assert [ [ job["id"] for job in jobs ] for jobs in stub.batches ] == [[0, 1], [2, 3], [4]]
+    assert [ v['i'] for v in vs ] == list(range(5))
+    assert [ g.vertices.get(v.id)['i'] for v in vs ] == list(range(5))
+
+@with_rest_stub("stream_responses=1&batch_max_commands=2")
+def test_stream_materialize(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    with engine.profile() as p:
+        with engine.transaction():
+            vs = [ g.vertices.create(i=i) for i in range(5) ]
+    
+    # the futures of each request are materialized while it is read
+    assert p.report()['phases']['materialize']['count'] == 3
+    assert [ v['i'] for v in vs ] == list(range(5))
+    assert [ g.vertices.get(v.id)['i'] for v in vs ] == list(range(5))
+
+@with_rest_stub()
+def test_profile_build(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    with engine.profile() as p:
+        with engine.transaction():
+            vs = [ g.vertices.create(i=i) for i in range(3) ]
+        g.vertices.get(vs[0].id)
+    
+    phases = p.report()['phases']
+    # building the batch, not the atomic request
+    assert phases['build']['count'] == 3
+    assert phases['encode']['count'] == 4
+    assert phases['network']['count'] == 2
+    assert phases['materialize']['count'] == 1
+    assert "POST /batch (3 commands)" in str(p)
+
+@with_rest_stub("batch_max_bytes=250")
+def test_split_max_bytes(stub, engine):
+    from nuevo.drivers.neo4j.commands import dumps, Neo4jBatchedCommand, Neo4jRESTCommandFactory
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    size = len(dumps(Neo4jBatchedCommand(Neo4jRESTCommandFactory.create_node({'name': 'x' * 40}), 0)))
+    assert 2 * size + 3 <= 250 < 3 * size + 4
+    with engine.transaction():
+        vs = [ g.vertices.create(name=c * 40) for c in "abcde" ]
+    
+    assert [ len(jobs) for jobs in stub.batches ] == [2, 2, 1]
+    assert [ v['name'][0] for v in vs ] == list("abcde")
+
+@with_rest_stub("batch_max_bytes=10")
+def test_split_oversized_command(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    # a command over the limit still goes, alone in its request
+    with engine.transaction():
+        g.vertices.create(name='big')
+        g.vertices.create(name='bigger')
+    
+    assert [ len(jobs) for jobs in stub.batches ] == [1, 1]
+
+@with_rest_stub("batch_max_commands=1")
+def test_references_across_requests(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    with engine.transaction():
+        v1 = g.vertices.create(name='a')
+        v2 = g.vertices.create(name='b')
+        e1 = g.edges.create(v1, "knows", v2)
+        g.vertices.update(v2, name='c')
+    
+    assert len(stub.batches) == 4
+    # the references to the vertices of previous requests are resolved
+    create_edge, update = stub.batches[2][0], stub.batches[3][0]
+    assert create_edge["to"] == "/node/%d/relationships" % v1.id
+    assert create_edge["body"]["to"] == stub.url("/node/%d" % v2.id)
+    assert update["to"] == "/node/%d/properties" % v2.id
+    
+    assert list(v1.outE("knows")) == [e1]
+    assert g.vertices.get(v2.id)['name'] == 'c'
+
+def test_resolve():
+    from nuevo.drivers.neo4j.commands import Neo4jCommand, Neo4jBatchedCommand
+    
+    base_url = "http://localhost:7474/db/data"
+    cmd = Neo4jBatchedCommand(Neo4jCommand("POST", "{0}/relationships",
+                                           dict(to="{1}", type="knows", data={"ref": "{2}"})), 3)
+    assert cmd.refs == set([0, 1, 2])
+    
+    resolved = cmd.resolve({0: base_url + "/node/5", 1: base_url + "/node/6"}, base_url)
+    assert resolved.id == 3
+    assert resolved.resource == "/node/5/relationships"
+    assert resolved.params["to"] == base_url + "/node/6"
+    # references to commands of the same request stay
+    assert resolved.params["data"] == {"ref": "{2}"}
+    assert resolved.refs == set([2])
+    assert json.loads(json.dumps(resolved.params)) == resolved.params
+    
+    try:
+        Neo4jBatchedCommand(Neo4jCommand("GET", "{4}"), 4)
+        assert False, "Should have thrown!"
+    except ValueError:
+        pass
+
+def test_observe():
+    from nuevo.drivers.neo4j.rest import BatchLimits
+    
+    limits = BatchLimits(max_commands=10)
+    limits.observe(10, 100.0)
+    assert limits.commands == 10
+    
+    limits = BatchLimits(max_commands=300, adaptive=True, target_latency=1.0)
+    assert limits.commands == 100
+    limits.observe(100, 2.0)
+    assert limits.commands == 50
+    # faster than half the target, but a request smaller than the limit
+    limits.observe(20, 0.1)
+    assert limits.commands == 50
+    limits.observe(50, 0.1)
+    assert limits.commands == 100
+    limits.observe(100, 0.7)
+    assert limits.commands == 100
+    limits.observe(100, 0.1)
+    limits.observe(200, 0.1)
+    assert limits.commands == 300
+    
+    for _ in range(20):
+        limits.observe(limits.commands, 5.0)
+    assert limits.commands == 1
+    assert limits.full(2, 0) and not limits.full(1, 0)
+
+@with_rest_stub("batch_max_commands=2&batch_adaptive=1&batch_target_latency=0.01", delay=0.05)
+def test_adaptive_requests(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    with engine.transaction():
+        for i in range(4):
+            g.vertices.create(i=i)
+    
+    # every request is over the target latency, so the next one is halved
+    assert [ len(jobs) for jobs in stub.batches ] == [2, 1, 1]
+
+@with_rest_stub()
+def test_references(stub, engine):
+    from nuevo.core.graph import Graph
+    from nuevo.core.elements import Vertex
+    g = Graph(engine)
+    
+    i1 = g.indices.create("idx1", Vertex)
+    
+    requests = len(stub.requests)
+    with engine.transaction():
+        v1 = g.vertices.create(p1='string')
+        v2 = g.vertices.create()
+        e1 = g.edges.create(v1, "connected_to", v2)
+        i1.put(v1, "kk", "vv")
+        g.vertices.update(v2, p2=123)
+    
+    # the futures are referred to within the batch, which is a single request
+    assert stub.requests[requests:] == [("POST", "/db/data/batch")]
+    assert [ (job["method"], job["to"]) for job in stub.batches[0] ] == [
+        ("POST", "/node"), ("POST", "/node"), ("POST", "{0}/relationships"),
+        ("POST", "/index/node/idx1"), ("PUT", "{1}/properties")]
+    assert stub.batches[0][2]["body"]["to"] == "{1}"
+    assert stub.batches[0][3]["body"]["uri"] == "{0}"
+    
+    assert list(i1.lookup("kk", "vv")) == [v1]
+    assert list(v1.outE()) == [e1]
+    assert g.vertices.get(v2.id)['p2'] == 123
+
+@with_rest_stub("batch_workers=3")
+def test_groups(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    v5, v6, v7, v8 = [ g.vertices.create() for _ in range(4) ]
+    e1 = g.edges.create(v5, "knows", v6)
+    e2 = g.edges.create(v7, "knows", v8)
+    
+    with engine.transaction():
+        g.edges.delete(e1)
+        g.vertices.delete(v5)
+        g.vertices.delete(v6)
+        g.vertices.update(v7, name='a')
+        # a relationship goes with its nodes
+        e2['weight'] = 1
+        e2.save()
+        g.vertices.update(v8, name='b')
+        assert engine.rest.groups(3) == [[0, 1, 2], [3, 4, 5]]
+    
+    assert sorted(stub.nodes) == [v7.id, v8.id]
+    assert stub.nodes[v7.id] == {'name': 'a'} and stub.nodes[v8.id] == {'name': 'b'}
+    assert stub.rels[e2.id][3] == {'weight': 1}
+    assert len(stub.batches) == 2
+    
+    with engine.transaction():
+        g.vertices.update(v7, name='c')
+        g.edges.create(v8, "knows", v7)
+        g.vertices.update(v8, name='d')
+        g.vertices.create()
+        assert engine.rest.groups(3) == [[0, 1, 2], [3]]
+
+@with_rest_stub("batch_workers=3")
+def test_groups_deletes(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    v5, v6, v7 = [ g.vertices.create() for _ in range(3) ]
+    e1 = g.edges.create(v5, "knows", v6)
+    
+    # without the nodes of the relationship, the deletes keep their order
+    with engine.transaction():
+        g.edges.delete(e1.id)
+        g.vertices.update(v7, name='a')
+        g.vertices.delete(v5.id)
+        g.vertices.delete(v6.id)
+        assert engine.rest.groups(3) == [[0, 2, 3], [1]]
+        assert [ cmd.resource for cmd in engine.rest.batch ] == [
+            "/relationship/%d" % e1.id, "/node/%d/properties" % v7.id,
+            "/node/%d" % v5.id, "/node/%d" % v6.id]
+    
+    assert sorted(stub.nodes) == [v7.id] and stub.rels == {}
+
+@with_rest_stub("batch_workers=2", delay=0.1)
+def test_groups_parallel(stub, engine):
+    import threading
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    vs = [ g.vertices.create() for _ in range(4) ]
+    stub.max_in_flight = 0
+    for i in range(2):
+        with engine.transaction():
+            for v in vs:
+                g.vertices.update(v, i=i)
+    assert stub.max_in_flight == 2
+    assert [ stub.nodes[v.id] for v in vs ] == [{'i': 1}] * 4
+    
+    # the batches share the threads of the engine
+    threads = threading.active_count()
+    with engine.transaction():
+        for v in vs:
+            g.vertices.update(v, i=2)
+    assert threading.active_count() == threads
+    assert engine.batch_pool is engine.batch_pool
+
+@with_rest_stub("batch_max_commands=1")
+def test_partial_session_flush(stub, engine):
+    import sys
+    import types
+    from nuevo.core.graph import Graph
+    from nuevo.core.exceptions import NuevoException
+    # nuevo.ogm isn't part of this tree, a stand-in without models is enough
+    if 'nuevo.ogm.model' not in sys.modules:
+        ogm = types.ModuleType('nuevo.ogm')
+        model = types.ModuleType('nuevo.ogm.model')
+        model.Node = type('Node', (object,), dict(_model_registry={}))
+        model.NodeProxy = lambda engine, indices: None
+        ogm.model = model
+        sys.modules['nuevo.ogm'] = ogm
+        sys.modules['nuevo.ogm.model'] = model
+    from nuevo.core import sessions
+    g = Graph(engine)
+    
+    create_engine = sessions.create_engine
+    sessions.create_engine = lambda url: engine
+    try:
+        sessions.Session.bind("stub")
+        db = sessions.Session()
+    finally:
+        sessions.create_engine = create_engine
+    
+    v1 = g.vertices.create()
+    v2 = g.vertices.create()
+    e1 = g.edges.create(v1, "knows", v2)
+    
+    # each command goes in a request of its own, so the creates are
+    # committed when the delete fails
+    v3 = db.vertices.create(name='a')
+    v4 = db.vertices.create(name='b')
+    db.vertices.delete(v1)
+    try:
+        db.flush()
+        assert False, "Should have thrown!"
+    except NuevoException:
+        pass
+    assert g.vertices.get(v3.id)['name'] == 'a'
+    assert g.vertices.get(v4.id)['name'] == 'b'
+    assert db._new == [] and db._deleted == [v1]
+    
+    # the created elements are tracked, and not created again
+    v3['name'] = 'c'
+    db.edges.delete(e1)
+    db.flush()
+    assert sorted(stub.nodes) == [v2.id, v3.id, v4.id]
+    assert stub.nodes[v3.id] == {'name': 'c'}
@@ -0,0 +1,255 @@
+
+import asyncio
+
+from . import with_stub
+
+@with_stub()
+async def test_vertex_crud(stub, engine):
+    from nuevo.core.aio import AsyncGraph
+    from nuevo.core.exceptions import NotFoundException
+    g = AsyncGraph(engine)
+    
+    v1 = await g.vertices.create(p1='string', p2=None)
+    assert isinstance(v1.id, int)
+    assert dict(v1._content.data) == {'p1': 'string'}
+    
+    v2 = await g.vertices.get(v1.id)
+    assert v1 == v2
+    
+    await g.vertices.update(v1, p3=123)
+    assert (await g.vertices.get(v1.id))['p3'] == 123
+    
+    await g.vertices.delete(v1)
+    try:
+        await g.vertices.get(v1.id)
+        assert False, "Should have thrown!"
+    except NotFoundException:
+        pass
+
+@with_stub()
+async def test_edges(stub, engine):
+    from nuevo.core.aio import AsyncGraph
+    g = AsyncGraph(engine)
+    
+    v1 = await g.vertices.create()
+    v2 = await g.vertices.create()
+    e1 = await g.edges.create(v1, "connected_to", v2, p1='caca')
+    
+    edgs = [ e async for e in v1.outE("connected_to") ]
+    assert edgs == [e1]
+    assert await v2.inE() == [e1]
+    assert await v2.outE() == []
+    
+    assert await e1.outV == v1
+    assert await e1.inV == v2
+
+@with_stub(delay=0.05)
+async def test_concurrent_requests(stub, engine):
+    from nuevo.core.aio import AsyncGraph
+    g = AsyncGraph(engine)
+    
+    vs = await asyncio.gather(*[ g.vertices.create(i=i) for i in range(12) ])
+    got = await asyncio.gather(*[ g.vertices.get(v.id) for v in vs ])
+    
+    assert [ v['i'] for v in got ] == list(range(12))
+    assert 1 < stub.max_in_flight <= 4
+
+@with_stub()
+async def test_transaction(stub, engine):
+    from nuevo.core.aio import AsyncGraph
+    g = AsyncGraph(engine)
+    
+    async with engine.transaction():
+        v1 = await g.vertices.create(p1='a')
+        v2 = await g.vertices.create(p1='b')
+        e1 = await g.edges.create(v1, "connected_to", v2)
+    
+    assert stub.requests == [("POST", "/db/data/batch")]
+    assert await v1.outE() == [e1]
+    assert (await e1.inV)['p1'] == 'b'
+
+@with_stub()
+async def test_cypher(stub, engine):
+    from nuevo.core.aio import AsyncGraph, AsyncVertex, AsyncEdge
+    g = AsyncGraph(engine)
+    
+    v1 = await g.vertices.create(name='a')
+    v2 = await g.vertices.create(name='b')
+    e1 = await g.edges.create(v1, "knows", v2)
+    
+    def neighbours(id):
+        return ["n", "r", "name"], [ [stub.node(id), stub.rel(r), stub.nodes[end]["name"]]
+                                     for r, (start, _, end, _) in stub.rels.items() if start == id ]
+    stub.queries["START n=node({id}) MATCH n-[r]->m RETURN n, r, m.name"] = neighbours
+    
+    result = await engine.query("cypher", "START n=node({id}) MATCH n-[r]->m RETURN n, r, m.name",
+                                dict(id=v1.id))
+    assert result.columns == ["n", "r", "name"]
+    rows = list(result)
+    assert len(rows) == 1
+    n, r, name = rows[0]
+    assert isinstance(n, AsyncVertex) and n == v1
+    assert isinstance(r, AsyncEdge) and r == e1
+    assert name == rows[0]["name"] == 'b'
+
+@with_stub()
+async def test_prepared_query(stub, engine):
+    from nuevo.core.aio import AsyncGraph
+    g = AsyncGraph(engine)
+    
+    vs = [ await g.vertices.create(name=name) for name in "abc" ]
+    stub.queries["START n=node({id}) RETURN n.name"] = lambda id: (["n.name"], [[stub.nodes[id]["name"]]])
+    
+    name = engine.prepare("cypher", "START n=node({id}) RETURN n.name", ["id"])
+    assert (await name(vs[0].id)).one()[0] == 'a'
+    
+    requests = len(stub.requests)
+    async with engine.transaction():
+        results = [ await name(id=v.id) for v in vs[1:] ]
+    assert len(stub.requests) == requests + 1
+    assert [ r.one()["n.name"] for r in results ] == ['b', 'c']
+    
+    try:
+        await name(vs[0].id, id=vs[0].id)
+        assert False, "Should have thrown!"
+    except TypeError:
+        pass
+
+@with_stub()
+async def test_stats(stub, engine):
+    from nuevo.core.aio import AsyncGraph
+    g = AsyncGraph(engine)
+    
+    v1 = await g.vertices.create()
+    async with engine.transaction():
+        await g.vertices.create()
+        await g.edges.create(v1, "connected_to", v1)
+    try:
+        await g.vertices.get(-1)
+    except Exception:
+        pass
+    
+    stats = engine.stats(reset=True)
+    assert stats['requests']['POST node']['count'] == 1
+    assert stats['requests']['POST batch']['count'] == 1
+    assert stats['requests']['GET node']['errors'] == 1
+    assert stats['commands'] == {'POST node': 1, 'POST node/relationships': 1}
+    assert stats['batch_sizes']['count'] == 1 and stats['batch_sizes']['sum'] == 2
+    assert stats['timings']['network']['count'] == 3
+    # the network time of each request by method and kind
+    assert stats['latencies']['POST node']['count'] == 1
+    assert stats['latencies']['POST batch']['count'] == 1
+    assert stats['latencies']['GET node']['count'] == 1
+    assert sum( h['count'] for h in stats['latencies'].values() ) == 3
+    
+    assert engine.stats()['requests'] == {}
+
+@with_stub()
+async def test_indices(stub, engine):
+    from nuevo.core.aio import AsyncGraph
+    from nuevo.core.elements import Vertex
+    g = AsyncGraph(engine)
+    
+    people = await g.indices.get_create("people", Vertex)
+    v1 = await g.vertices.create(name='a')
+    await people.put(v1, "name", "a")
+    assert await people.lookup("name", "a") == [v1]
+    
+    # the index catalog is loaded, a warm get_create makes no request
+    requests = len(stub.requests)
+    assert await g.indices.get_create("people", Vertex) == people
+    assert len(stub.requests) == requests
+
+@with_stub(options="cache_size=10")
+async def test_cache(stub, engine):
+    from nuevo.core.aio import AsyncGraph
+    g = AsyncGraph(engine)
+    
+    v1 = await g.vertices.create(name='a')
+    requests = len(stub.requests)
+    assert (await g.vertices.get(v1.id))._content is v1._content
+    assert len(stub.requests) == requests
+
+@with_stub()
+async def test_neighbours(stub, engine):
+    from nuevo.core.aio import AsyncGraph
+    g = AsyncGraph(engine)
+    
+    v1, v2, v3 = [ await g.vertices.create(i=i) for i in range(3) ]
+    await g.edges.create(v1, "knows", v2)
+    await g.edges.create(v3, "likes", v1)
+    
+    assert await v1.outV() == [v2]
+    assert await v1.inV() == [v3]
+    assert await v1.bothV() == [v2, v3]
+    assert await v1.bothV("likes") == [v3]
+    assert await v2.outV("knows") == []
+
+@with_stub()
+async def test_lazy_elements(stub, engine):
+    import gc
+    import warnings
+    from nuevo.core.aio import AsyncGraph
+    g = AsyncGraph(engine)
+    
+    v1 = await g.vertices.create()
+    v2 = await g.vertices.create()
+    e1 = await g.edges.create(v1, "knows", v2)
+    
+    requests = len(stub.requests)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        edges = v1.outE()
+        v1.outV()
+        e1.inV.close()
+        del edges
+        gc.collect()
+    assert caught == []
+    assert len(stub.requests) == requests
+    
+    # each await sends the request again
+    edges = v1.outE()
+    assert await edges == [e1]
+    assert [ e async for e in edges ] == [e1]
+    assert len(stub.requests) == requests + 2
+
+@with_stub(options="bulk_size=2")
+async def test_create_many_bulk_size(stub, engine):
+    from nuevo.core.aio import AsyncGraph
+    g = AsyncGraph(engine)
+    
+    vs = await g.vertices.create_many([ dict(i=i) for i in range(5) ])
+    assert [ v['i'] for v in vs ] == list(range(5))
+    es = await g.edges.create_many([ (vs[0], "knows", v, {}) for v in vs[1:] ])
+    assert await vs[0].outE() == es
+    
+    assert stub.requests[:5] == [("POST", "/db/data/batch")] * 5
+    assert [ len(jobs) for jobs in stub.batches ] == [2, 2, 1, 2, 2]
+
+@with_stub()
+async def test_stale_connection(stub, engine):
+    from nuevo.core.aio import AsyncGraph
+    g = AsyncGraph(engine)
+    
+    v1 = await g.vertices.create()
+    # the idle connection is closed by the server, the request goes on another
+    stub.drop_connections()
+    await asyncio.sleep(0.05)
+    assert await g.vertices.get(v1.id) == v1
+    assert stub.requests == [("POST", "/db/data/node"), ("GET", "/db/data/node/%d" % v1.id)]
+
+@with_stub()
+async def test_no_resend(stub, engine):
+    from nuevo.core.aio import AsyncGraph
+    g = AsyncGraph(engine)
+    
+    await g.vertices.create()
+    # the server got the request, but closed the connection before responding
+    stub.hang_ups = 1
+    try:
+        await g.vertices.create()
+        assert False, "Should have thrown!"
+    except ConnectionError:
+        pass
+    assert stub.requests == [("POST", "/db/data/node")] * 2
+    assert len(stub.nodes) == 1
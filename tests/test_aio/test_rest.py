@@ -0,0 +1,350 @@
+from . import with_rest_stub
+
+@with_rest_stub()
+def test_cache_off(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    v1 = g.vertices.create(name='a')
+    requests = len(stub.requests)
+    g.vertices.get(v1.id)
+    g.vertices.get(v1.id)
+    assert len(stub.requests) == requests + 2
+    assert engine.stats()['cache']['max_size'] == 0
+
+@with_rest_stub()
+def test_save_unsaved_keys(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    v1 = g.vertices.create(name='a')
+    # keys that were never stored are not deleted, which would fail
+    v1['x'] = 1
+    del v1['x']
+    v1['new'] = None
+    requests = len(stub.requests)
+    v1.save()
+    assert len(stub.requests) == requests
+    
+    v1['name'] = None
+    v1['y'] = 2
+    del v1['y']
+    v1.save()
+    assert stub.requests[requests:] == [
+        ("DELETE", "/db/data/node/%d/properties/name" % v1.id)]
+    assert list(g.vertices.get(v1.id)) == []
+    assert list(v1) == []
+
+@with_rest_stub("cache_size=100")
+def test_cache_invalidation(stub, engine):
+    from nuevo.core.graph import Graph
+    from nuevo.core.exceptions import NotFoundException
+    g = Graph(engine)
+    
+    # created elements are cached
+    v1 = g.vertices.create(name='a')
+    v2 = g.vertices.create(name='b')
+    e1 = g.edges.create(v1, "knows", v2)
+    requests = len(stub.requests)
+    assert g.vertices.get(v1.id)._content is v1._content
+    assert g.edges.get(e1.id)._content is e1._content
+    assert len(stub.requests) == requests
+    
+    # an update through the element changes the cached content in place
+    g.vertices.update(v1, name='c')
+    assert g.vertices.get(v1.id)['name'] == 'c'
+    v1['name'] = 'd'
+    v1.save()
+    assert g.vertices.get(v1.id)['name'] == 'd'
+    assert len(stub.requests) == requests + 2
+    
+    # an update by id evicts it
+    g.vertices.update(v2.id, name='e')
+    assert g.vertices.get(v2.id)['name'] == 'e'
+    assert len(stub.requests) == requests + 4
+    
+    g.edges.update(e1.id, weight=1)
+    assert g.edges.get(e1.id)['weight'] == 1
+    assert len(stub.requests) == requests + 6
+    
+    # deletes evict it
+    g.edges.delete(e1)
+    g.vertices.delete(v1)
+    for get, id in ((g.edges.get, e1.id), (g.vertices.get, v1.id)):
+        try:
+            get(id)
+            assert False, "Should have thrown!"
+        except NotFoundException:
+            pass
+    
+    stats = engine.stats()['cache']
+    assert stats['hits'] == 4 and stats['max_size'] == 100
+
+@with_rest_stub("cache_size=100&cache_ttl=0.05")
+def test_cache_ttl(stub, engine):
+    import time
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    v1 = g.vertices.create(name='a')
+    # a change by another client is seen once the entry expires
+    stub.nodes[v1.id]['name'] = 'b'
+    assert g.vertices.get(v1.id)['name'] == 'a'
+    time.sleep(0.1)
+    assert g.vertices.get(v1.id)['name'] == 'b'
+
+@with_rest_stub()
+def test_index_catalog(stub, engine):
+    from nuevo.core.graph import Graph
+    from nuevo.core.elements import Vertex, Edge
+    from nuevo.core.exceptions import NotFoundException
+    g = Graph(engine)
+    
+    i1 = g.indices.get_create("people", Vertex)
+    assert stub.requests == [("GET", "/db/data/index/node"), ("POST", "/db/data/index/node")]
+    
+    # a warm get_create makes no request, not even from another engine
+    requests = len(stub.requests)
+    assert g.indices.get_create("people", Vertex) == i1
+    other = Graph(type(engine)("http", stub.base_url[len("http:"):]))
+    assert other.indices.get("people", Vertex)._content == i1._content
+    assert len(stub.requests) == requests
+    
+    # neither does looking for a missing index again
+    for _ in range(2):
+        try:
+            g.indices.get("places", Vertex)
+            assert False, "Should have thrown!"
+        except NotFoundException:
+            pass
+    assert len(stub.requests) == requests
+    
+    # until it is created
+    i2 = g.indices.create("places", Vertex)
+    assert g.indices.get("places", Vertex) == i2
+    assert len(stub.requests) == requests + 1
+    
+    # each type has its own listing
+    g.indices.get_create("people", Edge)
+    assert stub.requests[requests + 1:] == [("GET", "/db/data/index/relationship"),
+                                            ("POST", "/db/data/index/relationship")]
+
+def test_shared_session():
+    import threading
+    from nuevo.drivers.neo4j.rest import shared_session
+    
+    url = "http://shared-session.test:7474/db/data/"
+    session = shared_session(url, 4)
+    assert shared_session(url.rstrip("/"), 4) is session
+    # each pool size and timeout has its own session
+    assert shared_session(url, 8) is not session
+    assert shared_session(url, 4, pool_timeout=1) is not session
+    
+    url = "http://shared-session.test:7474/other/"
+    barrier = threading.Barrier(8)
+    sessions = []
+    def get():
+        barrier.wait()
+        sessions.append(shared_session(url, 4))
+    threads = [ threading.Thread(target=get) for _ in range(8) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(sessions) == 8 and all( s is sessions[0] for s in sessions )
+
+@with_rest_stub("pool_size=1&pool_timeout=0.1", delay=0.5)
+def test_pool_timeout(stub, engine):
+    import threading
+    import time
+    import requests
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    # the only connection is busy with a slow request
+    thread = threading.Thread(target=g.vertices.create)
+    thread.start()
+    time.sleep(0.1)
+    start = time.time()
+    try:
+        g.vertices.create()
+        assert False, "Should have thrown!"
+    except requests.exceptions.Timeout:
+        pass
+    assert time.time() - start < 0.4
+    thread.join()
+    assert len(stub.nodes) == 1
+    assert engine.stats()['requests']['POST node']['errors'] == 1
+    # the request without a response has no latency
+    assert engine.stats()['latencies']['POST node']['count'] == 1
+
+@with_rest_stub("stream_responses=1&pool_size=1&pool_timeout=0.1")
+def test_stream_release(stub, engine):
+    import gc
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    v1 = g.vertices.create(name='a')
+    for i in range(3):
+        g.edges.create(v1, "knows", g.vertices.create(i=i))
+    
+    # a streamed response left halfway holds the only connection until it
+    # is closed or dropped
+    edges = iter(v1.outE())
+    next(edges)
+    del edges
+    gc.collect()
+    assert g.vertices.get(v1.id)['name'] == 'a'
+    assert engine.stats()['requests']['GET node/relationships']['count'] == 1
+
+@with_rest_stub()
+def test_future_hash(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    with engine.transaction():
+        v1 = g.vertices.create(name='a')
+        # the id, and so the hash, isn't known yet
+        try:
+            hash(v1)
+            assert False, "Should have thrown!"
+        except TypeError:
+            pass
+        assert v1 == v1 and v1 != g.vertices.create(name='a')
+    
+    v2 = g.vertices.get(v1.id)
+    assert hash(v1) == hash(v2) and set([v1, v2]) == set([v1])
+
+@with_rest_stub()
+def test_content_mapping(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    content = g.vertices.create(name='a', age=3)._content
+    assert content['name'] == 'a' and 'age' in content and 'self' not in content
+    assert sorted(content) == ['age', 'name'] and len(content) == 2
+    content['name'] = 'b'
+    assert content.data == {'name': 'b', 'age': 3}
+
+@with_rest_stub()
+def test_base_url_slash(stub, engine):
+    from nuevo.core.graph import Graph
+    from nuevo.core.elements import Vertex, Edge
+    
+    path = stub.base_url[len("http:"):]
+    for i, base in enumerate((path, path.rstrip("/"))):
+        g = Graph(type(engine)("http", base))
+        v1 = g.vertices.create(name='a')
+        v2 = g.vertices.create(name='b')
+        e1 = g.edges.create(v1, "knows", v2)
+        
+        # the endpoints are parsed from the URLs in the responses
+        e2 = g.edges.get(e1.id)
+        assert e2.outV == v1 and e2.inV == v2
+        assert (e2._content.out_id, e2._content.in_id) == (v1.id, v2.id)
+        
+        people = g.indices.create("people%d" % i, Vertex)
+        links = g.indices.create("links%d" % i, Edge)
+        people.put(v1, "name", "a")
+        links.put(e1, "kind", "x")
+        assert list(people.lookup("name", "a")) == [v1]
+        assert list(links.lookup("kind", "x")) == [e1]
+        assert stub.requests[-1] == ("GET", "/db/data/index/relationship/links%d/kind/x" % i)
+
+@with_rest_stub()
+def test_bfs(stub, engine):
+    from nuevo.core.graph import Graph
+    from nuevo.core.traversal import bfs, shortest_path
+    g = Graph(engine)
+    
+    v = [ g.vertices.create(i=i) for i in range(7) ]
+    for a, b in ((0, 1), (0, 2), (1, 3), (2, 3), (2, 4), (4, 5), (6, 0)):
+        g.edges.create(v[a], "knows", v[b])
+    
+    requests = len(stub.requests)
+    batches = len(stub.batches)
+    visited = [ (vertex['i'], depth) for vertex, depth in bfs(v[0], labels=["knows"]) ]
+    assert visited == [(0, 0), (1, 1), (2, 1), (3, 2), (4, 2), (5, 3)]
+    # each level is a single batch, with a traversal per vertex of the frontier
+    assert stub.requests[requests:] == [("POST", "/db/data/batch")] * 4
+    assert [ len(jobs) for jobs in stub.batches[batches:] ] == [1, 2, 2, 1]
+    assert all( job["to"] == "/node/%d/traverse/node" % v[i].id
+                for jobs, level in zip(stub.batches[batches:], ([0], [1, 2], [3, 4], [5]))
+                for job, i in zip(jobs, level) )
+    
+    assert [ (vertex['i'], depth) for vertex, depth in bfs(v[0], direction="in") ] == [(0, 0), (6, 1)]
+    assert [ vertex['i'] for vertex in shortest_path(v[6], v[5]) ] == [6, 0, 2, 4, 5]
+
+def star(g, size):
+    center = g.vertices.create(name='center')
+    others = [ g.vertices.create(i=i) for i in range(size) ]
+    edges = [ g.edges.create(center, "knows", v, i=i) for i, v in enumerate(others) ]
+    return center, others, edges
+
+@with_rest_stub()
+def test_paged_traversal(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    center, others, edges = star(g, 7)
+    requests = len(stub.requests)
+    pages = engine.out_edges(center, (), 3).pages()
+    assert [ [ e['i'] for e in page ] for page in pages ] == [[0, 1, 2], [3, 4, 5], [6]]
+    assert [ method for method, _ in stub.requests[requests:] ] == ["POST", "GET", "GET"]
+    assert list(center.outV(page_size=3)) == others
+    
+    # the endpoints are fetched a page at a time, in one batch each
+    batches = len(stub.batches)
+    found = list(center.outE(page_size=3, prefetch=True))
+    assert found == edges
+    assert [ e._inV for e in found ] == others and all( e._outV == center for e in found )
+    assert [ len(jobs) for jobs in stub.batches[batches:] ] == [4, 4, 2]
+
+@with_rest_stub("page_prefetch=0")
+def test_paged_traversal_expired(stub, engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    center, others, edges = star(g, 7)
+    pages = center.outE(page_size=3).pages()
+    assert len(next(pages)) == 3
+    assert len(next(pages)) == 3
+    # the lease ran out, the traversal ends early
+    stub.traversals.clear()
+    assert list(pages) == []
+    assert stub.requests[-1][0] == "GET"
+
+@with_rest_stub()
+def test_paged_traversal_error(stub, engine):
+    import sys
+    import traceback
+    from nuevo.core.graph import Graph
+    from nuevo.drivers.neo4j.rest import RESTException
+    g = Graph(engine)
+    
+    center, others, edges = star(g, 5)
+    stub.failing.add(("GET", "/node/%d/paged/traverse/relationship/%d"
+                             % (center.id, stub.last_id + 1)))
+    pages = center.outE(page_size=2).pages()
+    assert len(next(pages)) == 2
+    # the error of the page fetched in the background is raised when it's needed
+    try:
+        next(pages)
+        assert False, "Should have thrown!"
+    except RESTException as ex:
+        assert ex.status == 500
+        # with the traceback of the background thread
+        frames = traceback.extract_tb(sys.exc_info()[2])
+        assert "_next" in [ frame[2] for frame in frames ]
+
+def test_load():
+    from nuevo.drivers.neo4j.engine import Neo4jRESTEngine, load
+    from nuevo.drivers.neo4j.aio import AsyncNeo4jRESTEngine
+    assert load() is Neo4jRESTEngine
+    
+    engine = load()("http", "//localhost:7474/db/data")
+    assert isinstance(engine, Neo4jRESTEngine)
+    assert engine.base_url == "http://localhost:7474/db/data/"
+    engine = load()("async", "http://localhost:7474/db/data/")
+    assert isinstance(engine, AsyncNeo4jRESTEngine)
+    assert engine.base_url == "http://localhost:7474/db/data/"
@@ -10,7 +10,7 @@ def with_engine(test):
         try:
             url = os.environ['NUEVO_TEST_ENGINE']
         except KeyError:
-            raise Exception("Please define NUEVO_TEST_ENGINE with the URL string of the engine used in the test")
+            raise Exception("Please define NUEVO_TEST_ENGINE with the URL string of the engine used in the test (e.g. memory:)")
         engine = create_engine(url)
         engine._clear_database_for_testing()
         return test(*args, engine=engine, **kwargs)
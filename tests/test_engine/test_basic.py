@@ -7,3 +7,21 @@ from . import with_engine
 def test_dummy(engine):
     pass
 
+
+@with_engine
+def test_profile(engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    with engine.profile() as p:
+        v1 = g.vertices.create(p1='string')
+        g.vertices.get(v1.id)
+    
+    report = p.report()
+    assert sorted(report['phases']) == ["build", "decode", "encode", "materialize", "network"]
+    assert report['total'] >= sum(phase['time'] for phase in report['phases'].values())
+    assert "application" in str(p)
+    
+    # a closed profile doesn't change
+    g.vertices.create()
+    assert p.report()['phases'] == report['phases']
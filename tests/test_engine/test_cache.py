@@ -0,0 +1,87 @@
+
+class Clock(object):
+    
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+
+def test_lru():
+    from nuevo.core.cache import ElementCache
+    
+    cache = ElementCache(size=2)
+    cache.put("node", 1, "a")
+    cache.put("node", 2, "b")
+    assert cache.get("node", 1) == "a"
+    # 2 is now the least recently used
+    cache.put("node", 3, "c")
+    assert cache.get("node", 2) is None
+    assert cache.get("node", 1) == "a"
+    assert cache.get("node", 3) == "c"
+    assert len(cache) == 2
+    
+    # peeking doesn't count as a use
+    assert cache.peek("node", 1) == "a"
+    cache.put("node", 4, "d")
+    assert cache.peek("node", 1) is None
+    assert cache.peek("node", 3) == "c"
+    
+    # the type is part of the key
+    cache = ElementCache(size=2)
+    cache.put("node", 3, "c")
+    cache.put("relationship", 3, "r")
+    assert cache.get("node", 3) == "c"
+    assert cache.get("relationship", 3) == "r"
+
+def test_ttl():
+    from nuevo.core.cache import ElementCache
+    
+    clock = Clock()
+    cache = ElementCache(size=10, ttl=5, clock=clock)
+    cache.put("node", 1, "a")
+    clock.now = 3.0
+    cache.put("node", 2, "b")
+    clock.now = 4.0
+    assert cache.get("node", 1) == "a"
+    # a use doesn't extend the ttl
+    clock.now = 6.0
+    assert cache.get("node", 1) is None
+    assert cache.get("node", 2) == "b"
+    clock.now = 9.0
+    assert cache.get("node", 2) is None
+    assert len(cache) == 0
+
+def test_stats():
+    from nuevo.core.cache import ElementCache
+    
+    cache = ElementCache(size=10)
+    assert cache.get("node", 1) is None
+    cache.put("node", 1, "a")
+    assert cache.get("node", 1) == "a"
+    assert cache.get("node", 1) == "a"
+    # invalid contents are evicted and count as a miss
+    assert cache.get("node", 1, valid=lambda c: False) is None
+    assert cache.get("node", 1) is None
+    assert cache.stats() == dict(hits=2, misses=3, size=0, max_size=10)
+
+def test_disabled():
+    from nuevo.core.cache import ElementCache
+    
+    cache = ElementCache(size=0)
+    cache.put("node", 1, "a")
+    assert cache.get("node", 1) is None
+    assert len(cache) == 0
+
+def test_evict():
+    from nuevo.core.cache import ElementCache
+    
+    cache = ElementCache()
+    cache.put("node", 1, "a")
+    cache.put("node", 2, "b")
+    cache.evict("node", 1)
+    cache.evict("node", 3)
+    assert cache.get("node", 1) is None
+    assert cache.get("node", 2) == "b"
+    cache.clear()
+    assert cache.get("node", 2) is None
@@ -222,3 +222,32 @@ def test_delete_by_id_not_exists(engine):
     except NotFoundException:
         pass
 
+
+@with_engine
+def test_create_many(engine):
+    from nuevo.core.graph import Graph
+
+    g = Graph(engine)
+    
+    v1, v2, v3 = g.vertices.create_many([{}, {}, {}])
+    
+    e1, e2 = g.edges.create_many([(v1, "connected_to", v2, dict(p1='caca')),
+                                  (v2.id, "connected_to", v3.id, None)])
+    
+    assert e1['p1'] == 'caca'
+    assert len(e2) == 0
+    assert e1.inV == v2
+    assert e2.outV == v2
+
+@with_engine
+def test_create_many_same_transaction(engine):
+    from nuevo.core.graph import Graph
+
+    g = Graph(engine)
+    
+    with engine.transaction():
+        vs = g.vertices.create_many(dict(p1=i) for i in range(3))
+        es = g.edges.create_many((vs[i], "next", vs[i + 1], {}) for i in range(2))
+    
+    assert list(vs[0].outV("next")) == [vs[1]]
+    assert list(vs[2].inE("next")) == [es[1]]
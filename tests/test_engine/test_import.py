@@ -0,0 +1,42 @@
+import subprocess
+import sys
+import os
+
+from nuevo.core.engine import registry
+
+# generous, it guards against loading every engine or pkg_resources again,
+# not against small regressions
+MAX_IMPORT_SECONDS = 1.0
+
+SCRIPT = """
+import sys, time
+start = time.time()
+import nuevo.core.engine
+elapsed = time.time() - start
+print(elapsed)
+print('pkg_resources' in sys.modules)
+print('nuevo.drivers.neo4j.engine' in sys.modules)
+print('nuevo.drivers.memory.engine' in sys.modules)
+"""
+
+def test_import_time():
+    env = dict(os.environ)
+    lib = os.path.join(os.path.dirname(__file__), '..', '..', 'lib')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [lib, env.get('PYTHONPATH')]))
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT], env=env)
+    elapsed, pkg_resources, neo4j, memory = output.decode().split()
+    assert float(elapsed) < MAX_IMPORT_SECONDS
+    assert pkg_resources == 'False'
+    assert neo4j == 'False'
+    assert memory == 'False'
+
+def test_parse_url():
+    assert registry.parse("neo4j+batch:http://localhost:7474/db/data/") == \
+        ("neo4j", "batch", "http://localhost:7474/db/data/")
+    assert registry.parse("memory:") == ("memory", None, "")
+    assert registry.parse("memory:") is registry.parse("memory:")
+    try:
+        registry.parse("not an engine")
+        assert False
+    except ValueError:
+        pass
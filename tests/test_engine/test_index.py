@@ -74,17 +74,21 @@ def test_get_create(engine):
 
     g = Graph(engine)
 
-    #try:
-    #    i1 = g.indices.get("testidx", Vertex)
-    #    assert False
-    #except NotFoundException:
-    #    pass
+    try:
+        i1 = g.indices.get("testidx", Vertex)
+        assert False
+    except NotFoundException:
+        pass
     
-    #i1 = g.indices.get_create("testidx", Vertex)
+    i1 = g.indices.get_create("testidx", Vertex)
     
-    #i2 = g.indices.get("testidx", Vertex)
+    i2 = g.indices.get("testidx", Vertex)
 
-    #assert i1 == i2
+    assert i1 == i2
+    
+    i3 = g.indices.get_create("testidx", Vertex)
+    
+    assert i1 == i3
 
 @with_engine
 def test_index_delete(engine):
@@ -0,0 +1,79 @@
+from . import with_engine
+
+import json
+import sys
+import os
+import shutil
+import tempfile
+
+def write(directory, name, content):
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+@with_engine
+def test_load(engine):
+    from nuevo.core.graph import Graph
+    from nuevo.core.elements import Vertex
+    from nuevo.core.loader import BulkLoader, read_records
+    
+    g = Graph(engine)
+    directory = tempfile.mkdtemp()
+    try:
+        people = write(directory, "people.jsonl",
+                       "\n".join(json.dumps(dict(id=i, name="p%d" % i)) for i in range(10)))
+        knows = write(directory, "knows.csv",
+                      "out,label,in,since\n" +
+                      "".join("%d,knows,%d,%d\n" % (i, i + 1, 2000 + i) for i in range(9)) +
+                      "8,knows,42,\n")
+        
+        with BulkLoader(engine, index="people", chunk_size=3, max_keys=4) as loader:
+            loader.load_vertices(read_records(people))
+            assert loader.keys.spilled
+            stats = loader.load_edges(read_records(knows))
+            
+            assert stats.vertices == 10
+            assert stats.edges == 9
+            assert stats.skipped == 1
+            
+            v0 = g.vertices.get(loader.keys[0])
+            v1 = g.vertices.get(loader.keys["1"])
+        
+        assert v0["name"] == "p0"
+        edges = list(v0.outE("knows"))
+        assert len(edges) == 1
+        assert edges[0]["since"] == "2000"
+        assert edges[0].inV == v1
+        
+        index = g.indices.get("people", Vertex)
+        assert list(index.lookup("id", 1)) == [v1]
+    finally:
+        shutil.rmtree(directory)
+
+@with_engine
+def test_load_workers(engine):
+    import traceback
+    from nuevo.core.graph import Graph
+    from nuevo.core.loader import BulkLoader
+    g = Graph(engine)
+    
+    with BulkLoader(engine, chunk_size=2, workers=3) as loader:
+        stats = loader.load_vertices( dict(id=i) for i in range(20) )
+        assert stats.vertices == 20 and len(loader.keys) == 20
+        
+        # a failed chunk is rolled back, without undoing the others
+        edges = [ dict(out=i, label="next", **{'in': i + 1}) for i in range(20) ]
+        try:
+            loader.strict = True
+            loader.load_edges(edges)
+            assert False, "Should have thrown!"
+        except KeyError:
+            # with the traceback of the worker
+            frames = traceback.extract_tb(sys.exc_info()[2])
+            assert frames[-1][2] == "_write_edges"
+        
+        written = [ e for i in range(20) for e in g.vertices.get(loader.keys[i]).outE() ]
+        assert len(written) == loader.stats.edges
+        assert all( e.inV.id == loader.keys[e.outV["id"] + 1] for e in written )
+        assert len(written) % 2 == 0 and len(written) < 20
@@ -0,0 +1,222 @@
+import os
+import sys
+import types
+
+def session(**attrs):
+    # nuevo.ogm isn't part of this tree, a stand-in without models is enough
+    if 'nuevo.ogm.model' not in sys.modules:
+        ogm = types.ModuleType('nuevo.ogm')
+        model = types.ModuleType('nuevo.ogm.model')
+        model.Node = type('Node', (object,), dict(_model_registry={}))
+        model.NodeProxy = lambda engine, indices: None
+        ogm.model = model
+        sys.modules['nuevo.ogm'] = ogm
+        sys.modules['nuevo.ogm.model'] = model
+    from nuevo.core.sessions import Session
+    
+    Session.bind(os.environ['NUEVO_TEST_ENGINE'])
+    db = Session()
+    db.engine._clear_database_for_testing()
+    for key, value in attrs.items():
+        setattr(db, key, value)
+    return db
+
+def transactions(engine):
+    """Count the transactions started on engine."""
+    started = []
+    transaction = engine.transaction
+    def counted(nest=True):
+        started.append(nest)
+        return transaction(nest)
+    engine.transaction = counted
+    return started
+
+def test_commit_order():
+    from nuevo.core.graph import Graph
+    from nuevo.core.elements import Vertex
+    db = session()
+    g = Graph(db.engine)
+    
+    index = db.indices.create("people", Vertex)
+    old = g.vertices.create(name='old')
+    
+    started = transactions(db.engine)
+    with db:
+        v1 = db.vertices.create(name='a')
+        v2 = db.vertices.create(name='b')
+        e1 = db.edges.create(v1, "knows", v2)
+        e2 = db.edges.create(v2, "knows", old.id)
+        index.put(v1, "name", "a")
+        assert db.pending and v1.id is None
+    
+    assert not db.pending
+    assert started[:1] == [True]
+    assert g.vertices.get(v1.id)['name'] == 'a'
+    assert list(v1.outE()) == [e1]
+    assert list(v2.outV()) == [old]
+    assert list(index.lookup("name", "a")) == [v1]
+    
+    # the created elements are tracked
+    v1['name'] = 'c'
+    assert db.dirty == [v1]
+    db.commit()
+    assert g.vertices.get(v1.id)['name'] == 'c'
+
+def test_dirty():
+    from nuevo.core.graph import Graph
+    db = session()
+    g = Graph(db.engine)
+    
+    v1 = g.vertices.create(name='a', age=3)
+    v2 = g.vertices.create(name='b')
+    
+    v = db.vertices.get(v1.id)
+    assert db.dirty == []
+    v['name'] = 'c'
+    del v['age']
+    assert db.dirty == [v]
+    assert g.vertices.get(v1.id)['age'] == 3
+    db.vertices.update(v2, name='d')
+    assert sorted( e.id for e in db.dirty ) == [v1.id, v2.id]
+    db.commit()
+    
+    assert sorted(g.vertices.get(v1.id)) == ['name']
+    assert g.vertices.get(v1.id)['name'] == 'c'
+    assert g.vertices.get(v2.id)['name'] == 'd'
+    assert db.dirty == []
+
+def test_delete_order():
+    from nuevo.core.graph import Graph
+    from nuevo.core.exceptions import NotFoundException
+    db = session()
+    g = Graph(db.engine)
+    
+    v1 = g.vertices.create()
+    v2 = g.vertices.create()
+    e1 = g.edges.create(v1, "knows", v2)
+    
+    # the edge goes first, whatever the order of the calls
+    db.vertices.delete(db.vertices.get(v1.id))
+    db.edges.delete(e1)
+    db.commit()
+    
+    assert g.vertices.get(v2.id) == v2
+    try:
+        g.vertices.get(v1.id)
+        assert False, "Should have thrown!"
+    except NotFoundException:
+        pass
+
+def test_delete_pending():
+    from nuevo.core.graph import Graph
+    from nuevo.core.elements import Vertex, Edge
+    db = session()
+    g = Graph(db.engine)
+    
+    people = db.indices.create("people", Vertex)
+    links = db.indices.create("links", Edge)
+    old = g.vertices.create(name='old')
+    
+    v1 = db.vertices.create(name='a')
+    v2 = db.vertices.create(name='b')
+    e1 = db.edges.create(v1, "knows", v2)
+    e2 = db.edges.create(old, "knows", v1)
+    e3 = db.edges.create(v2, "knows", old.id)
+    people.put(v1, "name", "a")
+    links.put(e2, "kind", "x")
+    links.put(e3, "kind", "x")
+    
+    # the pending edges and index entries of v1 go away with it
+    db.vertices.delete(v1)
+    assert db._new == [v2, e3]
+    db.commit()
+    
+    assert v1.id is None and e1.id is None and e2.id is None
+    assert list(v2.outV()) == [old]
+    assert list(old.inE()) == [e3]
+    assert list(links.lookup("kind", "x")) == [e3]
+    assert list(people.lookup("name", "a")) == []
+
+def test_delete_pending_edges_of_existing_vertex():
+    from nuevo.core.graph import Graph
+    from nuevo.core.exceptions import NotFoundException
+    db = session()
+    g = Graph(db.engine)
+    
+    old = g.vertices.create(name='old')
+    v1 = db.vertices.create(name='a')
+    db.edges.create(v1, "knows", old.id)
+    db.edges.create(old, "knows", v1)
+    db.vertices.delete(old)
+    db.commit()
+    
+    assert list(v1.bothE()) == []
+    try:
+        g.vertices.get(old.id)
+        assert False, "Should have thrown!"
+    except NotFoundException:
+        pass
+
+def test_autoflush():
+    from nuevo.core.graph import Graph
+    db = session()
+    g = Graph(db.engine)
+    
+    old = g.vertices.create(name='old')
+    v1 = db.vertices.create(name='a')
+    # reading flushes the pending changes first
+    db.vertices.get(old.id)
+    assert isinstance(v1.id, int)
+    assert not db.pending
+    
+    db.autoflush = False
+    v1 = db.vertices.create(name='a')
+    db.vertices.get(old.id)
+    assert v1.id is None and db.pending
+    db.flush()
+    assert isinstance(v1.id, int)
+
+def test_rollback():
+    from nuevo.core.graph import Graph
+    db = session()
+    g = Graph(db.engine)
+    
+    old = g.vertices.create(name='old')
+    try:
+        with db:
+            v = db.vertices.get(old.id)
+            v['name'] = 'new'
+            v1 = db.vertices.create(name='a')
+            db.vertices.delete(v)
+            raise KeyError()
+    except KeyError:
+        pass
+    
+    assert not db.pending
+    assert db.dirty == []
+    assert v1.id is None
+    assert g.vertices.get(old.id)['name'] == 'old'
+    db.commit()
+    assert g.vertices.get(old.id)['name'] == 'old'
+
+def test_failed_flush():
+    from nuevo.core.graph import Graph
+    from nuevo.core.exceptions import NuevoException
+    db = session()
+    g = Graph(db.engine)
+    
+    v1 = g.vertices.create()
+    v2 = g.vertices.create()
+    g.edges.create(v1, "knows", v2)
+    
+    v3 = db.vertices.create(name='a')
+    # v1 still has an edge, so the flush fails as a whole
+    db.vertices.delete(v1)
+    try:
+        db.commit()
+        assert False, "Should have thrown!"
+    except NuevoException:
+        pass
+    assert v3.id is None and db.pending
+    db.rollback()
+    assert not db.pending
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import json
+
+def split(data, size):
+    return [ data[i:i + size] for i in range(0, len(data), size) ]
+
+def test_iter_array():
+    from nuevo.drivers.neo4j.streaming import iter_array
+    
+    items = [ 1, -1500.25, 1e10, u"sé", None, True, [], {},
+              {"self": "http://localhost/node/1", "data": {"a": [1, {"b": "x" * 100}]}} ]
+    data = json.dumps(items, ensure_ascii=False).encode('utf-8')
+    for size in (1, 2, 3, 7, 64, len(data)):
+        assert list(iter_array(split(data, size))) == items
+    assert list(iter_array([b" [ ] "])) == []
+
+def test_iter_array_lazy():
+    from nuevo.drivers.neo4j.streaming import iter_array
+    
+    def chunks():
+        yield b'[{"a": 1}, '
+        raise AssertionError("read past the first item")
+    
+    assert next(iter_array(chunks())) == {"a": 1}
+
+def test_iter_array_invalid():
+    from nuevo.drivers.neo4j.streaming import iter_array
+    
+    for data in (b'', b'{"a": 1}', b'[1, 2', b'[{"a": ', b'[1 2]'):
+        try:
+            list(iter_array(split(data, 2)))
+            assert False, data
+        except ValueError:
+            pass
+
+def test_stream_body():
+    from nuevo.drivers.neo4j.rest import Neo4jBatchedREST, BatchLimits
+    from nuevo.drivers.neo4j.commands import Neo4jRESTCommandFactory
+    
+    rest = Neo4jBatchedREST("http://localhost:7474/db/data/", BatchLimits(max_commands=3),
+                            session=object())
+    for i in range(5):
+        rest.execute(Neo4jRESTCommandFactory.create_node(dict(n=i)))
+    
+    sent = []
+    body = b"".join(rest.stream_body(range(5), {}, sent)).decode('utf-8')
+    assert sent == [0, 1, 2]
+    assert [ cmd["body"]["n"] for cmd in json.loads(body) ] == [0, 1, 2]
+    
+    sent = []
+    body = b"".join(rest.stream_body([3, 4], {}, sent)).decode('utf-8')
+    assert [ cmd["id"] for cmd in json.loads(body) ] == [3, 4]
@@ -0,0 +1,88 @@
+
+from . import with_engine
+
+@with_engine
+def test_commit(engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    v1 = g.vertices.create(p1='string')
+    
+    with engine.transaction():
+        g.vertices.update(v1.id, p2=123)
+        v2 = g.vertices.create(p3='otherstring')
+    
+    v3 = g.vertices.get(v1.id)
+    assert 'p1' not in v3
+    assert v3['p2'] == 123
+    assert v2['p3'] == 'otherstring'
+
+@with_engine
+def test_rollback(engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    v1 = g.vertices.create(p1='string')
+    
+    try:
+        with engine.transaction():
+            g.vertices.update(v1.id, p2=123)
+            raise ValueError()
+    except ValueError:
+        pass
+    
+    v2 = g.vertices.get(v1.id)
+    assert v2['p1'] == 'string'
+    assert 'p2' not in v2
+
+@with_engine
+def test_references(engine):
+    from nuevo.core.graph import Graph
+    from nuevo.core.elements import Vertex
+    g = Graph(engine)
+    
+    i1 = g.indices.create("idx1", Vertex)
+    
+    with engine.transaction():
+        v1 = g.vertices.create(p1='string')
+        v2 = g.vertices.create()
+        e1 = g.edges.create(v1, "connected_to", v2)
+        i1.put(v1, "kk", "vv")
+        g.vertices.update(v2, p2=123)
+    
+    assert list(i1.lookup("kk", "vv")) == [v1]
+    assert list(v1.outE()) == [e1]
+    assert g.vertices.get(v2.id)['p2'] == 123
+
+@with_engine
+def test_threads(engine):
+    import threading
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    # a transaction rolled back in a thread leaves the others alone
+    opened = threading.Event()
+    written = threading.Event()
+    created = []
+    def commit():
+        with engine.transaction():
+            opened.wait()
+            created.append(g.vertices.create(name='a'))
+            written.set()
+    def rollback():
+        try:
+            with engine.transaction():
+                opened.set()
+                written.wait()
+                g.vertices.create(name='b')
+                raise ValueError()
+        except ValueError:
+            pass
+    threads = [ threading.Thread(target=commit), threading.Thread(target=rollback) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert g.vertices.get(created[0].id)['name'] == 'a'
+    assert [ c.data['name'] for c in engine.scan_vertices() ] == ['a']
@@ -0,0 +1,66 @@
+from . import with_engine
+
+def build(g):
+    #  0 -> 1 -> 2 -> 3 -> 4
+    #  0 -> 5 -> 4   (label "short")
+    v = [ g.vertices.create(n=i) for i in range(7) ]
+    for i in range(4):
+        g.edges.create(v[i], "next", v[i + 1])
+    g.edges.create(v[0], "short", v[5])
+    g.edges.create(v[5], "short", v[4])
+    return v
+
+@with_engine
+def test_bfs(engine):
+    from nuevo.core.graph import Graph
+    from nuevo.core.traversal import bfs, k_hop
+    
+    g = Graph(engine)
+    v = build(g)
+    
+    found = [ (vertex["n"], depth) for vertex, depth in bfs(v[0]) ]
+    assert found[0] == (0, 0)
+    assert sorted(found[1:3]) == [ (1, 1), (5, 1) ]
+    assert sorted(found[3:5]) == [ (2, 2), (4, 2) ]
+    assert found[5:] == [ (3, 3) ]
+    
+    assert [ vertex["n"] for vertex, _ in bfs(v[0], labels=["next"], max_depth=2) ] == [0, 1, 2]
+    assert [ vertex["n"] for vertex, _ in bfs(v[4], direction="in", labels=["short"]) ] == [4, 5, 0]
+    assert sorted( vertex["n"] for vertex in k_hop(v[2], 1, direction="all") ) == [1, 3]
+    assert list(bfs(v[6])) == [ (v[6], 0) ]
+
+@with_engine
+def test_shortest_path(engine):
+    from nuevo.core.graph import Graph
+    from nuevo.core.traversal import shortest_path
+    
+    g = Graph(engine)
+    v = build(g)
+    
+    assert shortest_path(v[0], v[4]) == [ v[0], v[5], v[4] ]
+    assert shortest_path(v[0], v[4], labels=["next"]) == v[:5]
+    assert shortest_path(v[4], v[0]) is None
+    assert shortest_path(v[4], v[0], direction="all") == [ v[4], v[5], v[0] ]
+    assert shortest_path(v[0], v[3], max_depth=2) is None
+    assert shortest_path(v[0], v[6]) is None
+    assert shortest_path(v[1], v[1]) == [ v[1] ]
+
+def test_id_set():
+    from nuevo.core.traversal import IdSet
+    
+    ids = IdSet([3, 100])
+    assert ids.add(7)
+    assert not ids.add(3)
+    assert 100 in ids and 7 in ids
+    assert 4 not in ids and 100000 not in ids
+    assert len(ids) == 3
+
+def test_id_set_large_ids():
+    from nuevo.core.traversal import IdSet
+    
+    # memory follows the number of ids, not the largest one
+    ids = IdSet([10 ** 9, 10 ** 9 + 1, 2 ** 40])
+    assert 10 ** 9 in ids and 10 ** 9 + 1 in ids and 2 ** 40 in ids
+    assert 10 ** 9 - 1 not in ids and 0 not in ids
+    assert len(ids) == 3
+    assert len(ids._words) == 2
@@ -109,7 +109,7 @@ def test_update_by_id_not_exists(engine):
 def test_delete_by_vertex(engine):
     from nuevo.core.graph import Graph
     from nuevo.core.exceptions import NotFoundException
-
+    
     g = Graph(engine)
     
     v1 = g.vertices.create(p1='string', p2=123)
@@ -126,7 +126,7 @@ def test_delete_by_vertex(engine):
 def test_delete_by_id(engine):
     from nuevo.core.graph import Graph
     from nuevo.core.exceptions import NotFoundException
-
+    
     g = Graph(engine)
     
     v1 = g.vertices.create(p1='string', p2=123)
@@ -143,7 +143,7 @@ def test_delete_by_id(engine):
 def test_delete_by_id_not_exists(engine):
     from nuevo.core.graph import Graph
     from nuevo.core.exceptions import NotFoundException
-
+    
     g = Graph(engine)
     
     try:
@@ -155,7 +155,7 @@ def test_delete_by_id_not_exists(engine):
 @with_engine
 def test_edges_label(engine):
     from nuevo.core.graph import Graph
-
+    
     g = Graph(engine)
     
     v1 = g.vertices.create()
@@ -183,16 +183,16 @@ def test_edges_label(engine):
 @with_engine
 def test_edges_all_labels(engine):
     from nuevo.core.graph import Graph
-
+    
     g = Graph(engine)
     
     v1 = g.vertices.create()
     v2 = g.vertices.create()
     v3 = g.vertices.create()
-
+    
     e1 = g.edges.create(v1, "label1", v2)
     e2 = g.edges.create(v2, "label2", v3)
-
+    
     edgs = v1.outE()
     assert list(edgs) == [e1]
     edgs = v1.inE()
@@ -218,7 +218,7 @@ def test_edges_all_labels(engine):
 @with_engine
 def test_edges_some_labels(engine):
     from nuevo.core.graph import Graph
-
+    
     g = Graph(engine)
     
     v1 = g.vertices.create()
@@ -226,15 +226,15 @@ def test_edges_some_labels(engine):
     v3 = g.vertices.create()
     v4 = g.vertices.create()
     v5 = g.vertices.create()
-
+    
     e1 = g.edges.create(v1, "label1", v3)
     e2 = g.edges.create(v2, "label2", v3)
     e3 = g.edges.create(v3, "label3", v4)
     e4 = g.edges.create(v3, "label4", v5)
-
+    
     edgs = v3.inE("label1")
     assert list(edgs) == [e1]
-
+    
     edgs = v3.outE("label3")
     assert list(edgs) == [e3]
     
@@ -244,7 +244,7 @@ def test_edges_some_labels(engine):
 @with_engine
 def test_vertices_label(engine):
     from nuevo.core.graph import Graph
-
+    
     g = Graph(engine)
     
     v1 = g.vertices.create()
@@ -273,13 +273,13 @@ def test_vertices_label(engine):
 @with_engine
 def test_vertices_all_labels(engine):
     from nuevo.core.graph import Graph
-
+    
     g = Graph(engine)
     
     v1 = g.vertices.create()
     v2 = g.vertices.create()
     v3 = g.vertices.create()
-
+    
     e1 = g.edges.create(v1, "label1", v2)
     e2 = g.edges.create(v2, "label2", v3)
     
@@ -294,7 +294,7 @@ def test_vertices_all_labels(engine):
 @with_engine
 def test_vertices_some_labels(engine):
     from nuevo.core.graph import Graph
-
+    
     g = Graph(engine)
     
     v1 = g.vertices.create()
@@ -302,17 +302,128 @@ def test_vertices_some_labels(engine):
     v3 = g.vertices.create()
     v4 = g.vertices.create()
     v5 = g.vertices.create()
-
+    
     e1 = g.edges.create(v1, "label1", v3)
     e2 = g.edges.create(v2, "label2", v3)
     e3 = g.edges.create(v3, "label3", v4)
     e4 = g.edges.create(v3, "label4", v5)
-
+    
     edgs = v3.inV("label1")
     assert list(edgs) == [v1]
-
+    
     edgs = v3.outV("label3")
     assert list(edgs) == [v4]
     
     edgs = v3.bothV("label2", "label4")
-    assert list(edgs) == [v2, v5]
\ No newline at end of file
+    assert list(edgs) == [v2, v5]
+
+
+@with_engine
+def test_create_many(engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    vs = g.vertices.create_many(dict(p1=i) for i in range(5))
+    
+    assert len(vs) == 5
+    assert [v['p1'] for v in vs] == list(range(5))
+    assert [g.vertices.get(v.id) for v in vs] == vs
+
+@with_engine
+def test_edges_prefetch(engine):
+    from nuevo.core.graph import Graph
+    
+    g = Graph(engine)
+    
+    v1 = g.vertices.create()
+    v2 = g.vertices.create()
+    v3 = g.vertices.create()
+    
+    e1 = g.edges.create(v1, "label1", v2)
+    e2 = g.edges.create(v1, "label1", v3)
+    
+    edgs = v1.outE("label1", prefetch=True)
+    assert edgs == [e1, e2]
+    assert [e.outV for e in edgs] == [v1, v1]
+    assert [e.inV for e in edgs] == [v2, v3]
+    
+    edgs = v3.inE(prefetch=True)
+    assert edgs == [e2]
+    assert edgs[0].outV == v1
+
+@with_engine
+def test_save(engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    v1 = g.vertices.create(p1='string', p2=123, p3=True)
+    v2 = g.vertices.create(p1='other')
+    
+    v1['p1'] = 'changed'
+    v1['p4'] = 456
+    del v1['p2']
+    v1['p3'] = None
+    v2['p2'] = 789
+    assert v1.dirty == set(['p1', 'p2', 'p3', 'p4'])
+    
+    with engine.transaction():
+        v1.save()
+        v2.save()
+    
+    assert not v1.dirty
+    assert dict((k, v1[k]) for k in v1) == dict(p1='changed', p4=456)
+    
+    v3 = g.vertices.get(v1.id)
+    assert dict((k, v3[k]) for k in v3) == dict(p1='changed', p4=456)
+    assert g.vertices.get(v2.id)['p2'] == 789
+
+@with_engine
+def test_save_unsaved_keys(engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    v1 = g.vertices.create(p1='string')
+    v1['x'] = 1
+    del v1['x']
+    v1['new'] = None
+    assert v1.dirty == set(['x', 'new'])
+    assert v1._delta() == ({}, [])
+    v1.save()
+    assert not v1.dirty
+    
+    # computing the delta changes nothing
+    v1['p1'] = None
+    assert v1._delta() == ({}, ['p1'])
+    assert v1._delta() == ({}, ['p1'])
+    v1.save()
+    assert list(g.vertices.get(v1.id)) == []
+
+@with_engine
+def test_hash(engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    v1 = g.vertices.create()
+    v2 = g.vertices.create()
+    e1 = g.edges.create(v1, "connected_to", v2)
+    
+    seen = set([v1, v2, e1])
+    assert g.vertices.get(v1.id) in seen
+    assert g.edges.get(e1.id) in seen
+    assert len(set([v1, g.vertices.get(v1.id), v2])) == 2
+
+@with_engine
+def test_paged_adjacency(engine):
+    from nuevo.core.graph import Graph
+    g = Graph(engine)
+    
+    hub = g.vertices.create()
+    vertices = g.vertices.create_many([ dict(n=i) for i in range(7) ])
+    g.edges.create_many([ (hub, "connected_to", v, None) for v in vertices ])
+    
+    edges = list(hub.outE("connected_to", page_size=3))
+    assert len(edges) == 7
+    assert sorted( e.inV["n"] for e in hub.outE(page_size=3, prefetch=True) ) == list(range(7))
+    assert sorted( v["n"] for v in hub.outV(page_size=3) ) == list(range(7))
+    assert list(vertices[0].inV(page_size=3)) == [hub]
+    assert len(list(hub.bothE(page_size=2))) == 7